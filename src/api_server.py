@@ -0,0 +1,254 @@
+import asyncio
+import hashlib
+import json
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, unquote, urlsplit
+from catalog_stats import RatingStats
+from title_index import TrigramIndex
+
+REASONS = {200: "OK", 201: "Created", 204: "No Content", 304: "Not Modified",
+           400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           409: "Conflict", 413: "Payload Too Large", 500: "Internal Server Error"}
+MAX_BODY = 1024 * 1024
+
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class ApiServer:
+    def __init__(self, storage, host="127.0.0.1", port=8000):
+        """
+        An asyncio HTTP/1.1 server exposing a storage as JSON. Reads are
+        answered from an in-memory snapshot of the catalog; writes go
+        through one writer task that applies them to the storage in a
+        worker thread and then to the snapshot.
+        """
+        self.storage = storage
+        self.host = host
+        self.port = port
+        self._server = None
+        self._queue = None
+        self._writer_task = None
+        # One thread, so storage calls never run concurrently.
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        movies = await loop.run_in_executor(self._executor, self.storage.list_movies)
+        # A private copy: the storage may keep mutating its own dict.
+        self._movies = {title: dict(info) for title, info in movies.items()}
+        self._stats = RatingStats.from_movies(self._movies)
+        self._titles = TrigramIndex(self._movies)
+        self._list_body = None
+        self._list_etag = None
+        self._queue = asyncio.Queue()
+        self._writer_task = asyncio.create_task(self._write_loop())
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self):
+        await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def close(self):
+        self._server.close()
+        await self._server.wait_closed()
+        self._writer_task.cancel()
+        self._executor.shutdown(wait=True)
+
+    # Snapshot -------------------------------------------------------------
+
+    def _list_response(self):
+        if self._list_body is None:
+            self._list_body = json.dumps({"movies": self._movies}).encode("utf-8")
+            self._list_etag = '"' + hashlib.sha1(self._list_body).hexdigest() + '"'
+        return self._list_body, self._list_etag
+
+    def _apply_to_snapshot(self, op, title, payload):
+        if op == "add":
+            self._movies[title] = payload
+            self._stats.add(title, payload["rating"])
+            self._titles.add(title)
+        elif op == "delete":
+            del self._movies[title]
+            self._stats.remove(title)
+            self._titles.remove(title)
+        elif op == "update":
+            self._movies[title]["rating"] = payload["rating"]
+            self._stats.update(title, payload["rating"])
+        self._list_body = None
+
+    async def _write_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            op, title, payload, future = await self._queue.get()
+            try:
+                if op == "add":
+                    call = (self.storage.add_movie, title, payload["year"], payload["rating"], payload["poster"])
+                elif op == "delete":
+                    call = (self.storage.delete_movie, title)
+                else:
+                    call = (self.storage.update_movie, title, payload["rating"])
+                await loop.run_in_executor(self._executor, *call)
+                self._apply_to_snapshot(op, title, payload)
+                future.set_result(None)
+            except Exception as e:
+                future.set_exception(e)
+
+    async def _write(self, op, title, payload=None):
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((op, title, payload, future))
+        try:
+            await future
+        except ValueError as e:
+            status = 409 if op == "add" else 404
+            raise HttpError(status, str(e))
+
+    # HTTP -----------------------------------------------------------------
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                    break
+                request_line, *header_lines = head.decode("latin-1").split("\r\n")
+                try:
+                    method, target, version = request_line.split(" ", 2)
+                except ValueError:
+                    break
+                headers = {}
+                for line in header_lines:
+                    name, _, value = line.partition(":")
+                    if name:
+                        headers[name.strip().lower()] = value.strip()
+                try:
+                    length = int(headers.get("content-length", "0") or 0)
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    # The body cannot be found, so the connection cannot go on.
+                    await self._send(writer, 400, {"error": "Invalid Content-Length"}, keep_alive=False)
+                    break
+                if length > MAX_BODY:
+                    await self._send(writer, 413, {"error": "Request body too large"}, keep_alive=False)
+                    break
+                body = await reader.readexactly(length) if length else b""
+                connection = headers.get("connection", "").lower()
+                keep_alive = connection != "close" and (version == "HTTP/1.1" or connection == "keep-alive")
+                try:
+                    status, payload, extra = await self._route(method, target, headers, body)
+                except HttpError as e:
+                    status, payload, extra = e.status, {"error": str(e)}, {}
+                except Exception as e:
+                    status, payload, extra = 500, {"error": str(e)}, {}
+                await self._send(writer, status, payload, extra, keep_alive)
+                if not keep_alive:
+                    break
+        finally:
+            writer.close()
+
+    async def _send(self, writer, status, payload, extra=None, keep_alive=True):
+        if payload is None:
+            body = b""
+        elif isinstance(payload, bytes):
+            body = payload
+        else:
+            body = json.dumps(payload).encode("utf-8")
+        lines = [f"HTTP/1.1 {status} {REASONS.get(status, 'Unknown')}",
+                 f"Content-Length: {len(body)}",
+                 "Connection: " + ("keep-alive" if keep_alive else "close")]
+        if body:
+            lines.append("Content-Type: application/json")
+        lines.extend(f"{name}: {value}" for name, value in (extra or {}).items())
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+        await writer.drain()
+
+    @staticmethod
+    def _json_body(body):
+        try:
+            data = json.loads(body or b"{}")
+        except ValueError:
+            raise HttpError(400, "Body must be JSON")
+        if not isinstance(data, dict):
+            raise HttpError(400, "Body must be a JSON object")
+        return data
+
+    @staticmethod
+    def _not_modified(headers, etag):
+        return etag in [tag.strip() for tag in headers.get("if-none-match", "").split(",")]
+
+    async def _route(self, method, target, headers, body):
+        url = urlsplit(target)
+        path = url.path.rstrip("/") or "/"
+        query = parse_qs(url.query)
+        if path == "/movies":
+            if method == "GET":
+                payload, etag = self._list_response()
+                if self._not_modified(headers, etag):
+                    return 304, None, {"ETag": etag}
+                return 200, payload, {"ETag": etag}
+            if method == "POST":
+                data = self._json_body(body)
+                try:
+                    title = str(data["title"])
+                    movie = {"rating": float(data["rating"]), "year": int(data["year"]),
+                             "poster": str(data.get("poster", ""))}
+                except (KeyError, TypeError, ValueError):
+                    raise HttpError(400, "Expected title, year and rating")
+                await self._write("add", title, movie)
+                return 201, {title: movie}, {}
+            raise HttpError(405, "Method not allowed")
+        if path == "/movies/search":
+            if method != "GET":
+                raise HttpError(405, "Method not allowed")
+            text = query.get("q", [""])[0]
+            _, list_etag = self._list_response()
+            etag = list_etag[:-1] + "-" + hashlib.sha1(text.encode("utf-8")).hexdigest()[:12] + '"'
+            if self._not_modified(headers, etag):
+                return 304, None, {"ETag": etag}
+            found = {title: self._movies[title] for title in self._titles.search(text)}
+            return 200, {"movies": found}, {"ETag": etag}
+        if path == "/stats":
+            if method != "GET":
+                raise HttpError(405, "Method not allowed")
+            stats = self._stats.summary()
+            if stats:
+                stats["best"] = {"title": stats["best"][0], "rating": stats["best"][1]}
+                stats["worst"] = {"title": stats["worst"][0], "rating": stats["worst"][1]}
+            return 200, {"stats": stats}, {}
+        if path.startswith("/movies/"):
+            title = unquote(path[len("/movies/"):])
+            if method == "GET":
+                if title not in self._movies:
+                    raise HttpError(404, f"Movie '{title}' not found!")
+                return 200, {title: self._movies[title]}, {}
+            if method in ("PATCH", "PUT"):
+                data = self._json_body(body)
+                try:
+                    rating = float(data["rating"])
+                except (KeyError, TypeError, ValueError):
+                    raise HttpError(400, "Expected rating")
+                await self._write("update", title, {"rating": rating})
+                return 200, {title: self._movies[title]}, {}
+            if method == "DELETE":
+                await self._write("delete", title)
+                return 204, None, {}
+            raise HttpError(405, "Method not allowed")
+        raise HttpError(404, "Not found")
+
+
+def run_server(storage, host="127.0.0.1", port=8000):
+    """
+    Serves the storage until interrupted.
+    """
+    server = ApiServer(storage, host, port)
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
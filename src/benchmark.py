@@ -0,0 +1,195 @@
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from site_generator import SiteGenerator
+from storage_binary import StorageBinary
+from storage_csv import StorageCsv
+from storage_json import StorageJson
+from storage_sqlite import StorageSqlite
+
+WORDS = ("the", "last", "night", "of", "dark", "star", "love", "city", "war", "king",
+         "return", "lost", "girl", "man", "secret", "dead", "house", "blood", "river",
+         "summer", "ghost", "american", "little", "world", "life", "black", "story")
+
+# Each factory gets a directory and returns a fresh storage in it.
+BACKENDS = {
+    "json": lambda directory: StorageJson(os.path.join(directory, "movies.json")),
+    "json-cached": lambda directory: StorageJson(os.path.join(directory, "movies.json"), cache=True),
+    "json-journal": lambda directory: StorageJson(os.path.join(directory, "movies.json"),
+                                                  cache=True, journal=True),
+    "csv": lambda directory: StorageCsv(os.path.join(directory, "movies.csv")),
+    "csv-indexed": lambda directory: StorageCsv(os.path.join(directory, "movies.csv"), indexed=True),
+    "sqlite": lambda directory: StorageSqlite(os.path.join(directory, "movies.db")),
+    "binary": lambda directory: StorageBinary(os.path.join(directory, "movies.bin")),
+}
+
+TEMPLATE = ("<html><head><title>__TEMPLATE_TITLE__</title></head>"
+            "<body><ol>__TEMPLATE_MOVIE_GRID__</ol></body></html>")
+
+
+def synthetic_movies(count, seed=0):
+    """
+    Yields count (title, year, rating, poster) tuples with title lengths
+    and poster URLs resembling OMDb data.
+    """
+    rng = random.Random(seed)
+    alphabet = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789"
+    for number in range(count):
+        words = rng.choices(WORDS, k=rng.randint(1, 6))
+        title = " ".join(words).title() + f" {number}"
+        year = rng.randint(1920, 2025)
+        rating = round(rng.uniform(1.0, 9.9), 1)
+        poster = ("https://m.media-amazon.com/images/M/MV5B"
+                  + "".join(rng.choices(alphabet, k=40)) + "._V1_SX300.jpg")
+        yield title, year, rating, poster
+
+
+def _operations(storage, directory, sample_title):
+    """
+    Returns (name, callable) pairs for every measured operation. The
+    mutations run as add -> update -> delete so each round leaves the
+    catalog as it found it.
+    """
+    counter = iter(range(10 ** 9))
+    added = []
+
+    def add():
+        title = f"Benchmark Movie {next(counter)}"
+        storage.add_movie(title, 2024, 5.0, "https://example.com/poster.jpg")
+        added.append(title)
+
+    def update():
+        storage.update_movie(added[-1], 6.5)
+
+    def delete():
+        storage.delete_movie(added.pop())
+
+    template_file = os.path.join(directory, "template.html")
+    with open(template_file, "w", encoding="utf-8") as f:
+        f.write(TEMPLATE)
+    generator = SiteGenerator(template_file, os.path.join(directory, "index.html"))
+    query = sample_title.split()[0].lower()
+    return [
+        ("list_movies", storage.list_movies),
+        ("add_movie", add),
+        ("update_movie", update),
+        ("delete_movie", delete),
+        ("search", lambda: storage.search_movies(query)),
+        ("sorted_by_rating", lambda: storage.sorted_movies("rating")),
+        ("top_20_by_rating", lambda: storage.sorted_movies("rating", limit=20)),
+        ("stats", storage.movie_stats),
+        ("random_movie", storage.random_movie),
+        ("generate_website", lambda: generator.generate(storage.iter_movies())),
+    ]
+
+
+def _measure(function, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    tracemalloc.start()
+    try:
+        function()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return best, peak
+
+
+def run_benchmarks(sizes, backends, repeat=3, seed=0):
+    """
+    Seeds every backend with synthetic catalogs of the given sizes and
+    times each operation (best of repeat runs) plus one traced run for
+    the peak memory. Returns a list of result dictionaries.
+    """
+    results = []
+    for size in sizes:
+        movies = list(synthetic_movies(size, seed))
+        for backend in backends:
+            directory = tempfile.mkdtemp(prefix="movie-bench-")
+            try:
+                storage = BACKENDS[backend](directory)
+                storage.add_movies(movies)
+                sample_title = movies[0][0] if movies else "none"
+                for operation, function in _operations(storage, directory, sample_title):
+                    seconds, peak = _measure(function, repeat)
+                    results.append({"backend": backend, "size": size, "operation": operation,
+                                    "seconds": seconds, "peak_bytes": peak})
+                if hasattr(storage, "close"):
+                    storage.close()
+            finally:
+                shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+
+def compare(baseline, results, threshold=0.25, min_seconds=0.001):
+    """
+    Returns the results that are more than threshold (a fraction) slower
+    than the matching baseline entry. Timings below min_seconds in both
+    runs are ignored as noise.
+    """
+    previous = {(entry["backend"], entry["size"], entry["operation"]): entry
+                for entry in baseline}
+    regressions = []
+    for entry in results:
+        old = previous.get((entry["backend"], entry["size"], entry["operation"]))
+        if old is None or max(old["seconds"], entry["seconds"]) < min_seconds:
+            continue
+        if entry["seconds"] > old["seconds"] * (1 + threshold):
+            regressions.append({**entry, "baseline_seconds": old["seconds"]})
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the movie storage backends.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 100000, 1000000])
+    parser.add_argument("--backends", nargs="+", choices=sorted(BACKENDS), default=list(BACKENDS))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="where to save the run (default bench_results.json, "
+                                         "or bench_latest.json with --compare)")
+    parser.add_argument("--compare", metavar="BASELINE", help="flag regressions against a saved run")
+    parser.add_argument("--threshold", type=float, default=0.25)
+    args = parser.parse_args(argv)
+    if args.output is None:
+        args.output = "bench_latest.json" if args.compare else "bench_results.json"
+    if args.compare and os.path.abspath(args.output) == os.path.abspath(args.compare):
+        parser.error("--output must not overwrite the --compare baseline")
+
+    baseline = None
+    if args.compare:
+        # Read before the run, so a bad path fails fast.
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+    results = run_benchmarks(args.sizes, args.backends, args.repeat)
+    report = {
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=4)
+    for entry in results:
+        print(f"{entry['backend']:>13} {entry['size']:>8} {entry['operation']:<18}"
+              f"{entry['seconds'] * 1000:10.3f} ms {entry['peak_bytes'] / 1024:10.1f} KiB")
+    if baseline is not None:
+        regressions = compare(baseline, results, args.threshold)
+        for entry in regressions:
+            print(f"REGRESSION {entry['backend']} {entry['size']} {entry['operation']}: "
+                  f"{entry['baseline_seconds'] * 1000:.3f} ms -> {entry['seconds'] * 1000:.3f} ms")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
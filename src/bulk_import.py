@@ -0,0 +1,148 @@
+import csv
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from omdb_client import normalize_title, parse_movie
+
+# The error fetch_with_retries() reports once the bucket's limit is used up.
+BUDGET_EXHAUSTED = "Request budget exhausted"
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None, limit=None):
+        """
+        Allows rate acquisitions per second on average, with bursts of up
+        to capacity (defaults to rate), and at most limit in total if set.
+        """
+        self.rate = rate
+        self.capacity = capacity or max(1, rate)
+        self.limit = limit
+        self.acquired = 0
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Blocks until a token is available and takes it. Returns False
+        without waiting once limit tokens have been handed out.
+        """
+        while True:
+            with self._lock:
+                if self.limit is not None and self.acquired >= self.limit:
+                    return False
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    self.acquired += 1
+                    return True
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def fetch_with_retries(client, bucket, title, retries=3, backoff=0.5, use_cache=True):
+    """
+    Fetches a title with a token from bucket per request. Network errors,
+    5xx and 429 answers are retried with exponential backoff. Returns
+    (data, error), error being None on success.
+    """
+    for attempt in range(retries + 1):
+        if not bucket.acquire():
+            return None, BUDGET_EXHAUSTED
+        try:
+            return client.fetch_movie(title, use_cache), None
+        except requests.RequestException as e:
+            response = getattr(e, "response", None)
+            status = response.status_code if response is not None else None
+            retryable = status is None or status >= 500 or status == 429
+            if not retryable or attempt == retries:
+                return None, str(e)
+            time.sleep(backoff * 2 ** attempt)
+
+
+def read_titles(file_path):
+    """
+    Reads movie titles from a text file (one per line, "#" starts a
+    comment) or a CSV file with a "title" column (else the first column).
+    Titles repeated up to case and spacing are only returned once.
+    """
+    titles = []
+    with open(file_path, 'r', newline='', encoding='utf-8') as f:
+        if file_path.endswith(".csv"):
+            rows = list(csv.reader(f))
+            column = 0
+            if rows and "title" in [cell.strip().lower() for cell in rows[0]]:
+                column = [cell.strip().lower() for cell in rows[0]].index("title")
+                rows = rows[1:]
+            titles = [row[column] for row in rows if len(row) > column]
+        else:
+            titles = [line for line in f if not line.lstrip().startswith("#")]
+    seen = set()
+    result = []
+    for title in titles:
+        title = title.strip()
+        key = normalize_title(title)
+        if title and key not in seen:
+            seen.add(key)
+            result.append(title)
+    return result
+
+
+class BulkImporter:
+    def __init__(self, client, storage, max_workers=8, rate=10, retries=3, backoff=0.5):
+        """
+        Resolves titles against OMDb with up to max_workers requests in
+        flight and at most rate requests per second. Network errors, 5xx
+        and 429 answers are retried with exponential backoff.
+        """
+        self.client = client
+        self.storage = storage
+        self.max_workers = max_workers
+        self.bucket = TokenBucket(rate)
+        self.retries = retries
+        self.backoff = backoff
+
+    def run(self, titles):
+        """
+        Imports the titles and returns a report with one dictionary per
+        title: {"title": ..., "status": "added"|"skipped"|"failed",
+        "message": ...}. All new movies are stored in a single write.
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            results = list(executor.map(self._resolve, titles))
+        existing = self.storage.list_movies()
+        added = set()
+        report = []
+        new_movies = []
+        for title, movie, error in results:
+            if error:
+                report.append({"title": title, "status": "failed", "message": error})
+            elif movie[0] in existing or movie[0] in added:
+                # Different inputs can resolve to the same OMDb title.
+                report.append({"title": title, "status": "skipped",
+                               "message": f"Movie '{movie[0]}' already exists!"})
+            else:
+                added.add(movie[0])
+                new_movies.append(movie)
+                report.append({"title": title, "status": "added", "message": movie[0]})
+        if new_movies:
+            self.storage.add_movies(new_movies)
+        return report
+
+    def _resolve(self, title):
+        """
+        Returns (title, movie, error) where movie is a (title, year,
+        rating, poster) tuple on success.
+        """
+        data, error = fetch_with_retries(self.client, self.bucket, title, self.retries, self.backoff)
+        if error:
+            return title, None, error
+        if data.get("Response") == "False":
+            return title, None, data.get("Error", "Movie not found")
+        try:
+            return title, parse_movie(data, title), None
+        except ValueError as e:
+            return title, None, f"Invalid OMDb data: {e}"
@@ -0,0 +1,205 @@
+import heapq
+import statistics
+import sys
+from array import array
+from collections.abc import Mapping
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def column_stats(ratings):
+    """
+    Returns (average, median, best, worst) for a non-empty array of
+    ratings, with best and worst as the positions of the first highest
+    and lowest rating.
+    """
+    if numpy is not None:
+        values = numpy.frombuffer(ratings, dtype=ratings.typecode)
+        return (float(values.mean()), float(numpy.median(values)),
+                int(values.argmax()), int(values.argmin()))
+    positions = range(len(ratings))
+    # max()/min() keep the first of equal ratings, like argmax.
+    return (statistics.fmean(ratings), statistics.median(ratings),
+            max(positions, key=ratings.__getitem__), min(positions, key=ratings.__getitem__))
+
+
+def sort_positions(column, reverse=True, limit=None, offset=0):
+    """
+    Returns the positions of an array column in sorted order, keeping
+    equal values in their original order. limit and offset select a page.
+    """
+    if numpy is not None:
+        values = numpy.frombuffer(column, dtype=column.typecode)
+        # Negating keeps ties in listing order, unlike reversing.
+        order = numpy.argsort(-values if reverse else values, kind="stable")
+        end = None if limit is None else offset + limit
+        return order[offset:end].tolist()
+    positions = range(len(column))
+    if limit is None:
+        return sorted(positions, key=column.__getitem__, reverse=reverse)[offset:]
+    select = heapq.nlargest if reverse else heapq.nsmallest
+    return select(offset + limit, positions, key=column.__getitem__)[offset:]
+
+
+class Catalog(Mapping):
+    def __init__(self):
+        """
+        A compact, read-only catalog. Titles are kept in an interned list,
+        ratings and years in array columns and all posters in one string
+        with an offset column, instead of a dictionary per movie. It reads
+        like a list_movies() dictionary: catalog[title] builds the
+        {"rating", "year", "poster"} dictionary on demand. Use from_rows()
+        or from_movies() to create one.
+        """
+        self.titles = []
+        self.ratings = array("d")
+        self.years = array("i")
+        self._posters = ""
+        self._poster_ends = array("Q")
+        # title -> position, only built once a title is looked up.
+        self._positions = None
+
+    @classmethod
+    def from_rows(cls, rows):
+        """
+        Builds a catalog from (title, rating, year, poster) tuples in
+        listing order. A repeated title replaces the earlier row but keeps
+        its position, like assigning into a dictionary does.
+        """
+        catalog = cls()
+        posters = []
+        positions = {}
+        for title, rating, year, poster in rows:
+            position = positions.get(title)
+            if position is not None:
+                catalog.ratings[position] = rating
+                catalog.years[position] = year
+                posters[position] = poster
+                continue
+            title = sys.intern(title)
+            positions[title] = len(catalog.titles)
+            catalog.titles.append(title)
+            catalog.ratings.append(rating)
+            catalog.years.append(year)
+            posters.append(poster)
+        end = 0
+        for poster in posters:
+            end += len(poster)
+            catalog._poster_ends.append(end)
+        catalog._posters = "".join(posters)
+        return catalog
+
+    @classmethod
+    def from_movies(cls, movies):
+        """
+        Builds a catalog from a list_movies() dictionary.
+        """
+        return cls.from_rows((title, info["rating"], info["year"], info.get("poster") or "")
+                             for title, info in movies.items())
+
+    def __len__(self):
+        return len(self.titles)
+
+    def __iter__(self):
+        return iter(self.titles)
+
+    def _lookup(self):
+        if self._positions is None:
+            self._positions = {title: position for position, title in enumerate(self.titles)}
+        return self._positions
+
+    def __contains__(self, title):
+        return title in self._lookup()
+
+    def __getitem__(self, title):
+        return self._info(self._lookup()[title])
+
+    def poster(self, position):
+        start = self._poster_ends[position - 1] if position else 0
+        return self._posters[start:self._poster_ends[position]]
+
+    def _info(self, position):
+        return {"rating": self.ratings[position], "year": self.years[position],
+                "poster": self.poster(position)}
+
+    def rows(self, positions=None):
+        """
+        Yields (title, info) pairs for the given positions, or for the
+        whole catalog in listing order.
+        """
+        if positions is None:
+            positions = range(len(self.titles))
+        for position in positions:
+            yield self.titles[position], self._info(position)
+
+    def _column(self, key):
+        if key == "rating":
+            return self.ratings
+        if key == "year":
+            return self.years
+        raise ValueError(f"Cannot sort by '{key}'")
+
+    # The operations below work on whole columns, with NumPy if installed.
+
+    def stats(self):
+        """
+        Returns the rating statistics as described in
+        catalog_stats.compute_stats(), or None for an empty catalog.
+        """
+        if not self.titles:
+            return None
+        average, median, best, worst = column_stats(self.ratings)
+        return {
+            "count": len(self.titles),
+            "average": average,
+            "median": median,
+            "best": (self.titles[best], self.ratings[best]),
+            "worst": (self.titles[worst], self.ratings[worst]),
+        }
+
+    def sorted_positions(self, key="rating", reverse=True, limit=None, offset=0):
+        """
+        Returns the positions of the movies sorted by "rating" or "year".
+        Movies with equal values keep their listing order.
+        """
+        return sort_positions(self._column(key), reverse, limit, offset)
+
+    def sorted_movies(self, key="rating", reverse=True, limit=None, offset=0):
+        """
+        Same result as IStorage.sorted_movies().
+        """
+        return list(self.rows(self.sorted_positions(key, reverse, limit, offset)))
+
+    def filter_positions(self, min_rating=None, max_rating=None, min_year=None, max_year=None):
+        """
+        Returns the positions, in listing order, of the movies within the
+        given inclusive bounds. Bounds left as None are not checked.
+        """
+        bounds = [(self.ratings, min_rating, max_rating), (self.years, min_year, max_year)]
+        if numpy is not None:
+            mask = numpy.ones(len(self.titles), dtype=bool)
+            for column, low, high in bounds:
+                values = numpy.frombuffer(column, dtype=column.typecode)
+                if low is not None:
+                    mask &= values >= low
+                if high is not None:
+                    mask &= values <= high
+            return numpy.flatnonzero(mask).tolist()
+        positions = range(len(self.titles))
+        for column, low, high in bounds:
+            if low is not None:
+                positions = [p for p in positions if column[p] >= low]
+            if high is not None:
+                positions = [p for p in positions if column[p] <= high]
+        return list(positions)
+
+    def filter(self, min_rating=None, max_rating=None, min_year=None, max_year=None):
+        """
+        Returns a new Catalog with the movies within the given bounds.
+        """
+        positions = self.filter_positions(min_rating, max_rating, min_year, max_year)
+        return Catalog.from_rows((self.titles[p], self.ratings[p], self.years[p], self.poster(p))
+                                 for p in positions)
@@ -0,0 +1,94 @@
+import bisect
+import math
+import statistics
+from fractions import Fraction
+from sorted_index import SortedIndex
+
+
+def compute_stats(movies):
+    """
+    Computes the catalog statistics from a list_movies() dictionary.
+    Returns None for an empty catalog, otherwise a dictionary like:
+    {"count": 2, "average": 8.0, "median": 8.0,
+     "best": ("Titanic", 9.0), "worst": ("Cats", 7.0)}
+    """
+    if not movies:
+        return None
+    ratings = [info["rating"] for info in movies.values()]
+    best = max(movies.items(), key=lambda x: x[1]["rating"])
+    worst = min(movies.items(), key=lambda x: x[1]["rating"])
+    return {
+        "count": len(ratings),
+        "average": statistics.mean(ratings),
+        "median": statistics.median(ratings),
+        "best": (best[0], best[1]["rating"]),
+        "worst": (worst[0], worst[1]["rating"]),
+    }
+
+
+class RatingStats(SortedIndex):
+    def __init__(self):
+        """
+        Running rating statistics that are updated per mutation instead of
+        being recomputed over the whole catalog. The ratings are kept as a
+        SortedIndex, so it doubles as the rating index of a storage.
+        """
+        super().__init__()
+        # An exact sum keeps the average identical to statistics.mean.
+        self._total = Fraction(0)
+
+    @classmethod
+    def from_movies(cls, movies):
+        stats = cls.from_items((title, info["rating"]) for title, info in movies.items())
+        stats._total = sum((Fraction(rating) for rating, seq, title in stats._sorted), Fraction(0))
+        return stats
+
+    def add(self, title, rating):
+        super().add(title, rating)
+        self._total += Fraction(rating)
+
+    def remove(self, title):
+        self._total -= Fraction(self.value(title))
+        super().remove(title)
+
+    def update(self, title, rating):
+        self._total += Fraction(rating) - Fraction(self.value(title))
+        super().update(title, rating)
+
+    def summary(self):
+        """
+        Returns the same dictionary as compute_stats().
+        """
+        count = len(self._sorted)
+        if count == 0:
+            return None
+        middle = count // 2
+        if count % 2:
+            median = self._sorted[middle][0]
+        else:
+            median = (self._sorted[middle - 1][0] + self._sorted[middle][0]) / 2
+        best_rating = self._sorted[-1][0]
+        best = self._sorted[bisect.bisect_left(self._sorted, (best_rating,))]
+        worst = self._sorted[0]
+        return {
+            "count": count,
+            "average": float(self._total / count),
+            "median": median,
+            "best": (best[2], best[0]),
+            "worst": (worst[2], worst[0]),
+        }
+
+    def check_consistency(self, movies):
+        """
+        Returns True if the running statistics match a full recomputation
+        over movies.
+        """
+        expected = compute_stats(movies)
+        actual = self.summary()
+        if expected is None or actual is None:
+            return expected is actual
+        return (actual["count"] == expected["count"]
+                and math.isclose(actual["average"], expected["average"])
+                and math.isclose(actual["median"], expected["median"])
+                and actual["best"] == expected["best"]
+                and actual["worst"] == expected["worst"])
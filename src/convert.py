@@ -0,0 +1,355 @@
+import argparse
+import csv
+import json
+import os
+import re
+import sys
+from contextlib import ExitStack, contextmanager
+from file_lock import replace_file, temp_file
+from storage_csv import HEADER, coerce_numbers
+
+# Bytes read from the source at a time.
+CHUNK_SIZE = 64 * 1024
+# A single JSON record larger than this is treated as damage instead of
+# being buffered until the end of the file.
+MAX_RECORD_SIZE = 16 * 1024 * 1024
+# Movies handed to a database target per add_movies() call.
+BATCH_SIZE = 10_000
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+
+class _JsonScanner:
+    def __init__(self, f, chunk_size=None):
+        """
+        Reads JSON tokens from a text file a chunk at a time. Only the
+        unconsumed tail of the current chunk is kept, so the memory used
+        does not depend on the size of the file.
+        """
+        self._f = f
+        self._chunk_size = chunk_size or CHUNK_SIZE
+        self._decoder = json.JSONDecoder()
+        self._buf = ""
+        self._pos = 0
+        self._eof = False
+        # Line number at offset _mark of the buffer.
+        self._line = 1
+        self._mark = 0
+
+    def _fill(self):
+        if self._eof:
+            return False
+        chunk = self._f.read(self._chunk_size)
+        if not chunk:
+            self._eof = True
+            return False
+        self.line()
+        self._buf = self._buf[self._pos:] + chunk
+        self._pos = self._mark = 0
+        return True
+
+    def line(self):
+        """
+        Returns the line number of the current position.
+        """
+        self._line += self._buf.count("\n", self._mark, self._pos)
+        self._mark = self._pos
+        return self._line
+
+    def peek(self):
+        """
+        Skips whitespace and returns the next character, "" at the end.
+        """
+        while True:
+            self._pos = _WHITESPACE.match(self._buf, self._pos).end()
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, chars):
+        """
+        Consumes the next character, which must be one of chars.
+        """
+        char = self.peek()
+        if not char or char not in chars:
+            found = repr(char) if char else "end of file"
+            raise ValueError(f"Expected {' or '.join(map(repr, chars))} but found {found} "
+                             f"at line {self.line()}")
+        self._pos += 1
+        return char
+
+    def value(self):
+        """
+        Decodes the next complete JSON value.
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError as e:
+                if len(self._buf) - self._pos < MAX_RECORD_SIZE and self._fill():
+                    continue
+                raise ValueError(f"Invalid JSON at line {self.line()}: {e.msg}") from e
+            # A number that ends with the buffer may go on in the next chunk.
+            if end == len(self._buf) and self._fill():
+                continue
+            self._pos = end
+            return value
+
+
+def read_json(f):
+    """
+    Yields (line, title, record) for each entry of the "movies" object of
+    a StorageJson file, parsing it incrementally. Other top-level keys are
+    skipped.
+    """
+    scanner = _JsonScanner(f)
+    scanner.expect("{")
+    if scanner.peek() == "}":
+        return
+    while True:
+        key = scanner.value()
+        scanner.expect(":")
+        if key != "movies":
+            scanner.value()
+        else:
+            scanner.expect("{")
+            if scanner.peek() == "}":
+                scanner.expect("}")
+            else:
+                while True:
+                    scanner.peek()
+                    line = scanner.line()
+                    title = scanner.value()
+                    scanner.expect(":")
+                    yield line, title, scanner.value()
+                    if scanner.expect(",}") == "}":
+                        break
+        if scanner.expect(",}") == "}":
+            return
+
+
+def read_csv(f):
+    """
+    Yields (line, title, record) for each row of a StorageCsv file, with
+    the record holding the row's raw strings. Rows blanked out by an
+    indexed delete are skipped.
+    """
+    reader = csv.DictReader(f)
+    if reader.fieldnames is None:
+        return
+    missing = [name for name in HEADER if name not in reader.fieldnames]
+    if missing:
+        raise ValueError(f"CSV header lacks {', '.join(missing)}")
+    line = reader.line_num + 1
+    for row in reader:
+        title = row["title"]
+        if title is not None and title.strip():
+            yield line, title, row
+        line = reader.line_num + 1
+
+
+def open_storage(path):
+    """
+    Opens a .bin or SQLite target or source; None for the text formats,
+    which are streamed directly.
+    """
+    if path.endswith(".bin"):
+        from storage_binary import StorageBinary
+        return StorageBinary(path)
+    if path.endswith((".db", ".sqlite", ".sqlite3")):
+        from storage_sqlite import StorageSqlite
+        return StorageSqlite(path)
+    return None
+
+
+def read_records(path):
+    """
+    Yields (line, title, record) for every movie of the file at path. For
+    the database formats line is the row number.
+    """
+    if path.endswith((".json", ".csv")):
+        journal = path + ".journal"
+        if path.endswith(".json") and os.path.exists(journal) and os.path.getsize(journal):
+            raise ValueError(f"'{path}' has a journal; compact it before converting")
+        with open(path, "r", encoding="utf-8", newline="" if path.endswith(".csv") else None) as f:
+            reader = read_csv if path.endswith(".csv") else read_json
+            yield from reader(f)
+        return
+    storage = open_storage(path)
+    if storage is None:
+        raise ValueError(f"Unsupported format: '{path}'")
+    try:
+        for row, (title, info) in enumerate(storage.iter_movies(), 1):
+            yield row, title, info
+    finally:
+        storage.close()
+
+
+def validate(title, record):
+    """
+    Returns (movie, errors) for a record read from any format. The movie
+    is a (title, year, rating, poster) tuple with the numbers coerced like
+    StorageCsv.list_movies() reads them, or None if the record cannot be
+    kept at all.
+    """
+    if not isinstance(title, str) or not title.strip():
+        return None, ["empty title"]
+    if not isinstance(record, dict):
+        return None, ["record is not an object"]
+    rating, year, errors = coerce_numbers(record.get("rating"), record.get("year"))
+    errors = [f"invalid {field} {record.get(field)!r}" for field in errors]
+    poster = record.get("poster")
+    if poster is None:
+        poster = ""
+    elif not isinstance(poster, str):
+        errors.append(f"invalid poster {poster!r}")
+        poster = ""
+    return (title, year, rating, poster), errors
+
+
+@contextmanager
+def _json_writer(path):
+    with temp_file(path) as f:
+        f.write('{\n    "movies": {')
+        first = True
+
+        def write(line, title, year, rating, poster):
+            nonlocal first
+            # The layout json.dump(..., indent=4) gives a StorageJson file.
+            entry = json.dumps({title: {"year": year, "rating": rating, "poster": poster}}, indent=4)
+            f.write(("\n" if first else ",\n") + "    " + entry[2:-2].replace("\n", "\n    "))
+            first = False
+
+        yield write
+        f.write('}' if first else '\n    }')
+        f.write('\n}')
+    replace_file(f.name, path)
+
+
+@contextmanager
+def _csv_writer(path):
+    with temp_file(path, newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(HEADER)
+        yield lambda line, title, year, rating, poster: writer.writerow([title, rating, year, poster])
+    replace_file(f.name, path)
+
+
+@contextmanager
+def _storage_writer(storage, on_duplicate):
+    """
+    Adds movies to a database storage in batches of BATCH_SIZE. Titles the
+    target already has are passed to on_duplicate(line, title).
+    """
+    batch = []
+
+    def flush():
+        movies = [movie for line, movie in batch]
+        try:
+            storage.add_movies(movies)
+        except ValueError:
+            # add_movies() is all or nothing; find the duplicates one by one.
+            for line, movie in batch:
+                try:
+                    storage.add_movie(*movie)
+                except ValueError:
+                    on_duplicate(line, movie[0])
+        batch.clear()
+
+    def write(line, *movie):
+        batch.append((line, movie))
+        if len(batch) >= BATCH_SIZE:
+            flush()
+
+    try:
+        yield write
+        flush()
+    finally:
+        storage.close()
+
+
+def _open_writer(path, on_duplicate):
+    if path.endswith(".json"):
+        return _json_writer(path)
+    if path.endswith(".csv"):
+        return _csv_writer(path)
+    storage = open_storage(path)
+    if storage is None:
+        raise ValueError(f"Unsupported format: '{path}'")
+    return _storage_writer(storage, on_duplicate)
+
+
+def convert(source, target=None, on_error=None):
+    """
+    Streams every movie of source into target, picking both formats from
+    the file extensions (.json, .csv, .bin, .db). A .json or .csv target
+    is replaced atomically once complete; movies are added to a database
+    target. With target None the source is only validated.
+
+    Each record is checked with StorageCsv's coercion rules. A rating or
+    year that does not parse is written as 0, as the app would read it; a
+    record without a usable title is skipped. Every problem is passed to
+    on_error(line, title, message). Returns a dictionary with the number
+    of records "read", "written" and "bad".
+    """
+    counts = {"read": 0, "written": 0, "bad": 0}
+
+    def report(line, title, messages):
+        counts["bad"] += 1
+        if on_error is not None:
+            for message in messages:
+                on_error(line, title, message)
+
+    def on_duplicate(line, title):
+        counts["written"] -= 1
+        report(line, title, ["already in target"])
+
+    with ExitStack() as stack:
+        write = None
+        if target is not None:
+            write = stack.enter_context(_open_writer(target, on_duplicate))
+        for line, title, record in read_records(source):
+            counts["read"] += 1
+            movie, errors = validate(title, record)
+            if errors:
+                report(line, title, errors)
+            if movie is not None and write is not None:
+                write(line, *movie)
+                counts["written"] += 1
+    return counts
+
+
+def run(source, target=None):
+    """
+    Runs convert() and prints each problem and a summary. Returns the
+    exit code: 0 if every record was valid, 1 otherwise.
+    """
+    def on_error(line, title, message):
+        print(f"{source}:{line}: {title!r}: {message}", file=sys.stderr)
+
+    try:
+        counts = convert(source, target, on_error)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    if target is None:
+        print(f"Checked {counts['read']} movies, {counts['bad']} bad")
+    else:
+        print(f"Wrote {counts['written']} of {counts['read']} movies to {target}, "
+              f"{counts['bad']} bad")
+    return 1 if counts["bad"] else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="convert.py",
+                                     description="Stream a catalog into another format")
+    parser.add_argument("source", help=".json, .csv, .bin or .db file")
+    parser.add_argument("target", nargs="?", help="omit to only validate the source")
+    args = parser.parse_args(argv)
+    return run(args.source, args.target)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
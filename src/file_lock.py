@@ -0,0 +1,187 @@
+import os
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # No advisory locks here (e.g. Windows): only threads are serialized.
+    fcntl = None
+
+SHARED = "shared"
+EXCLUSIVE = "exclusive"
+# Bytes of the commit counter at the start of a lock file.
+VERSION_SIZE = 8
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+class FileLock:
+    def __init__(self, lock_path):
+        """
+        An advisory lock on lock_path, shared for readers and exclusive for
+        writers. It is reentrant: nested acquisitions in the owning thread
+        only touch the OS lock when the effective mode changes, so an
+        exclusive section may call code that takes the shared lock.
+        Use lock_for() to get the one instance per file in this process.
+        """
+        self.lock_path = lock_path
+        self._lock = threading.RLock()
+        self._file = None
+        self._held = []
+
+    def _after_fork(self):
+        """
+        Drops the lock state a forked child inherited. Its copy of the lock
+        file shares one open file description with the parent's, which
+        flock() treats as the same holder, so the child opens its own.
+        """
+        self._lock = threading.RLock()
+        self._held = []
+        if self._file is not None:
+            # Closing our copy leaves the parent's flock() in place.
+            self._file.close()
+            self._file = None
+
+    def _mode(self):
+        if not self._held:
+            return None
+        return EXCLUSIVE if EXCLUSIVE in self._held else SHARED
+
+    def _open(self):
+        if self._file is None:
+            # Not "a+b": appending would ignore the seek before a version write.
+            fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o666)
+            self._file = os.fdopen(fd, "r+b", buffering=0)
+        return self._file
+
+    def _flock(self, mode):
+        if fcntl is None:
+            return
+        self._open()
+        operation = {SHARED: fcntl.LOCK_SH, EXCLUSIVE: fcntl.LOCK_EX, None: fcntl.LOCK_UN}[mode]
+        fcntl.flock(self._file.fileno(), operation)
+
+    @contextmanager
+    def _hold(self, mode):
+        with self._lock:
+            before = self._mode()
+            self._held.append(mode)
+            held = self._mode()
+            if held != before:
+                self._flock(held)
+            try:
+                yield
+            finally:
+                self._held.pop()
+                if held != before:
+                    # Downgrade back to shared, or release entirely.
+                    self._flock(before)
+
+    def shared(self):
+        return self._hold(SHARED)
+
+    def exclusive(self):
+        return self._hold(EXCLUSIVE)
+
+    def version(self):
+        """
+        Returns the commit counter kept in the lock file, 0 if no writer
+        has committed yet. Call it with the lock held.
+        """
+        with self._lock:
+            f = self._open()
+            f.seek(0)
+            data = f.read(VERSION_SIZE)
+        return int.from_bytes(data, "little") if len(data) == VERSION_SIZE else 0
+
+    def bump_version(self):
+        """
+        Increments the commit counter. Writers call it under the exclusive
+        lock after every change to the file, so a reader holding the old
+        value sees the change even if the file's size and mtime did not
+        move. Returns the new version.
+        """
+        with self._lock:
+            version = self.version() + 1
+            f = self._open()
+            f.seek(0)
+            f.write(version.to_bytes(VERSION_SIZE, "little"))
+        return version
+
+
+def lock_for(path):
+    """
+    Returns the FileLock guarding path (on path + ".lock"). Every storage
+    on the same file in this process shares it, since two flock()s from
+    one process on different descriptors would deadlock each other.
+    """
+    lock_path = os.path.abspath(path) + ".lock"
+    with _registry_lock:
+        if lock_path not in _registry:
+            _registry[lock_path] = FileLock(lock_path)
+        return _registry[lock_path]
+
+
+def _reset_after_fork():
+    global _registry_lock
+    _registry_lock = threading.Lock()
+    for lock in _registry.values():
+        lock._after_fork()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def write_optimistically(lock, attempt, tries=3):
+    """
+    Calls attempt(), which returns False when the file changed between
+    its read and its commit, up to tries times without blocking readers.
+    A last call runs under the exclusive lock, so a busy file cannot
+    starve the writer.
+    """
+    for _ in range(tries):
+        if attempt():
+            return
+    with lock.exclusive():
+        attempt()
+
+
+@contextmanager
+def temp_file(path, newline=None, binary=False):
+    """
+    Opens a temporary text (or binary) file next to path. On a clean
+    exit it is flushed, fsynced and closed; its name is then ready for
+    replace_file(). On an error it is removed.
+    """
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    if binary:
+        f = open(tmp_path, "wb")
+    else:
+        f = open(tmp_path, "w", newline=newline, encoding="utf-8")
+    try:
+        yield f
+        f.flush()
+        os.fsync(f.fileno())
+        f.close()
+    except BaseException:
+        f.close()
+        os.remove(tmp_path)
+        raise
+
+
+def replace_file(tmp_path, path):
+    """
+    Atomically moves tmp_path over path: readers see the old file or
+    the new one, never a truncated mix.
+    """
+    os.replace(tmp_path, path)
+    if hasattr(os, "O_DIRECTORY"):
+        # Make the rename itself durable.
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
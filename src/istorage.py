@@ -1,7 +1,18 @@
+import heapq
+import itertools
+import random
+import threading
 from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from catalog import Catalog
+from catalog_stats import compute_stats
+from title_index import TrigramIndex
 
 
 class IStorage(ABC):
+    # Id of the thread that has a batch() open on this storage.
+    _batch_owner = None
+
     @abstractmethod
     def list_movies(self):
         """
@@ -33,4 +44,149 @@ class IStorage(ABC):
         """
         Updates the movie’s rating.
         """
-        pass
\ No newline at end of file
+        pass
+
+    def iter_movies(self):
+        """
+        Yields (title, info) pairs in listing order. Backends that can
+        stream rows override this so callers need not hold the catalog.
+        """
+        return iter(self.list_movies().items())
+
+    def list_catalog(self):
+        """
+        Returns the movies as a compact Catalog, which reads like the
+        list_movies() dictionary. Backends that can fill its columns
+        straight from their rows override this.
+        """
+        return Catalog.from_movies(self.list_movies())
+
+    def add_movies(self, movies):
+        """
+        Adds several movies, given as (title, year, rating, poster) tuples.
+        Raises ValueError without adding anything if a title already exists
+        or appears twice. Backends override this to write only once.
+        """
+        self._check_new_titles(self.list_movies(), movies)
+        for title, year, rating, poster in movies:
+            self.add_movie(title, year, rating, poster)
+
+    @staticmethod
+    def _check_new_titles(existing, movies):
+        seen = set()
+        for title, year, rating, poster in movies:
+            if title in existing or title in seen:
+                raise ValueError(f"Movie '{title}' already exists!")
+            seen.add(title)
+
+    @contextmanager
+    def batch(self):
+        """
+        Groups mutations into one transaction:
+
+            with storage.batch():
+                storage.add_movie(...)
+                storage.update_movie(...)
+
+        The data is loaded once and every mutation in the block is checked
+        and applied in memory right away, raising ValueError for a
+        duplicate or missing title as usual; reads in the block see the
+        changes. Leaving the block commits them all with a single write.
+        If the block raises, nothing is written. A batch() opened inside
+        another one joins it. Backends without batching support still run
+        the block, but write each mutation as it happens.
+        """
+        if self._batch_owner == threading.get_ident():
+            yield self
+            return
+        self._begin_batch()
+        self._batch_owner = threading.get_ident()
+        try:
+            yield self
+        except BaseException:
+            self._batch_owner = None
+            self._end_batch(commit=False)
+            raise
+        self._batch_owner = None
+        self._end_batch(commit=True)
+
+    def _check_no_batch(self, operation):
+        """
+        Raises ValueError if this thread has a batch open: operations that
+        rewrite the whole file would commit the batch's working copy.
+        """
+        if self._batch_owner == threading.get_ident():
+            raise ValueError(f"{operation}() cannot run inside batch()")
+
+    def _begin_batch(self):
+        """
+        Starts collecting mutations. By default they are not collected,
+        so each one commits on its own.
+        """
+        pass
+
+    def _end_batch(self, commit):
+        """
+        Writes the batch's changes if commit is true, otherwise drops them.
+        """
+        pass
+
+    # The query methods below fall back to list_movies(). Backends that can
+    # answer them without loading every movie should override them.
+
+    def search_movies(self, query):
+        """
+        Returns the movies whose title contains query (case-insensitive),
+        in the same format as list_movies().
+        """
+        query = query.lower()
+        return {title: info for title, info in self.list_movies().items()
+                if query in title.lower()}
+
+    def suggest_titles(self, query, limit=5):
+        """
+        Returns up to limit titles that look like query, best match first,
+        for catching typos.
+        """
+        index = TrigramIndex(self.list_movies())
+        return [title for title, score in index.fuzzy_search(query, limit)]
+
+    def sorted_movies(self, key="rating", reverse=True, limit=None, offset=0):
+        """
+        Returns a list of (title, info) pairs sorted by "rating" or "year".
+        Movies with equal values keep their listing order. limit and offset
+        select a page of the result.
+        """
+        items = self.list_movies().items()
+        sort_key = lambda x: x[1][key]
+        if limit is None:
+            return sorted(items, key=sort_key, reverse=reverse)[offset:]
+        select = heapq.nlargest if reverse else heapq.nsmallest
+        return select(offset + limit, items, key=sort_key)[offset:]
+
+    def movies_in_range(self, min_rating=None, max_rating=None, min_year=None, max_year=None):
+        """
+        Returns the movies whose rating and year lie within the given
+        inclusive bounds (None leaves a side open), in the same format and
+        order as list_movies().
+        """
+        catalog = self.list_catalog()
+        return dict(catalog.rows(catalog.filter_positions(min_rating, max_rating, min_year, max_year)))
+
+    def movie_stats(self):
+        """
+        Returns the rating statistics as described in
+        catalog_stats.compute_stats(), or None for an empty catalog.
+        """
+        return compute_stats(self.list_movies())
+
+    def random_movie(self):
+        """
+        Returns a random (title, info) pair, or None for an empty catalog.
+        """
+        movies = self.list_movies()
+        if not movies:
+            return None
+        # Skip ahead instead of copying every title into a list.
+        title = next(itertools.islice(movies, random.randrange(len(movies)), None))
+        return title, movies[title]
@@ -1,11 +1,191 @@
-from storage_json import StorageJson
+import argparse
+import os
+import shlex
+import sys
 from movie_app import MovieApp
 
-def main():
-    # Updated file path to point to the data directory.
-    storage = StorageJson("data/movies_data.json")
-    app = MovieApp(storage)
-    app.run()
+def create_storage(file_path, journal=False):
+    """
+    Picks the storage backend from the data file's extension. Backends
+    are imported on demand so a command only loads the one it uses.
+    journal=True appends JSON writes to <file>.journal; a JSON file that
+    already has a journal is always opened with it, so no write is lost.
+    """
+    if file_path.endswith(".csv"):
+        from storage_csv import StorageCsv
+        # The offset index makes duplicate checks, updates and deletes
+        # touch single rows; `compact` drops the rows they leave behind.
+        return StorageCsv(file_path, indexed=True)
+    if file_path.endswith(".bin"):
+        from storage_binary import StorageBinary
+        return StorageBinary(file_path)
+    if file_path.endswith((".db", ".sqlite", ".sqlite3")):
+        from storage_sqlite import StorageSqlite
+        return StorageSqlite(file_path)
+    from storage_json import StorageJson
+    journal = journal or os.path.exists(file_path + ".journal")
+    # The cache keeps one parse alive across the commands of a script.
+    return StorageJson(file_path, cache=True, journal=journal)
+
+def non_negative_int(text):
+    value = int(text)
+    if value < 0:
+        raise argparse.ArgumentTypeError(f"must not be negative: {value}")
+    return value
+
+def add_commands(parser):
+    """
+    Adds the subcommands shared by the command line and script files.
+    """
+    commands = parser.add_subparsers(dest="command")
+    commands.add_parser("menu", help="interactive menu (default)")
+    commands.add_parser("list", help="list all movies")
+    add = commands.add_parser("add", help="add a movie from OMDb")
+    add.add_argument("title")
+    delete = commands.add_parser("delete", help="delete a movie")
+    delete.add_argument("title")
+    update = commands.add_parser("update", help="update a movie's rating")
+    update.add_argument("title")
+    update.add_argument("rating")
+    commands.add_parser("stats", help="show rating statistics")
+    commands.add_parser("random", help="show a random movie")
+    search = commands.add_parser("search", help="search titles")
+    search.add_argument("query")
+    commands.add_parser("sorted", help="list movies sorted by rating")
+    filter_ = commands.add_parser("filter", help="list movies within rating/year bounds")
+    filter_.add_argument("--min-rating", type=float)
+    filter_.add_argument("--max-rating", type=float)
+    filter_.add_argument("--min-year", type=int)
+    filter_.add_argument("--max-year", type=int)
+    generate = commands.add_parser("generate", help="generate the website")
+    generate.add_argument("--per-page", type=int, help="movies per page")
+    generate.add_argument("--mirror-posters", action="store_true",
+                          help="serve local copies of the posters (downloads them)")
+    bulk = commands.add_parser("import", help="import titles from a .txt/.csv file via OMDb")
+    bulk.add_argument("file")
+    refresh = commands.add_parser("refresh", help="re-fetch the stalest ratings from OMDb")
+    refresh.add_argument("--budget", type=non_negative_int, help="max OMDb requests (default 1000)")
+    refresh.add_argument("--max-age", type=float, help="skip movies fetched within this many days")
+    commands.add_parser("compact", help="rewrite the data file without dead rows or journal entries")
+    serve = commands.add_parser("serve", help="serve the catalog as a JSON HTTP API")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=8000)
+    convert = commands.add_parser("convert", help="stream a data file into another format, validating it")
+    convert.add_argument("source")
+    convert.add_argument("target", nargs="?", help="omit to only validate the source")
+    script = commands.add_parser("script", help="run one command per line from a file ('-' for stdin)")
+    script.add_argument("file")
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="main.py", description="My Movies Database")
+    parser.add_argument("-s", "--storage", default="data/movies_data.json",
+                        help="data file; .json, .csv, .db or .bin picks the backend")
+    parser.add_argument("--journal", action="store_true",
+                        help="append JSON writes to a journal instead of rewriting the file")
+    add_commands(parser)
+    return parser
+
+def run_command(app, args):
+    """
+    Runs one parsed subcommand against the app.
+    """
+    command = args.command
+    if command == "list":
+        app._run_command(app._command_list_movies)
+    elif command == "add":
+        app._run_command(app._command_add_movie, args.title)
+    elif command == "delete":
+        app._run_command(app._command_delete_movie, args.title)
+    elif command == "update":
+        app._run_command(app._command_update_movie, args.title, args.rating)
+    elif command == "stats":
+        app._run_command(app._command_stats)
+    elif command == "random":
+        app._run_command(app._command_random_movie)
+    elif command == "search":
+        app._run_command(app._command_search_movie, args.query)
+    elif command == "sorted":
+        app._run_command(app._command_sorted_by_rating)
+    elif command == "filter":
+        app._run_command(app._command_filter_movies, args.min_rating, args.max_rating,
+                         args.min_year, args.max_year)
+    elif command == "generate":
+        app.website_page_size = args.per_page
+        app.mirror_posters = args.mirror_posters
+        app._run_command(app._command_generate_website)
+    elif command == "import":
+        app._run_command(app._command_bulk_import, args.file)
+    elif command == "refresh":
+        app._run_command(app._command_refresh_ratings, args.budget, args.max_age)
+    elif command == "compact":
+        app._run_command(app._command_compact)
+
+def run_script(app, lines):
+    """
+    Runs every non-empty, non-comment line as a subcommand, all in this
+    one process and against the same storage. The script is one batch:
+    its changes are written once, after the last line, and not at all if
+    it is interrupted.
+    """
+    parser = argparse.ArgumentParser(prog="script", add_help=False)
+    add_commands(parser)
+    with app._storage.batch():
+        for number, line in enumerate(lines, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            try:
+                args = parser.parse_args(shlex.split(line))
+            except (SystemExit, ValueError):
+                app._error(f"Error: cannot parse line {number}: {line}")
+                continue
+            if args.command in (None, "menu", "script", "serve", "convert", "compact"):
+                app._error(f"Error: '{args.command}' is not allowed in a script (line {number})")
+                continue
+            run_command(app, args)
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.command == "convert":
+        # Works on the given files, not on the app's data file.
+        from convert import run
+        return run(args.source, args.target)
+    storage = create_storage(args.storage, args.journal)
+    # Opt-in instrumentation: MOVIE_APP_METRICS names the export file
+    # (.json for a snapshot, anything else for Prometheus text) and
+    # MOVIE_APP_PROFILE a folder for per-command cProfile dumps.
+    metrics_file = os.environ.get("MOVIE_APP_METRICS")
+    metrics = None
+    if metrics_file:
+        from metrics import InstrumentedStorage, Metrics
+        metrics = Metrics()
+        storage = InstrumentedStorage(storage, metrics)
+    if args.command == "serve":
+        from api_server import run_server
+        try:
+            run_server(storage, args.host, args.port)
+        finally:
+            if metrics:
+                metrics.write(metrics_file)
+        return 0
+    interactive = args.command in (None, "menu")
+    app = MovieApp(storage, metrics=metrics, profile_dir=os.environ.get("MOVIE_APP_PROFILE"),
+                   interactive=interactive)
+    try:
+        if interactive:
+            app.run()
+        elif args.command == "script":
+            if args.file == "-":
+                run_script(app, sys.stdin)
+            else:
+                with open(args.file, "r", encoding="utf-8") as f:
+                    run_script(app, f)
+        else:
+            run_command(app, args)
+    finally:
+        if metrics:
+            metrics.write(metrics_file)
+    return 1 if app.errors else 0
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
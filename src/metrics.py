@@ -0,0 +1,249 @@
+import bisect
+import json
+import threading
+import time
+from istorage import IStorage
+
+# Latency histogram bucket bounds in seconds.
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    def __init__(self):
+        """
+        A small registry of counters, latency histograms and gauges that
+        can be exported in the Prometheus text format or as JSON.
+        """
+        self._counters = {}
+        self._histograms = {}
+        self._gauges = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(labels):
+        return tuple(sorted((labels or {}).items()))
+
+    def inc(self, name, amount=1, labels=None):
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            key = self._key(labels)
+            series[key] = series.get(key, 0) + amount
+
+    def observe(self, name, seconds, labels=None):
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            key = self._key(labels)
+            if key not in series:
+                series[key] = Histogram()
+            series[key].observe(seconds)
+
+    def gauge(self, name, function, labels=None):
+        """
+        Registers a gauge whose value is read from function() at export.
+        """
+        self._gauges.setdefault(name, {})[self._key(labels)] = function
+
+    def snapshot(self):
+        """
+        Returns all metrics as a JSON-serializable dictionary.
+        """
+        with self._lock:
+            def labelled(series, value):
+                return [{"labels": dict(key), **value(item)} for key, item in series.items()]
+            return {
+                "counters": {name: labelled(series, lambda v: {"value": v})
+                             for name, series in self._counters.items()},
+                "histograms": {name: labelled(series, lambda h: {
+                                   "buckets": dict(zip([str(b) for b in h.buckets] + ["+Inf"], h.counts)),
+                                   "sum": h.sum, "count": h.count})
+                               for name, series in self._histograms.items()},
+                "gauges": {name: labelled(series, lambda f: {"value": f()})
+                           for name, series in self._gauges.items()},
+            }
+
+    def to_prometheus(self):
+        """
+        Returns the metrics in the Prometheus text exposition format.
+        """
+        def label_text(labels, extra=None):
+            pairs = {**labels, **(extra or {})}
+            if not pairs:
+                return ""
+            return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in pairs.items()) + "}"
+
+        snapshot = self.snapshot()
+        lines = []
+        for name, series in snapshot["counters"].items():
+            lines.append(f"# TYPE {name} counter")
+            for entry in series:
+                lines.append(f"{name}{label_text(entry['labels'])} {entry['value']}")
+        for name, series in snapshot["gauges"].items():
+            lines.append(f"# TYPE {name} gauge")
+            for entry in series:
+                lines.append(f"{name}{label_text(entry['labels'])} {entry['value']}")
+        for name, series in snapshot["histograms"].items():
+            lines.append(f"# TYPE {name} histogram")
+            for entry in series:
+                cumulative = 0
+                for bound, count in entry["buckets"].items():
+                    cumulative += count
+                    lines.append(f"{name}_bucket{label_text(entry['labels'], {'le': bound})} {cumulative}")
+                lines.append(f"{name}_sum{label_text(entry['labels'])} {entry['sum']}")
+                lines.append(f"{name}_count{label_text(entry['labels'])} {entry['count']}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, file_path):
+        """
+        Writes a JSON snapshot if file_path ends in .json, otherwise the
+        Prometheus text format.
+        """
+        with open(file_path, "w", encoding="utf-8") as f:
+            if file_path.endswith(".json"):
+                json.dump(self.snapshot(), f, indent=4)
+            else:
+                f.write(self.to_prometheus())
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _hit_ratio(source):
+    total = source.cache_hits + source.cache_misses
+    return source.cache_hits / total if total else 0.0
+
+
+class InstrumentedStorage(IStorage):
+    def __init__(self, storage, metrics):
+        """
+        Wraps any IStorage and records call counts, latencies, errors and,
+        for backends that count them, bytes read and written per method.
+        """
+        self._storage = storage
+        self._metrics = metrics
+        if hasattr(storage, "cache_hits"):
+            metrics.gauge("storage_cache_hits", lambda: storage.cache_hits)
+            metrics.gauge("storage_cache_misses", lambda: storage.cache_misses)
+            metrics.gauge("storage_cache_hit_ratio", lambda: _hit_ratio(storage))
+
+    def __getattr__(self, name):
+        # Backend-specific extras (compact, close, ...) pass straight through.
+        return getattr(self._storage, name)
+
+    def _call(self, method, *args, label=None):
+        storage = self._storage
+        labels = {"method": label or method}
+        read_before = getattr(storage, "bytes_read", 0)
+        written_before = getattr(storage, "bytes_written", 0)
+        start = time.perf_counter()
+        try:
+            return getattr(storage, method)(*args)
+        except Exception:
+            self._metrics.inc("storage_errors_total", labels=labels)
+            raise
+        finally:
+            self._metrics.observe("storage_call_seconds", time.perf_counter() - start, labels)
+            self._metrics.inc("storage_calls_total", labels=labels)
+            read = getattr(storage, "bytes_read", 0) - read_before
+            written = getattr(storage, "bytes_written", 0) - written_before
+            if read:
+                self._metrics.inc("storage_bytes_read_total", read, labels)
+            if written:
+                self._metrics.inc("storage_bytes_written_total", written, labels)
+
+    def list_movies(self):
+        return self._call("list_movies")
+
+    def add_movie(self, title, year, rating, poster):
+        return self._call("add_movie", title, year, rating, poster)
+
+    def delete_movie(self, title):
+        return self._call("delete_movie", title)
+
+    def update_movie(self, title, rating):
+        return self._call("update_movie", title, rating)
+
+    def iter_movies(self):
+        # Measured until the caller has consumed the last row.
+        labels = {"method": "iter_movies"}
+        start = time.perf_counter()
+        try:
+            yield from self._storage.iter_movies()
+        finally:
+            self._metrics.observe("storage_call_seconds", time.perf_counter() - start, labels)
+            self._metrics.inc("storage_calls_total", labels=labels)
+
+    def list_catalog(self):
+        return self._call("list_catalog")
+
+    def add_movies(self, movies):
+        return self._call("add_movies", movies)
+
+    def search_movies(self, query):
+        return self._call("search_movies", query)
+
+    def suggest_titles(self, query, limit=5):
+        return self._call("suggest_titles", query, limit)
+
+    def sorted_movies(self, key="rating", reverse=True, limit=None, offset=0):
+        return self._call("sorted_movies", key, reverse, limit, offset)
+
+    def movies_in_range(self, min_rating=None, max_rating=None, min_year=None, max_year=None):
+        return self._call("movies_in_range", min_rating, max_rating, min_year, max_year)
+
+    def movie_stats(self):
+        return self._call("movie_stats")
+
+    def random_movie(self):
+        return self._call("random_movie")
+
+    # batch() comes from IStorage and drives the wrapped storage's batch;
+    # its commit, the one write of the batch, is measured as "batch".
+    def _begin_batch(self):
+        self._storage._begin_batch()
+
+    def _end_batch(self, commit):
+        self._call("_end_batch", commit, label="batch")
+
+
+class InstrumentedOmdbClient:
+    def __init__(self, client, metrics):
+        """
+        Wraps an OmdbClient and records the latency and outcome of every
+        fetch along with the client's cache hit rate.
+        """
+        self._client = client
+        self._metrics = metrics
+        metrics.gauge("omdb_cache_hits", lambda: client.cache_hits)
+        metrics.gauge("omdb_cache_misses", lambda: client.cache_misses)
+        metrics.gauge("omdb_cache_hit_ratio", lambda: _hit_ratio(client))
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def fetch_movie(self, title, use_cache=True):
+        hits = self._client.cache_hits
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            data = self._client.fetch_movie(title, use_cache)
+            outcome = "found" if data.get("Response") != "False" else "not_found"
+            return data
+        finally:
+            source = "cache" if self._client.cache_hits > hits else "network"
+            labels = {"outcome": outcome, "source": source}
+            self._metrics.observe("omdb_fetch_seconds", time.perf_counter() - start, labels)
+            self._metrics.inc("omdb_fetch_total", labels=labels)
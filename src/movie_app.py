@@ -1,25 +1,70 @@
+import cProfile
 import os
-import random
-import statistics
-import requests
-from dotenv import load_dotenv
+import time
+from site_generator import SiteGenerator
 
-# Load environment variables from .env file.
-load_dotenv()
+# The OMDb client, requests and dotenv are only imported once a command
+# needs the network, so offline commands start fast and need no API key.
 
 class MovieApp:
-    def __init__(self, storage):
+    def __init__(self, storage, metrics=None, profile_dir=None, interactive=True):
         """
         Initialize the MovieApp with a storage that implements IStorage.
+        With a metrics.Metrics registry the OMDb lookups are instrumented;
+        with a profile_dir every menu command is profiled into that folder.
+        With interactive=False commands take their arguments directly and
+        never wait for enter.
         """
         self._storage = storage
-        # Get the API key from environment variables.
-        self.api_key = os.environ.get("OMDB_API_KEY")
-        if not self.api_key:
-            raise ValueError("OMDB_API_KEY not found in environment variables. Please create a .env file with your API key.")
+        self._metrics = metrics
+        self._omdb_client = None
+        self.api_key = None
+        self.profile_dir = profile_dir
+        # Number of profiles dumped so far, to keep their names unique.
+        self._profile_count = 0
+        self.interactive = interactive
+        # Number of commands that reported an error.
+        self.errors = 0
         # Set file paths for the template and the generated website.
         self.template_file = "_static/index_template.html"
         self.website_file = "index_template.html"
+        # Number of movies per generated page; None puts all on one page.
+        self.website_page_size = None
+        # Whether to copy the posters next to the website instead of
+        # linking to the remote images.
+        self.mirror_posters = False
+        # Number of movies shown per page of the sorted view.
+        self.sorted_page_size = 20
+
+    @property
+    def _omdb(self):
+        if self._omdb_client is None:
+            from dotenv import load_dotenv
+            from omdb_client import OmdbClient
+            # Load environment variables from .env file.
+            load_dotenv()
+            # Get the API key from environment variables.
+            self.api_key = os.environ.get("OMDB_API_KEY")
+            if not self.api_key:
+                raise ValueError("OMDB_API_KEY not found in environment variables. Please create a .env file with your API key.")
+            client = OmdbClient(self.api_key, cache_dir="data/omdb_cache")
+            if self._metrics is not None:
+                from metrics import InstrumentedOmdbClient
+                client = InstrumentedOmdbClient(client, self._metrics)
+            self._omdb_client = client
+        return self._omdb_client
+
+    @_omdb.setter
+    def _omdb(self, client):
+        self._omdb_client = client
+
+    def _pause(self, prompt="Press enter to continue"):
+        if self.interactive:
+            input(prompt)
+
+    def _error(self, message):
+        self.errors += 1
+        print(message)
 
     def _command_list_movies(self):
         movies = self._storage.list_movies()
@@ -29,129 +74,248 @@ class MovieApp:
         else:
             for title, info in movies.items():
                 print(f"{title} ({info['year']}), rating: {info['rating']}")
-        input("\nPress enter to continue")
+        self._pause("\nPress enter to continue")
 
-    def _command_add_movie(self):
+    def _command_add_movie(self, title=None):
         print("\nAdd movie:")
-        title = input("Enter movie title: ").strip()
+        if title is None:
+            title = input("Enter movie title: ").strip()
         # Fetch data from the OMDb API.
         try:
-            url = f"http://www.omdbapi.com/?i=tt3896198&apikey={self.api_key}&t={title}"
-            response = requests.get(url)
-            data = response.json()
+            from omdb_client import parse_movie
+            data = self._omdb.fetch_movie(title)
             if data.get("Response") == "False":
-                print(f"Error: {data.get('Error', 'Movie not found')}")
-                input("Press enter to continue")
+                self._error(f"Error: {data.get('Error', 'Movie not found')}")
+                self._pause()
                 return
             # Extract required information.
-            movie_title = data.get("Title", title)
-            movie_year = int(data.get("Year", "0").split("–")[0])
-            movie_rating = float(data.get("imdbRating", 0))
-            movie_poster = data.get("Poster", "")
+            movie_title, movie_year, movie_rating, movie_poster = parse_movie(data, title)
             self._storage.add_movie(movie_title, movie_year, movie_rating, movie_poster)
             print(f"Movie '{movie_title}' added successfully!")
         except Exception as e:
-            print(f"An error occurred: {e}")
-        input("Press enter to continue")
+            self._error(f"An error occurred: {e}")
+        self._pause()
 
-    def _command_delete_movie(self):
+    def _command_delete_movie(self, title=None):
         print("\nDelete movie:")
-        title = input("Enter movie title to delete: ").strip()
+        if title is None:
+            title = input("Enter movie title to delete: ").strip()
         try:
             self._storage.delete_movie(title)
             print(f"Movie '{title}' deleted successfully!")
         except ValueError as e:
-            print(f"Error: {e}")
-        input("Press enter to continue")
+            self._error(f"Error: {e}")
+        self._pause()
 
-    def _command_update_movie(self):
+    def _command_update_movie(self, title=None, rating_str=None):
         print("\nUpdate movie rating:")
-        title = input("Enter movie title: ").strip()
-        rating_str = input("Enter new movie rating: ").strip()
+        if title is None:
+            title = input("Enter movie title: ").strip()
+        if rating_str is None:
+            rating_str = input("Enter new movie rating: ").strip()
         try:
             rating = float(rating_str)
             self._storage.update_movie(title, rating)
             print(f"Movie '{title}' updated to rating {rating}")
         except ValueError as e:
-            print(f"Error: {e}")
-        input("Press enter to continue")
+            self._error(f"Error: {e}")
+        self._pause()
 
     def _command_stats(self):
-        movies = self._storage.list_movies()
+        stats = self._storage.movie_stats()
         print("\nMovie Stats:")
-        if not movies:
+        if not stats:
             print("No movies available!")
         else:
-            ratings = [info["rating"] for info in movies.values()]
-            avg = statistics.mean(ratings)
-            med = statistics.median(ratings)
-            best_movie = max(movies.items(), key=lambda x: x[1]["rating"])
-            worst_movie = min(movies.items(), key=lambda x: x[1]["rating"])
-            print(f"Average rating: {avg:.2f}")
-            print(f"Median rating: {med:.2f}")
-            print(f"Best movie: {best_movie[0]} with rating {best_movie[1]['rating']}")
-            print(f"Worst movie: {worst_movie[0]} with rating {worst_movie[1]['rating']}")
-        input("Press enter to continue")
+            best_title, best_rating = stats["best"]
+            worst_title, worst_rating = stats["worst"]
+            print(f"Average rating: {stats['average']:.2f}")
+            print(f"Median rating: {stats['median']:.2f}")
+            print(f"Best movie: {best_title} with rating {best_rating}")
+            print(f"Worst movie: {worst_title} with rating {worst_rating}")
+        self._pause()
 
     def _command_random_movie(self):
-        movies = self._storage.list_movies()
+        movie = self._storage.random_movie()
         print("\nRandom Movie:")
-        if not movies:
+        if not movie:
             print("No movies available!")
         else:
-            title = random.choice(list(movies.keys()))
-            info = movies[title]
+            title, info = movie
             print(f"{title} ({info['year']}), rating: {info['rating']}")
-        input("Press enter to continue")
+        self._pause()
 
-    def _command_search_movie(self):
+    def _command_search_movie(self, query=None):
         print("\nSearch movie:")
-        query = input("Enter part of movie title: ").strip().lower()
-        movies = self._storage.list_movies()
-        found = False
+        if query is None:
+            query = input("Enter part of movie title: ").strip()
+        movies = self._storage.search_movies(query)
         for title, info in movies.items():
-            if query in title.lower():
-                print(f"{title} ({info['year']}), rating: {info['rating']}")
-                found = True
-        if not found:
+            print(f"{title} ({info['year']}), rating: {info['rating']}")
+        if not movies:
             print("No movies found!")
-        input("Press enter to continue")
+            suggestions = self._storage.suggest_titles(query) if query else []
+            if suggestions:
+                print(f"Did you mean: {', '.join(suggestions)}?")
+        self._pause()
 
     def _command_sorted_by_rating(self):
-        movies = self._storage.list_movies()
         print("\nMovies Sorted by Rating:")
-        sorted_movies = sorted(movies.items(), key=lambda x: x[1]["rating"], reverse=True)
-        for title, info in sorted_movies:
-            print(f"{title} ({info['year']}): {info['rating']}")
-        input("Press enter to continue")
+        size = self.sorted_page_size
+        offset = 0
+        if not self.interactive:
+            # Nobody pages through the output, so sort once instead of
+            # fetching every page separately.
+            for title, info in self._storage.sorted_movies("rating"):
+                print(f"{title} ({info['year']}): {info['rating']}")
+            self._pause()
+            return
+        while True:
+            # One extra row tells whether another page follows.
+            page = self._storage.sorted_movies("rating", limit=size + 1, offset=offset)
+            for title, info in page[:size]:
+                print(f"{title} ({info['year']}): {info['rating']}")
+            if len(page) <= size:
+                break
+            offset += size
+            if input("Press enter for more, q to stop: ").strip().lower() == "q":
+                break
+        self._pause()
+
+    def _command_filter_movies(self, min_rating=None, max_rating=None, min_year=None, max_year=None):
+        print("\nFilter movies:")
+        try:
+            if self.interactive and (min_rating, max_rating, min_year, max_year) == (None,) * 4:
+                prompts = ("Minimum rating", "Maximum rating", "From year", "To year")
+                min_rating, max_rating, min_year, max_year = (
+                    input(f"{prompt} (blank for any): ").strip() or None for prompt in prompts)
+            movies = self._storage.movies_in_range(
+                None if min_rating is None else float(min_rating),
+                None if max_rating is None else float(max_rating),
+                None if min_year is None else int(min_year),
+                None if max_year is None else int(max_year))
+        except ValueError as e:
+            self._error(f"Error: {e}")
+            self._pause()
+            return
+        for title, info in movies.items():
+            print(f"{title} ({info['year']}), rating: {info['rating']}")
+        if not movies:
+            print("No movies found!")
+        self._pause()
 
     def _command_generate_website(self):
-        movies = self._storage.list_movies()
         try:
-            with open(self.template_file, "r", encoding="utf-8") as f:
-                template = f.read()
-            # Replace title placeholder.
-            app_title = "My Movie App"
-            template = template.replace("__TEMPLATE_TITLE__", app_title)
-            # Build the movie grid HTML.
-            grid_html = ""
-            for movie_title, info in movies.items():
-                grid_html += f"""<li class="movie">
-    <h3>{movie_title}</h3>
-    <img src="{info.get('poster', '')}" alt="{movie_title} poster">
-    <p>Year: {info.get('year')}</p>
-    <p>Rating: {info.get('rating')}</p>
-</li>
-"""
-            template = template.replace("__TEMPLATE_MOVIE_GRID__", grid_html)
-            with open(self.website_file, "w", encoding="utf-8") as f:
-                f.write(template)
+            posters = self._mirror_posters() if self.mirror_posters else None
+            generator = SiteGenerator(self.template_file, self.website_file,
+                                      "My Movie App", self.website_page_size, posters)
+            result = generator.generate(self._storage.iter_movies())
             print("Website was generated successfully.")
+            print(f"Pages written: {len(result['written'])}, unchanged: {len(result['unchanged'])}")
+            from site_search import SearchSite
+            search = SearchSite(self.template_file, os.path.dirname(self.website_file) or ".",
+                                "My Movie App", posters=posters)
+            result = search.generate(self._storage.list_catalog())
+            print(f"Search data written: {len(result['written'])}, "
+                  f"unchanged: {len(result['unchanged'])}")
         except Exception as e:
-            print(f"Error generating website: {e}")
-        input("Press enter to continue")
+            self._error(f"Error generating website: {e}")
+        self._pause()
+
+    def _mirror_posters(self):
+        """
+        Downloads the posters into a posters folder next to the website and
+        returns the {url: relative path} mapping for the pages.
+        """
+        from poster_mirror import PosterMirror
+        mirror = PosterMirror(os.path.join(os.path.dirname(self.website_file), "posters"))
+        try:
+            files = mirror.mirror(info.get("poster") for title, info in self._storage.iter_movies())
+        finally:
+            mirror.close()
+        print(f"Posters downloaded: {mirror.downloaded}, unchanged: {mirror.not_modified}, "
+              f"failed: {mirror.failed}")
+        return {url: "posters/" + name for url, name in files.items()}
+
+    def _command_bulk_import(self, file_path=None):
+        print("\nBulk import:")
+        if file_path is None:
+            file_path = input("Enter path of the title list (.txt or .csv): ").strip()
+        try:
+            from bulk_import import BulkImporter, read_titles
+            titles = read_titles(file_path)
+            report = BulkImporter(self._omdb, self._storage).run(titles)
+            for entry in report:
+                print(f"{entry['status']:>7}: {entry['title']} ({entry['message']})")
+            added = sum(1 for entry in report if entry["status"] == "added")
+            print(f"Imported {added} of {len(report)} titles.")
+        except (OSError, ValueError) as e:
+            self._error(f"Error: {e}")
+        self._pause()
+
+    def _command_refresh_ratings(self, budget=None, max_age_days=None):
+        print("\nRefresh ratings:")
+        try:
+            from rating_refresh import DAILY_BUDGET, RatingRefresher, timestamps_path
+            refresher = RatingRefresher(self._omdb, self._storage,
+                                        timestamps_path(self._storage.file_path),
+                                        budget=DAILY_BUDGET if budget is None else budget)
+            report = refresher.run(max_age=(max_age_days or 0) * 24 * 3600)
+            for entry in report:
+                if entry["status"] != "unchanged":
+                    print(f"{entry['status']:>7}: {entry['title']} ({entry['message']})")
+            updated = sum(1 for entry in report if entry["status"] == "updated")
+            print(f"Refreshed {len(report)} movies, {updated} ratings changed.")
+        except (OSError, ValueError) as e:
+            self._error(f"Error: {e}")
+        self._pause()
+
+    def _command_compact(self):
+        print("\nCompact:")
+        compact = getattr(self._storage, "compact", None)
+        if compact is None:
+            self._error("Error: this storage has nothing to compact.")
+        else:
+            try:
+                compact()
+                print(f"Compacted {self._storage.file_path}.")
+            except (OSError, ValueError) as e:
+                self._error(f"Error: {e}")
+        self._pause()
+
+    def _run_command(self, command, *args):
+        """
+        Runs a command, under cProfile if profile_dir is set.
+        """
+        if not self.profile_dir:
+            command(*args)
+            return
+        profiler = cProfile.Profile()
+        try:
+            profiler.runcall(command, *args)
+        finally:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            self._profile_count += 1
+            # The pid and counter keep runs within the same second apart.
+            name = (f"{command.__name__.lstrip('_')}-{time.strftime('%Y%m%d-%H%M%S')}"
+                    f"-{os.getpid()}-{self._profile_count}.prof")
+            profiler.dump_stats(os.path.join(self.profile_dir, name))
 
     def run(self):
+        commands = {
+            '1': self._command_list_movies,
+            '2': self._command_add_movie,
+            '3': self._command_delete_movie,
+            '4': self._command_update_movie,
+            '5': self._command_stats,
+            '6': self._command_random_movie,
+            '7': self._command_search_movie,
+            '8': self._command_sorted_by_rating,
+            '9': self._command_generate_website,
+            '10': self._command_bulk_import,
+            '11': self._command_filter_movies,
+            '12': self._command_refresh_ratings,
+        }
         while True:
             print("\n********** My Movies Database **********\n")
             print("Menu:")
@@ -165,27 +329,15 @@ class MovieApp:
             print("7. Search movie")
             print("8. Movies sorted by rating")
             print("9. Generate website")
-            choice = input("Enter choice (0-9): ").strip()
+            print("10. Bulk import from file (API Fetch)")
+            print("11. Filter movies by rating and year")
+            print("12. Refresh ratings from OMDb (API Fetch)")
+            choice = input("Enter choice (0-12): ").strip()
             if choice == '0':
                 break
-            elif choice == '1':
-                self._command_list_movies()
-            elif choice == '2':
-                self._command_add_movie()
-            elif choice == '3':
-                self._command_delete_movie()
-            elif choice == '4':
-                self._command_update_movie()
-            elif choice == '5':
-                self._command_stats()
-            elif choice == '6':
-                self._command_random_movie()
-            elif choice == '7':
-                self._command_search_movie()
-            elif choice == '8':
-                self._command_sorted_by_rating()
-            elif choice == '9':
-                self._command_generate_website()
-            else:
+            command = commands.get(choice)
+            if command is None:
                 print("Invalid choice. Please try again.")
-                input("Press enter to continue")
\ No newline at end of file
+                self._pause()
+            else:
+                self._run_command(command)
@@ -0,0 +1,111 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+
+OMDB_URL = "http://www.omdbapi.com/"
+
+
+def normalize_title(title):
+    """
+    Returns the cache key for a title: lowercased, with runs of
+    whitespace collapsed.
+    """
+    return " ".join(title.lower().split())
+
+
+def parse_movie(data, title):
+    """
+    Extracts (title, year, rating, poster) from an OMDb response.
+    """
+    movie_title = data.get("Title", title)
+    movie_year = int(data.get("Year", "0").split("–")[0])
+    movie_rating = float(data.get("imdbRating", 0))
+    movie_poster = data.get("Poster", "")
+    return movie_title, movie_year, movie_rating, movie_poster
+
+
+class OmdbClient:
+    def __init__(self, api_key, base_url=OMDB_URL, cache_dir=None, ttl=7 * 24 * 3600,
+                 negative_ttl=24 * 3600, timeout=10, pool_size=10):
+        """
+        Initialize the client. Requests share one pooled keep-alive session.
+        With a cache_dir, responses are kept on disk per normalized title
+        for ttl seconds, and "Movie not found" answers for negative_ttl.
+        """
+        self.api_key = api_key
+        self.base_url = base_url
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.timeout = timeout
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def close(self):
+        self.session.close()
+
+    def fetch_movie(self, title, use_cache=True):
+        """
+        Returns the OMDb response for a title as a dictionary. Raises
+        requests.RequestException on network or HTTP errors.
+        """
+        key = normalize_title(title)
+        if use_cache:
+            cached = self._read_cache(key)
+            if cached is not None:
+                self.cache_hits += 1
+                return cached
+        self.cache_misses += 1
+        response = self.session.get(self.base_url, params={"apikey": self.api_key, "t": title},
+                                    timeout=self.timeout)
+        response.raise_for_status()
+        data = response.json()
+        self._write_cache(key, data)
+        return data
+
+    def _cache_path(self, key):
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, digest + ".json")
+
+    @staticmethod
+    def _is_not_found(data):
+        return data.get("Response") == "False" and data.get("Error") == "Movie not found!"
+
+    def _read_cache(self, key):
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._cache_path(key), "r", encoding="utf-8") as f:
+                entry = json.load(f)
+            data = entry["response"]
+            age = time.time() - entry["fetched_at"]
+        except (OSError, ValueError, KeyError, TypeError):
+            # A truncated or hand-edited entry is a miss, refetched and
+            # overwritten like an expired one.
+            return None
+        if not isinstance(data, dict):
+            return None
+        ttl = self.negative_ttl if self._is_not_found(data) else self.ttl
+        if age >= ttl:
+            return None
+        return data
+
+    def _write_cache(self, key, data):
+        # Only real answers are cached; errors such as an exhausted
+        # request limit must be retried.
+        if not self.cache_dir or (data.get("Response") == "False" and not self._is_not_found(data)):
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._cache_path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"title": key, "fetched_at": time.time(), "response": data}, f)
+        os.replace(tmp_path, path)
@@ -0,0 +1,112 @@
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from file_lock import replace_file, temp_file
+
+# File extensions kept from poster URLs; anything else is stored as .img.
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".gif", ".webp")
+
+
+class PosterMirror:
+    def __init__(self, cache_dir, max_workers=8, timeout=10):
+        """
+        Downloads poster images into cache_dir with up to max_workers
+        requests in flight. Files are named by the SHA-256 of their
+        content, so an image shared by several URLs is stored once.
+        cache_dir/manifest.json maps each URL to its file along with the
+        ETag and Last-Modified the server sent; later runs send them back
+        so an unchanged poster costs a 304 instead of a download.
+        """
+        self.cache_dir = cache_dir
+        self.manifest_file = os.path.join(cache_dir, "manifest.json")
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.downloaded = 0
+        self.not_modified = 0
+        self.failed = 0
+        self._counter_lock = threading.Lock()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def close(self):
+        self.session.close()
+
+    def mirror(self, urls):
+        """
+        Brings the cache in line with the given poster URLs and returns a
+        {url: file name} dictionary for those with a local copy. A poster
+        that cannot be fetched keeps its previous copy if there is one.
+        Files no other URL refers to any more are deleted.
+        """
+        urls = sorted({url for url in urls if url and urlsplit(url).scheme in ("http", "https")})
+        os.makedirs(self.cache_dir, exist_ok=True)
+        manifest = self._load_manifest()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            entries = list(executor.map(lambda url: self._fetch(url, manifest.get(url)), urls))
+        new_manifest = {url: entry for url, entry in zip(urls, entries) if entry is not None}
+        self._save_manifest(new_manifest)
+        kept = {entry["file"] for entry in new_manifest.values()}
+        for name in os.listdir(self.cache_dir):
+            if name != os.path.basename(self.manifest_file) and name not in kept:
+                os.remove(os.path.join(self.cache_dir, name))
+        return {url: entry["file"] for url, entry in new_manifest.items()}
+
+    def _count(self, counter):
+        with self._counter_lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _fetch(self, url, entry):
+        """
+        Returns the manifest entry for url after a (conditional) request,
+        or the previous entry, or None if there is no usable copy.
+        """
+        if entry is not None and not os.path.exists(os.path.join(self.cache_dir, entry["file"])):
+            entry = None
+        headers = {}
+        if entry is not None:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+        try:
+            response = self.session.get(url, headers=headers, timeout=self.timeout)
+            if response.status_code == 304 and entry is not None:
+                self._count("not_modified")
+                return entry
+            response.raise_for_status()
+            name = hashlib.sha256(response.content).hexdigest() + self._extension(url)
+            path = os.path.join(self.cache_dir, name)
+            if not os.path.exists(path):
+                with temp_file(path, binary=True) as f:
+                    f.write(response.content)
+                replace_file(f.name, path)
+        except (requests.RequestException, OSError):
+            self._count("failed")
+            return entry
+        self._count("downloaded")
+        return {"file": name, "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified")}
+
+    @staticmethod
+    def _extension(url):
+        ext = os.path.splitext(urlsplit(url).path)[1].lower()
+        return ext if ext in IMAGE_EXTENSIONS else ".img"
+
+    def _load_manifest(self):
+        try:
+            with open(self.manifest_file, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_manifest(self, manifest):
+        with temp_file(self.manifest_file) as f:
+            json.dump(manifest, f, indent=4)
+        replace_file(f.name, self.manifest_file)
@@ -0,0 +1,126 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from bulk_import import BUDGET_EXHAUSTED, TokenBucket, fetch_with_retries
+from file_lock import replace_file, temp_file
+
+# Requests per run by default: OMDb's free daily quota.
+DAILY_BUDGET = 1000
+
+
+def timestamps_path(storage_path):
+    """
+    Returns the path of the sidecar file holding a data file's fetch times.
+    """
+    return storage_path + ".refreshed.json"
+
+
+def load_timestamps(path):
+    """
+    Reads the title -> last fetch time (seconds since the epoch) mapping.
+    A missing or damaged file just means nothing was fetched yet.
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            timestamps = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return timestamps if isinstance(timestamps, dict) else {}
+
+
+def save_timestamps(path, timestamps):
+    with temp_file(path) as f:
+        json.dump(timestamps, f)
+    replace_file(f.name, path)
+
+
+class RatingRefresher:
+    def __init__(self, client, storage, state_path, budget=DAILY_BUDGET, max_workers=8, rate=10,
+                 retries=3, backoff=0.5, clock=time.time):
+        """
+        Re-fetches the IMDb ratings of stored movies from OMDb, stalest
+        first: movies never refreshed come first, then those refreshed
+        longest ago. A run makes at most budget requests, retries
+        included, with up to max_workers in flight and at most rate per
+        second. The last fetch time of every movie is kept in the JSON
+        file state_path.
+        """
+        if budget < 0:
+            raise ValueError(f"The budget must not be negative, got {budget}.")
+        self.client = client
+        self.storage = storage
+        self.state_path = state_path
+        self.budget = budget
+        self.max_workers = max_workers
+        self.rate = rate
+        self.retries = retries
+        self.backoff = backoff
+        self.clock = clock
+
+    def stale_titles(self, movies, timestamps, max_age=0):
+        """
+        Returns the titles not fetched within max_age seconds, stalest
+        first. Equally stale movies keep their listing order.
+        """
+        now = self.clock()
+        titles = [title for title in movies if now - timestamps.get(title, 0) >= max_age]
+        return sorted(titles, key=lambda title: timestamps.get(title, 0))
+
+    def run(self, max_age=0):
+        """
+        Refreshes as many of the stale titles as the budget allows and
+        returns a report with one dictionary per title: {"title": ...,
+        "status": "updated"|"unchanged"|"failed"|"skipped", "message":
+        ...}. Only changed ratings are written, with update_movie() in a
+        single batch.
+        """
+        movies = self.storage.list_movies()
+        timestamps = load_timestamps(self.state_path)
+        titles = self.stale_titles(movies, timestamps, max_age)[:self.budget]
+        bucket = TokenBucket(self.rate, limit=self.budget)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            results = list(executor.map(lambda title: self._fetch(bucket, title), titles))
+        now = self.clock()
+        report = []
+        updates = {}
+        for title, rating, error, answered in results:
+            if answered:
+                timestamps[title] = now
+            old = movies[title]["rating"]
+            if error:
+                status = "skipped" if error == BUDGET_EXHAUSTED else "failed"
+                report.append({"title": title, "status": status, "message": error})
+            elif rating == old:
+                report.append({"title": title, "status": "unchanged", "message": str(rating)})
+            else:
+                updates[title] = rating
+                report.append({"title": title, "status": "updated", "message": f"{old} -> {rating}"})
+        if updates:
+            with self.storage.batch():
+                for entry in report:
+                    if entry["title"] not in updates:
+                        continue
+                    try:
+                        self.storage.update_movie(entry["title"], updates[entry["title"]])
+                    except ValueError as e:
+                        # Deleted while its rating was being fetched.
+                        entry.update(status="failed", message=str(e))
+        save_timestamps(self.state_path, {title: stamp for title, stamp in timestamps.items()
+                                          if title in movies})
+        return report
+
+    def _fetch(self, bucket, title):
+        """
+        Returns (title, rating, error, answered), answered telling whether
+        OMDb responded at all, which makes the movie count as fresh.
+        """
+        data, error = fetch_with_retries(self.client, bucket, title, self.retries, self.backoff,
+                                         use_cache=False)
+        if error:
+            return title, None, error, False
+        if data.get("Response") == "False":
+            return title, None, data.get("Error", "Movie not found"), True
+        try:
+            return title, float(data.get("imdbRating", "")), None, True
+        except ValueError:
+            return title, None, f"No IMDb rating ({data.get('imdbRating', 'missing')})", True
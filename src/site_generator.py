@@ -0,0 +1,186 @@
+import hashlib
+import html
+import json
+import os
+import sys
+from file_lock import replace_file, temp_file
+
+TITLE_PLACEHOLDER = "__TEMPLATE_TITLE__"
+GRID_PLACEHOLDER = "__TEMPLATE_MOVIE_GRID__"
+
+
+def movie_card(title, info, poster=None):
+    """
+    Returns the HTML of one movie in the grid. poster, if given, replaces
+    the poster URL as the image source.
+    """
+    title = html.escape(title)
+    if poster is None:
+        poster = info.get('poster') or ''
+    return f"""<li class="movie">
+    <h3>{title}</h3>
+    <img src="{html.escape(poster)}" alt="{title} poster">
+    <p>Year: {info.get('year')}</p>
+    <p>Rating: {info.get('rating')}</p>
+</li>
+"""
+
+
+# Characters of a page kept in memory before it is spilled to a
+# temporary file; only a site without per_page gets pages this large.
+PAGE_BUFFER_SIZE = 4 * 1024 * 1024
+
+
+class _PageWriter:
+    def __init__(self, path):
+        """
+        Collects one page in memory while hashing what is written, so an
+        unchanged page is never written to disk. A page that outgrows
+        PAGE_BUFFER_SIZE is streamed into a temporary file instead.
+        """
+        self.path = path
+        self._parts = []
+        self._size = 0
+        self._hash = hashlib.sha256()
+        self._tmp = None
+        self._file = None
+
+    def write(self, text):
+        self._hash.update(text.encode("utf-8"))
+        if self._file is not None:
+            self._file.write(text)
+            return
+        self._parts.append(text)
+        self._size += len(text)
+        if self._size > PAGE_BUFFER_SIZE:
+            self._tmp = temp_file(self.path)
+            self._file = self._tmp.__enter__()
+            self._file.write("".join(self._parts))
+            self._parts = []
+
+    def finish(self, previous_digest):
+        """
+        Moves the page into place unless it is unchanged. Returns the
+        page's digest and whether it was written.
+        """
+        digest = self._hash.hexdigest()
+        unchanged = digest == previous_digest and os.path.exists(self.path)
+        if self._file is None:
+            if unchanged:
+                return digest, False
+            with temp_file(self.path) as f:
+                f.write("".join(self._parts))
+        else:
+            self._tmp.__exit__(None, None, None)
+            f = self._file
+            if unchanged:
+                os.remove(f.name)
+                return digest, False
+        # Readers see either the old or the new page, never half of one.
+        replace_file(f.name, self.path)
+        return digest, True
+
+    def abort(self):
+        if self._tmp is not None:
+            self._tmp.__exit__(*sys.exc_info())
+
+
+class SiteGenerator:
+    def __init__(self, template_file, website_file, title="My Movie App", per_page=None,
+                 posters=None):
+        """
+        Writes the website from template_file. With per_page, the movies
+        are split over website_file, <name>_2<ext>, <name>_3<ext>, ...
+        Each page's hash is kept in <website_file>.manifest.json so
+        unchanged pages are not rewritten on the next run. posters maps
+        poster URLs to the local paths the pages should use instead.
+        """
+        self.template_file = template_file
+        self.website_file = website_file
+        self.title = title
+        self.per_page = per_page
+        self.posters = posters or {}
+        self.manifest_file = website_file + ".manifest.json"
+
+    def page_path(self, number):
+        if number == 1:
+            return self.website_file
+        root, ext = os.path.splitext(self.website_file)
+        return f"{root}_{number}{ext}"
+
+    def generate(self, movies):
+        """
+        Writes the pages for an iterable of (title, info) pairs, streaming
+        each card straight to its page. Returns a dictionary with the
+        lists of "written" and "unchanged" page paths.
+        """
+        with open(self.template_file, "r", encoding="utf-8") as f:
+            template = f.read().replace(TITLE_PLACEHOLDER, self.title)
+        head, _, tail = template.partition(GRID_PLACEHOLDER)
+        manifest = self._load_manifest()
+        new_manifest = {}
+        result = {"written": [], "unchanged": []}
+        number = 1
+        count = 0
+        page = _PageWriter(self.page_path(number))
+        try:
+            page.write(head)
+            for title, info in movies:
+                if self.per_page and count == self.per_page:
+                    self._finish_page(page, number, True, tail, manifest, new_manifest, result)
+                    number += 1
+                    count = 0
+                    page = _PageWriter(self.page_path(number))
+                    page.write(head)
+                page.write(movie_card(title, info, self.posters.get(info.get("poster"))))
+                count += 1
+        except BaseException:
+            page.abort()
+            raise
+        self._finish_page(page, number, False, tail, manifest, new_manifest, result)
+        # Drop pages left over from a run that had more of them.
+        for name in manifest:
+            if name not in new_manifest:
+                path = os.path.join(os.path.dirname(self.website_file), name)
+                if os.path.exists(path):
+                    os.remove(path)
+        if new_manifest != manifest:
+            self._save_manifest(new_manifest)
+        return result
+
+    def _finish_page(self, page, number, has_next, tail, manifest, new_manifest, result):
+        page.write(self._pager(number, has_next, tail))
+        name = os.path.basename(page.path)
+        digest, written = page.finish(manifest.get(name))
+        new_manifest[name] = digest
+        result["written" if written else "unchanged"].append(page.path)
+
+    def _pager(self, number, has_next, tail):
+        """
+        Returns the tail of the template with links to the neighbouring
+        pages inserted before </body>.
+        """
+        if not self.per_page or (number == 1 and not has_next):
+            return tail
+        links = []
+        if number > 1:
+            links.append(f'<a href="{os.path.basename(self.page_path(number - 1))}">Previous</a>')
+        if has_next:
+            links.append(f'<a href="{os.path.basename(self.page_path(number + 1))}">Next</a>')
+        nav = f'<nav class="pagination">{" ".join(links)}</nav>\n'
+        before, body_end, after = tail.rpartition("</body>")
+        if not body_end:
+            return tail + nav
+        return before + nav + body_end + after
+
+    def _load_manifest(self):
+        try:
+            with open(self.manifest_file, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_manifest(self, manifest):
+        with temp_file(self.manifest_file) as f:
+            json.dump(manifest, f, indent=4)
+        replace_file(f.name, self.manifest_file)
@@ -0,0 +1,229 @@
+import json
+import os
+import re
+from file_lock import replace_file, temp_file
+from site_generator import GRID_PLACEHOLDER, TITLE_PLACEHOLDER
+
+# Movies per data shard.
+SHARD_SIZE = 500
+# Folder next to the search page holding its data files.
+DATA_DIR = "site_data"
+SEARCH_PAGE = "search.html"
+
+_WORD = re.compile(r"\w+")
+
+SEARCH_FORM = """<li class="search">
+    <form id="search-form">
+        <input name="q" type="search" placeholder="Search titles" autofocus>
+        <input name="min_rating" type="number" step="0.1" placeholder="Min rating">
+        <input name="max_rating" type="number" step="0.1" placeholder="Max rating">
+        <input name="min_year" type="number" placeholder="From year">
+        <input name="max_year" type="number" placeholder="To year">
+    </form>
+    <p id="search-status">Loading...</p>
+</li>
+<li hidden id="search-anchor"></li>
+"""
+
+# Loads index.json, then only the token files and shards a search needs.
+SEARCH_SCRIPT = """<script>
+(async function () {
+    const LIMIT = 100;
+    const files = {};
+    const load = (name) => files[name] || (files[name] = fetch("%(data_dir)s/" + name).then((r) => r.json()));
+    const form = document.getElementById("search-form");
+    const anchor = document.getElementById("search-anchor");
+    const status = document.getElementById("search-status");
+    const index = await load("index.json");
+    const searchKey = (token) => /^[a-z0-9]$/.test(token[0]) ? token[0] : "_";
+    const bound = (name) => form.elements[name].value === "" ? null : Number(form.elements[name].value);
+    const within = (value, low, high) => (low === null || value >= low) && (high === null || value <= high);
+    const overlaps = (range, low, high) => (low === null || range[1] >= low) && (high === null || range[0] <= high);
+
+    async function matchingIds(words) {
+        let result = null;
+        for (const word of words) {
+            const ids = new Set();
+            const key = searchKey(word);
+            if (index.search.includes(key)) {
+                const data = await load("search-" + key + ".json");
+                // Tokens are sorted, so the ones starting with word are adjacent.
+                let low = 0, high = data.tokens.length;
+                while (low < high) {
+                    const middle = (low + high) >> 1;
+                    if (data.tokens[middle] < word) low = middle + 1; else high = middle;
+                }
+                for (let i = low; i < data.tokens.length && data.tokens[i].startsWith(word); i++) {
+                    data.ids[i].forEach((id) => ids.add(id));
+                }
+            }
+            result = result === null ? ids : new Set([...result].filter((id) => ids.has(id)));
+            if (!result.size) break;
+        }
+        return result;
+    }
+
+    function render(rows, more) {
+        while (anchor.nextSibling) anchor.parentNode.removeChild(anchor.nextSibling);
+        for (const [title, rating, year, poster] of rows) {
+            const item = document.createElement("li");
+            item.className = "movie";
+            const heading = document.createElement("h3");
+            heading.textContent = title;
+            const image = document.createElement("img");
+            image.src = poster;
+            image.alt = title + " poster";
+            const yearText = document.createElement("p");
+            yearText.textContent = "Year: " + year;
+            const ratingText = document.createElement("p");
+            ratingText.textContent = "Rating: " + rating;
+            item.append(heading, image, yearText, ratingText);
+            anchor.parentNode.appendChild(item);
+        }
+        status.textContent = rows.length + (more ? "+" : "") + " of " + index.count + " movies";
+    }
+
+    let latest = 0;
+    async function search() {
+        const run = ++latest;
+        const words = form.elements.q.value.toLowerCase().match(/[\\p{L}\\p{N}_]+/gu) || [];
+        const [minRating, maxRating] = [bound("min_rating"), bound("max_rating")];
+        const [minYear, maxYear] = [bound("min_year"), bound("max_year")];
+        const ids = words.length ? await matchingIds(words) : null;
+        const wanted = ids && new Set([...ids].map((id) => Math.floor(id / index.shard_size)));
+        const rows = [];
+        let more = false;
+        for (let n = 0; n < index.shards.length && !more; n++) {
+            const shard = index.shards[n];
+            if ((wanted && !wanted.has(n)) || !overlaps(shard.rating, minRating, maxRating) ||
+                    !overlaps(shard.year, minYear, maxYear)) continue;
+            const first = n * index.shard_size;
+            (await load(shard.file)).forEach((row, i) => {
+                if ((ids === null || ids.has(first + i)) && within(row[1], minRating, maxRating) &&
+                        within(row[2], minYear, maxYear)) {
+                    if (rows.length < LIMIT) rows.push(row); else more = true;
+                }
+            });
+        }
+        if (run === latest) render(rows, more);
+    }
+
+    form.addEventListener("input", search);
+    form.addEventListener("submit", (event) => { event.preventDefault(); search(); });
+    search();
+})();
+</script>
+"""
+
+
+def title_tokens(title):
+    """
+    Returns the distinct lowercased words of a title, as the search page
+    splits queries.
+    """
+    return sorted(set(_WORD.findall(title.lower())))
+
+
+def search_key(token):
+    """
+    Returns the name of the token file holding token: its first letter or
+    digit, "_" for anything else.
+    """
+    first = token[0]
+    return first if first.isascii() and first.isalnum() else "_"
+
+
+class SearchSite:
+    def __init__(self, template_file, output_dir, title="My Movie App", shard_size=SHARD_SIZE,
+                 posters=None):
+        """
+        Writes search.html into output_dir: the template with a search
+        form and a script, but no movies. Its data goes to site_data/ and
+        is fetched on demand:
+          - movies-<n>.json: shards of shard_size [title, rating, year,
+            poster] rows, best rated first; movie ids count through them.
+          - index.json: the movie count and each shard's file and rating
+            and year range, so a filter skips shards outside it.
+          - search-<c>.json: the sorted title tokens starting with c and
+            the ids of the movies containing each, for prefix searches.
+        Files whose content is unchanged are not rewritten. posters maps
+        poster URLs to local copies, as for SiteGenerator. The page uses
+        fetch(), so the folder has to be served over HTTP.
+        """
+        self.template_file = template_file
+        self.output_dir = output_dir
+        self.data_dir = os.path.join(output_dir, DATA_DIR)
+        self.title = title
+        self.shard_size = shard_size
+        self.posters = posters or {}
+
+    def generate(self, catalog):
+        """
+        Writes the page and data for a Catalog. Returns a dictionary with
+        the lists of "written" and "unchanged" file paths.
+        """
+        files = {}
+        shards = []
+        postings = {}
+        order = catalog.sorted_positions("rating")
+        for number, start in enumerate(range(0, len(order), self.shard_size)):
+            rows = []
+            for movie_id, position in enumerate(order[start:start + self.shard_size], start):
+                title = catalog.titles[position]
+                poster = catalog.poster(position)
+                rows.append([title, catalog.ratings[position], catalog.years[position],
+                             self.posters.get(poster, poster)])
+                for token in title_tokens(title):
+                    postings.setdefault(search_key(token), {}).setdefault(token, []).append(movie_id)
+            name = f"movies-{number}.json"
+            files[name] = _compact_json(rows)
+            ratings = [row[1] for row in rows]
+            years = [row[2] for row in rows]
+            shards.append({"file": name, "count": len(rows),
+                           "rating": [min(ratings), max(ratings)], "year": [min(years), max(years)]})
+        for key, tokens in postings.items():
+            ordered = sorted(tokens)
+            files[f"search-{key}.json"] = _compact_json(
+                {"tokens": ordered, "ids": [tokens[token] for token in ordered]})
+        files["index.json"] = _compact_json({"count": len(order), "shard_size": self.shard_size,
+                                             "shards": shards, "search": sorted(postings)})
+
+        os.makedirs(self.data_dir, exist_ok=True)
+        result = {"written": [], "unchanged": []}
+        pages = [(os.path.join(self.output_dir, SEARCH_PAGE), self._page())]
+        pages += [(os.path.join(self.data_dir, name), text) for name, text in files.items()]
+        for path, text in pages:
+            written = _write_if_changed(path, text)
+            result["written" if written else "unchanged"].append(path)
+        # Drop shards and token files left over from a bigger catalog.
+        for name in os.listdir(self.data_dir):
+            if name.endswith(".json") and name not in files:
+                os.remove(os.path.join(self.data_dir, name))
+        return result
+
+    def _page(self):
+        with open(self.template_file, "r", encoding="utf-8") as f:
+            template = f.read().replace(TITLE_PLACEHOLDER, self.title)
+        page = template.replace(GRID_PLACEHOLDER, SEARCH_FORM)
+        script = SEARCH_SCRIPT % {"data_dir": DATA_DIR}
+        before, body_end, after = page.rpartition("</body>")
+        if not body_end:
+            return page + script
+        return before + script + body_end + after
+
+
+def _compact_json(value):
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False)
+
+
+def _write_if_changed(path, text):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            if f.read() == text:
+                return False
+    except OSError:
+        pass
+    with temp_file(path) as f:
+        f.write(text)
+    replace_file(f.name, path)
+    return True
@@ -0,0 +1,146 @@
+import bisect
+
+
+class SortedIndex:
+    def __init__(self):
+        """
+        Titles kept sorted by one value (rating, year, ...) with bisect, so
+        a range or a page of the order costs O(log n + k) instead of a full
+        sort. Titles with equal values keep the order they were added in,
+        which is the listing order when the index mirrors a storage.
+        """
+        # (value, seq, title) in value order; seq is the insertion counter.
+        self._sorted = []
+        self._entries = {}
+        self._next_seq = 0
+
+    @classmethod
+    def from_items(cls, items):
+        """
+        Builds the index from (title, value) pairs in listing order.
+        """
+        index = cls()
+        entries = []
+        for seq, (title, value) in enumerate(items):
+            index._entries[title] = (value, seq)
+            entries.append((value, seq, title))
+        entries.sort()
+        index._sorted = entries
+        index._next_seq = len(entries)
+        return index
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, title):
+        return title in self._entries
+
+    def value(self, title):
+        return self._entries[title][0]
+
+    def seq(self, title):
+        return self._entries[title][1]
+
+    def add(self, title, value):
+        entry = (value, self._next_seq)
+        self._next_seq += 1
+        self._entries[title] = entry
+        bisect.insort(self._sorted, entry + (title,))
+
+    def remove(self, title):
+        value, seq = self._entries.pop(title)
+        del self._sorted[bisect.bisect_left(self._sorted, (value, seq))]
+
+    def update(self, title, value):
+        # The title keeps its place among equal values.
+        old_value, seq = self._entries[title]
+        del self._sorted[bisect.bisect_left(self._sorted, (old_value, seq))]
+        self._entries[title] = (value, seq)
+        bisect.insort(self._sorted, (value, seq, title))
+
+    def _bounds(self, low, high):
+        start = 0 if low is None else bisect.bisect_left(self._sorted, (low,))
+        # (high, inf) sorts after every entry with value high.
+        end = len(self._sorted) if high is None else bisect.bisect_right(self._sorted, (high, float("inf")))
+        return start, end
+
+    def count(self, low=None, high=None):
+        """
+        Returns how many titles have low <= value <= high.
+        """
+        start, end = self._bounds(low, high)
+        return max(0, end - start)
+
+    def range(self, low=None, high=None):
+        """
+        Yields the titles with low <= value <= high (None leaves that side
+        open) in ascending value order.
+        """
+        start, end = self._bounds(low, high)
+        for value, seq, title in self._sorted[start:end]:
+            yield title
+
+    def iter_sorted(self, reverse=False):
+        """
+        Yields the titles by value, highest first if reverse. Equal values
+        come in insertion order either way, like a stable sort.
+        """
+        if not reverse:
+            for value, seq, title in self._sorted:
+                yield title
+            return
+        yield from self._iter_reverse()
+
+    def _iter_reverse(self, offset=0):
+        end = len(self._sorted)
+        if offset >= end:
+            return
+        if offset:
+            # Jump into the run of equal values holding the offset-th title:
+            # the runs above it fill the first end - run_end positions.
+            value = self._sorted[end - 1 - offset][0]
+            start = bisect.bisect_left(self._sorted, (value,), 0, end)
+            run_end = bisect.bisect_right(self._sorted, (value, float("inf")), start, end)
+            for value, seq, title in self._sorted[start + offset - (end - run_end):run_end]:
+                yield title
+            end = start
+        while end:
+            # Walk the runs of equal values backwards, each one forwards.
+            start = bisect.bisect_left(self._sorted, (self._sorted[end - 1][0],), 0, end)
+            for value, seq, title in self._sorted[start:end]:
+                yield title
+            end = start
+
+    def page(self, limit=None, offset=0, reverse=False):
+        """
+        Returns a list of titles from iter_sorted(), skipping offset and
+        returning at most limit of them.
+        """
+        if not reverse:
+            stop = None if limit is None else offset + limit
+            return [title for value, seq, title in self._sorted[offset:stop]]
+        titles = self._iter_reverse(offset)
+        if limit is None:
+            return list(titles)
+        return [title for _, title in zip(range(limit), titles)]
+
+
+def titles_in_range(rating_index, year_index, min_rating=None, max_rating=None,
+                    min_year=None, max_year=None):
+    """
+    Returns the titles within both the rating and the year bounds, in
+    listing order. Only the narrower of the two ranges is walked.
+    """
+    by_rating = rating_index.count(min_rating, max_rating)
+    by_year = year_index.count(min_year, max_year)
+    if by_rating <= by_year:
+        titles = [title for title in rating_index.range(min_rating, max_rating)
+                  if _within(year_index.value(title), min_year, max_year)]
+    else:
+        titles = [title for title in year_index.range(min_year, max_year)
+                  if _within(rating_index.value(title), min_rating, max_rating)]
+    return sorted(titles, key=rating_index.seq)
+
+
+def _within(value, low, high):
+    return (low is None or value >= low) and (high is None or value <= high)
@@ -0,0 +1,450 @@
+import mmap
+import os
+import random
+import struct
+import sys
+from array import array
+from contextlib import ExitStack
+from catalog import Catalog, column_stats, sort_positions
+from file_lock import lock_for, replace_file, temp_file
+from istorage import IStorage
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+MAGIC = b"MOVIEBIN"
+FORMAT_VERSION = 1
+# magic, format version, reserved, record capacity, records used, live
+# records, heap bytes used, generation (bumped by every write).
+HEADER = struct.Struct("<8sIIQQQQQ")
+HEADER_SIZE = 64
+# rating, year, flags, title offset, title length, poster offset, poster
+# length; offsets are relative to the start of the string heap.
+RECORD = struct.Struct("<diIQIQI")
+RATING = struct.Struct("<d")
+FLAGS = struct.Struct("<I")
+FLAGS_OFFSET = 12
+RECORD_DTYPE = None if numpy is None else numpy.dtype([
+    ("rating", "<f8"), ("year", "<i4"), ("flags", "<u4"), ("title_at", "<u8"),
+    ("title_len", "<u4"), ("poster_at", "<u8"), ("poster_len", "<u4")])
+DELETED = 1
+MIN_CAPACITY = 1024
+MIN_HEAP = 64 * 1024
+
+
+class StorageBinary(IStorage):
+    def __init__(self, file_path):
+        """
+        Initialize the storage on a binary file: a header, a region of
+        fixed-size records and a heap holding the title and poster
+        strings, read through mmap. Opening only maps the file; the title
+        lookup table is built on the first write that needs it. Deletes
+        mark the record, rating updates overwrite it in place, and
+        compact() drops deleted records and their strings.
+        """
+        self.file_path = file_path
+        self._file_lock = lock_for(file_path)
+        self._file = None
+        self._map = None
+        self._signature = None
+        # title -> record slot, valid for the generation it was built at.
+        self._slots = None
+        self._slots_generation = None
+        # Inside batch(): the exclusive lock held for it, the header counts
+        # with its changes (written to the file only when it commits) and
+        # (offset, old bytes) for every in-place write.
+        self._batch_lock = None
+        self._pending = None
+        self._undo = None
+        if not os.path.exists(self.file_path):
+            with self._file_lock.exclusive():
+                if not os.path.exists(self.file_path):
+                    self._write_file([], MIN_CAPACITY, MIN_HEAP, 0)
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._file.close()
+        self._map = None
+        self._file = None
+        self._signature = None
+
+    # File layout -----------------------------------------------------------
+
+    def _mapped(self):
+        """
+        Returns the mapping of the data file, remapped if the file was
+        replaced or resized since (by us or another process).
+        """
+        stat = os.stat(self.file_path)
+        signature = (stat.st_ino, stat.st_size)
+        if self._map is None or signature != self._signature:
+            self.close()
+            self._file = open(self.file_path, "r+b")
+            self._map = mmap.mmap(self._file.fileno(), 0)
+            self._signature = signature
+            if self._map[:len(MAGIC)] != MAGIC:
+                self.close()
+                raise ValueError(f"Data file '{self.file_path}' is not a movie binary file")
+        return self._map
+
+    @staticmethod
+    def _header(m):
+        magic, version, _, capacity, count, live, heap_used, generation = HEADER.unpack_from(m, 0)
+        if version != FORMAT_VERSION:
+            raise ValueError(f"Unsupported binary format version {version}")
+        return capacity, count, live, heap_used, generation
+
+    def _state(self, m):
+        """
+        Returns the header counts as this instance sees them: including
+        the changes of an open batch, which the file's header lacks.
+        """
+        if self._pending is not None:
+            return self._pending
+        return self._header(m)
+
+    @staticmethod
+    def _write_header(m, capacity, count, live, heap_used, generation):
+        HEADER.pack_into(m, 0, MAGIC, FORMAT_VERSION, 0, capacity, count, live, heap_used, generation)
+
+    def _write_file(self, rows, capacity, heap_capacity, generation):
+        """
+        Writes (title, rating, year, poster) rows into a new file with room
+        for capacity records and heap_capacity string bytes, and renames it
+        over the data file.
+        """
+        records = bytearray()
+        heap = bytearray()
+        for title, rating, year, poster in rows:
+            title, poster = title.encode("utf-8"), poster.encode("utf-8")
+            records += RECORD.pack(rating, year, 0, len(heap), len(title),
+                                   len(heap) + len(title), len(poster))
+            heap += title
+            heap += poster
+        count = len(records) // RECORD.size
+        capacity = max(capacity, count)
+        heap_capacity = max(heap_capacity, len(heap))
+        header = bytearray(HEADER_SIZE)
+        self._write_header(header, capacity, count, count, len(heap), generation)
+        self._write_regions(header, records, heap, capacity, heap_capacity)
+
+    def _write_regions(self, header, records, heap, capacity, heap_capacity):
+        with temp_file(self.file_path, binary=True) as f:
+            f.write(header)
+            f.write(records)
+            # Unused slots and heap space are left as (sparse) zeros.
+            f.seek(HEADER_SIZE + capacity * RECORD.size)
+            f.write(heap)
+            f.truncate(HEADER_SIZE + capacity * RECORD.size + heap_capacity)
+        replace_file(f.name, self.file_path)
+
+    def _grow(self, m, records_needed, heap_needed):
+        """
+        Moves the file to one with room for records_needed records and
+        heap_needed heap bytes. Slots and heap offsets stay the same.
+        Inside a batch the new file still has the committed counts, so the
+        batch's records are copied but remain uncommitted.
+        """
+        capacity, count, live, heap_used, generation = self._state(m)
+        heap_start = HEADER_SIZE + capacity * RECORD.size
+        heap_capacity = len(m) - heap_start
+        new_capacity = max(capacity, records_needed)
+        if new_capacity > capacity:
+            new_capacity = max(new_capacity, capacity * 2)
+        new_heap = max(heap_capacity, heap_needed)
+        if new_heap > heap_capacity:
+            new_heap = max(new_heap, heap_capacity * 2)
+        header = bytearray(HEADER_SIZE)
+        self._write_header(header, new_capacity, *self._header(m)[1:])
+        self._write_regions(header, m[HEADER_SIZE:HEADER_SIZE + count * RECORD.size],
+                            m[heap_start:heap_start + heap_used], new_capacity, new_heap)
+        if self._pending is not None:
+            self._pending = (new_capacity,) + self._pending[1:]
+        return self._mapped()
+
+    def _records(self, m):
+        """
+        Yields (slot, title, rating, year, poster) for every live record.
+        """
+        capacity, count, live, heap_used, generation = self._state(m)
+        heap_start = HEADER_SIZE + capacity * RECORD.size
+        with memoryview(m) as view:
+            region = view[HEADER_SIZE:HEADER_SIZE + count * RECORD.size]
+            try:
+                for slot, (rating, year, flags, title_at, title_len, poster_at, poster_len) \
+                        in enumerate(struct.iter_unpack(RECORD.format, region)):
+                    if flags & DELETED:
+                        continue
+                    title_at += heap_start
+                    poster_at += heap_start
+                    yield (slot, str(view[title_at:title_at + title_len], "utf-8"), rating, year,
+                           str(view[poster_at:poster_at + poster_len], "utf-8"))
+            finally:
+                region.release()
+
+    def _columns(self, m):
+        """
+        Returns the slots, ratings and years of the live records as arrays,
+        without decoding any strings.
+        """
+        count = self._state(m)[1]
+        slots, ratings, years = array("Q"), array("d"), array("i")
+        with memoryview(m) as view:
+            region = view[HEADER_SIZE:HEADER_SIZE + count * RECORD.size]
+            try:
+                if numpy is not None:
+                    # Views the record region in place; only the selected
+                    # columns are copied out.
+                    records = numpy.frombuffer(region, dtype=RECORD_DTYPE)
+                    live = (records["flags"] & DELETED) == 0
+                    slots.frombytes(numpy.flatnonzero(live).astype(numpy.uint64).tobytes())
+                    ratings.frombytes(records["rating"][live].tobytes())
+                    years.frombytes(records["year"][live].astype(numpy.intc).tobytes())
+                    del records, live
+                else:
+                    for slot, (rating, year, flags, *_) in enumerate(
+                            struct.iter_unpack(RECORD.format, region)):
+                        if not flags & DELETED:
+                            slots.append(slot)
+                            ratings.append(rating)
+                            years.append(year)
+            finally:
+                region.release()
+        return slots, ratings, years
+
+    def _read(self, m, slot):
+        """
+        Returns the (title, info) pair stored in a slot.
+        """
+        heap_start = HEADER_SIZE + self._state(m)[0] * RECORD.size
+        rating, year, flags, title_at, title_len, poster_at, poster_len = \
+            RECORD.unpack_from(m, HEADER_SIZE + slot * RECORD.size)
+        title_at += heap_start
+        poster_at += heap_start
+        return (m[title_at:title_at + title_len].decode("utf-8"),
+                {"rating": rating, "year": year,
+                 "poster": m[poster_at:poster_at + poster_len].decode("utf-8")})
+
+    def _title_slots(self, m):
+        generation = self._state(m)[4]
+        if self._slots is None or self._slots_generation != generation:
+            self._slots = {title: slot for slot, title, rating, year, poster in self._records(m)}
+            self._slots_generation = generation
+        return self._slots
+
+    def _commit(self, m, capacity, count, live, heap_used, generation):
+        if self._undo is not None:
+            # A batch writes the header once, when it ends.
+            self._pending = (capacity, count, live, heap_used, generation)
+        else:
+            self._publish(m, capacity, count, live, heap_used, generation)
+        if self._slots is not None:
+            self._slots_generation = generation
+
+    def _publish(self, m, capacity, count, live, heap_used, generation):
+        # The new records and strings are flushed before the header that
+        # counts them is written, so a crash leaves either the previous
+        # catalog or the new one, never a header pointing at unwritten data.
+        m.flush()
+        self._write_header(m, capacity, count, live, heap_used, generation)
+        m.flush()
+
+    def _patch(self, m, at, packer, *values):
+        if self._undo is not None:
+            self._undo.append((at, m[at:at + packer.size]))
+        packer.pack_into(m, at, *values)
+
+    def _begin_batch(self):
+        # Other processes wait until the batch ends. Until then new records
+        # and strings lie past the file header's counts, which only change
+        # when the batch commits; in-place patches are logged for undo.
+        stack = ExitStack()
+        stack.enter_context(self._file_lock.exclusive())
+        try:
+            self._pending = self._header(self._mapped())
+        except BaseException:
+            stack.close()
+            raise
+        self._batch_lock = stack
+        self._undo = []
+
+    def _end_batch(self, commit):
+        undo, self._undo = self._undo, None
+        pending, self._pending = self._pending, None
+        try:
+            m = self._mapped()
+            if commit:
+                if pending != self._header(m):
+                    self._publish(m, *pending)
+            else:
+                for at, old in reversed(undo):
+                    m[at:at + len(old)] = old
+                if undo:
+                    m.flush()
+                # Added records lie past the header's counts; a grown file
+                # keeps its new capacity.
+                self._slots = None
+        finally:
+            self._batch_lock.close()
+            self._batch_lock = None
+
+    # IStorage --------------------------------------------------------------
+
+    def list_movies(self):
+        with self._file_lock.shared():
+            return {title: {"rating": rating, "year": year, "poster": poster}
+                    for slot, title, rating, year, poster in self._records(self._mapped())}
+
+    def list_catalog(self):
+        with self._file_lock.shared():
+            return Catalog.from_rows(row[1:] for row in self._records(self._mapped()))
+
+    def iter_movies(self):
+        # Rows are copied out first so no lock or mapping is held while
+        # the caller consumes them.
+        return self.list_catalog().rows()
+
+    def add_movie(self, title, year, rating, poster):
+        self.add_movies([(title, year, rating, poster)])
+
+    def add_movies(self, movies):
+        with self._file_lock.exclusive():
+            m = self._mapped()
+            slots = self._title_slots(m)
+            self._check_new_titles(slots, movies)
+            encoded = [(title, title.encode("utf-8"), year, rating, poster.encode("utf-8"))
+                       for title, year, rating, poster in movies]
+            capacity, count, live, heap_used, generation = self._state(m)
+            heap_needed = heap_used + sum(len(t) + len(p) for _, t, _, _, p in encoded)
+            if count + len(encoded) > capacity or \
+                    heap_needed > len(m) - HEADER_SIZE - capacity * RECORD.size:
+                m = self._grow(m, count + len(encoded), heap_needed)
+                capacity = self._state(m)[0]
+            heap_start = HEADER_SIZE + capacity * RECORD.size
+            for title, title_bytes, year, rating, poster_bytes in encoded:
+                at = heap_start + heap_used
+                m[at:at + len(title_bytes)] = title_bytes
+                m[at + len(title_bytes):at + len(title_bytes) + len(poster_bytes)] = poster_bytes
+                RECORD.pack_into(m, HEADER_SIZE + count * RECORD.size, rating, year, 0,
+                                 heap_used, len(title_bytes), heap_used + len(title_bytes),
+                                 len(poster_bytes))
+                slots[title] = count
+                heap_used += len(title_bytes) + len(poster_bytes)
+                count += 1
+                live += 1
+            self._commit(m, capacity, count, live, heap_used, generation + 1)
+
+    def delete_movie(self, title):
+        with self._file_lock.exclusive():
+            m = self._mapped()
+            slots = self._title_slots(m)
+            if title not in slots:
+                raise ValueError(f"Movie '{title}' not found!")
+            slot = slots.pop(title)
+            at = HEADER_SIZE + slot * RECORD.size + FLAGS_OFFSET
+            self._patch(m, at, FLAGS, FLAGS.unpack_from(m, at)[0] | DELETED)
+            capacity, count, live, heap_used, generation = self._state(m)
+            self._commit(m, capacity, count, live - 1, heap_used, generation + 1)
+
+    def update_movie(self, title, rating):
+        with self._file_lock.exclusive():
+            m = self._mapped()
+            slots = self._title_slots(m)
+            if title not in slots:
+                raise ValueError(f"Movie '{title}' not found!")
+            self._patch(m, HEADER_SIZE + slots[title] * RECORD.size, RATING, rating)
+            capacity, count, live, heap_used, generation = self._state(m)
+            self._commit(m, capacity, count, live, heap_used, generation + 1)
+
+    def sorted_movies(self, key="rating", reverse=True, limit=None, offset=0):
+        if key not in ("rating", "year"):
+            raise ValueError(f"Cannot sort by '{key}'")
+        with self._file_lock.shared():
+            m = self._mapped()
+            slots, ratings, years = self._columns(m)
+            column = ratings if key == "rating" else years
+            # Only the movies on the requested page get their strings decoded.
+            return [self._read(m, slots[position])
+                    for position in sort_positions(column, reverse, limit, offset)]
+
+    def movie_stats(self):
+        with self._file_lock.shared():
+            m = self._mapped()
+            slots, ratings, years = self._columns(m)
+            if not slots:
+                return None
+            average, median, best, worst = column_stats(ratings)
+            return {
+                "count": len(slots),
+                "average": average,
+                "median": median,
+                "best": (self._read(m, slots[best])[0], ratings[best]),
+                "worst": (self._read(m, slots[worst])[0], ratings[worst]),
+            }
+
+    def random_movie(self):
+        with self._file_lock.shared():
+            m = self._mapped()
+            capacity, count, live, heap_used, generation = self._state(m)
+            if live == 0:
+                return None
+            # Retry on deleted records; compact() keeps them rare.
+            while True:
+                slot = random.randrange(count)
+                flags, = FLAGS.unpack_from(m, HEADER_SIZE + slot * RECORD.size + FLAGS_OFFSET)
+                if not flags & DELETED:
+                    return self._read(m, slot)
+
+    # Maintenance and conversion --------------------------------------------
+
+    def compact(self):
+        """
+        Rewrites the file without deleted records and their strings.
+        """
+        self._check_no_batch("compact")
+        with self._file_lock.exclusive():
+            m = self._mapped()
+            capacity, count, live, heap_used, generation = self._header(m)
+            rows = [row[1:] for row in self._records(m)]
+            self._write_file(rows, MIN_CAPACITY, MIN_HEAP, generation + 1)
+            self._slots = None
+
+    def import_from(self, storage):
+        """
+        Copies every movie of another IStorage (e.g. StorageJson or
+        StorageCsv) in one write. Titles that already exist are kept.
+        Returns the number of movies imported.
+        """
+        with self._file_lock.exclusive():
+            existing = self._title_slots(self._mapped())
+            movies = [(title, info.get("year", 0), info.get("rating", 0.0), info.get("poster", ""))
+                      for title, info in storage.list_movies().items() if title not in existing]
+            if movies:
+                self.add_movies(movies)
+        return len(movies)
+
+    def export_to(self, storage):
+        """
+        Adds every movie to another IStorage in one add_movies() call.
+        """
+        storage.add_movies([(title, info["year"], info["rating"], info["poster"])
+                            for title, info in self.iter_movies()])
+
+
+if __name__ == "__main__":
+    # Usage: python storage_binary.py <source> <target>, where one side is
+    # a .bin file and the other a .json or .csv file.
+    from storage_csv import StorageCsv
+    from storage_json import StorageJson
+    source_path, target_path = sys.argv[1], sys.argv[2]
+    open_text = lambda path: StorageCsv(path) if path.endswith(".csv") else StorageJson(path)
+    if source_path.endswith(".bin"):
+        StorageBinary(source_path).export_to(open_text(target_path))
+        print(f"Exported {source_path} to {target_path}")
+    else:
+        target = StorageBinary(target_path)
+        print(f"Imported {target.import_from(open_text(source_path))} movies into {target_path}")
+        target.close()
@@ -1,60 +1,556 @@
 import csv
+import io
+import json
 import os
+import threading
+from catalog import Catalog
+from catalog_stats import RatingStats
+from file_lock import lock_for, replace_file, temp_file, write_optimistically
 from istorage import IStorage
+from sorted_index import SortedIndex, titles_in_range
+from title_index import TrigramIndex
+
+HEADER = ["title", "rating", "year", "poster"]
+# In indexed mode ratings are padded to this width so a later update
+# usually fits into the bytes of the old row.
+RATING_WIDTH = 6
+
+def coerce_numbers(rating, year):
+    """
+    Reads a rating as a float and a year as an int the way list_movies()
+    does, with 0 for a value that does not parse. Returns (rating, year,
+    errors), errors naming the fields that had to be replaced.
+    """
+    errors = []
+    try:
+        rating = float(rating)
+    except (TypeError, ValueError):
+        rating = 0.0
+        errors.append("rating")
+    try:
+        year = int(year)
+    except (TypeError, ValueError):
+        year = 0
+        errors.append("year")
+    return rating, year, errors
 
 class StorageCsv(IStorage):
-    def __init__(self, file_path):
+    def __init__(self, file_path, indexed=False):
+        """
+        Initialize the storage. With indexed=True a title -> byte offset
+        index is kept in memory, so duplicate checks are lookups and
+        updates/deletes patch rows in place. It is saved to a sidecar file
+        after every write, so the next process need not scan the file. Rating
+        statistics, a year index and a title search index are then
+        maintained incrementally as well.
+        Reads take a shared lock on <file>.lock. Plain mode writes
+        optimistically: rows are read and the new file prepared unlocked,
+        and the append or rename only happens under the exclusive lock if
+        the file is unchanged: every write increments a version number in
+        the lock file, which is compared along with the file's stat
+        signature. Indexed writes patch a few bytes, so they simply run
+        under the exclusive lock.
+        """
         self.file_path = file_path
+        self.index_path = file_path + ".idx"
+        self.indexed = indexed
+        self._index = None
+        self._index_signature = None
+        self._stats = None
+        self._year_index = None
+        self._title_index = None
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self._file_lock = lock_for(file_path)
+        # Serialises this instance's threads; batch() holds it throughout.
+        self._lock = threading.RLock()
+        # Inside batch(): the edited catalog, the signature of the file it
+        # was read from and the changes applied to it.
+        self._batch_movies = None
+        self._batch_signature = None
+        self._batch_changes = []
         # If the CSV file does not exist, create it with a header.
         if not os.path.exists(self.file_path):
-            with open(self.file_path, 'w', newline='', encoding='utf-8') as f:
-                writer = csv.writer(f)
-                writer.writerow(["title", "rating", "year", "poster"])
+            with self._file_lock.exclusive():
+                if not os.path.exists(self.file_path):
+                    with temp_file(self.file_path, newline='') as f:
+                        csv.writer(f).writerow(HEADER)
+                    replace_file(f.name, self.file_path)
 
     def list_movies(self):
-        movies = {}
-        with open(self.file_path, 'r', newline='', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                title = row["title"]
-                try:
-                    rating = float(row["rating"])
-                except ValueError:
-                    rating = 0.0
-                try:
-                    year = int(row["year"])
-                except ValueError:
-                    year = 0
-                poster = row["poster"]
-                movies[title] = {"rating": rating, "year": year, "poster": poster}
-        return movies
+        with self._lock:
+            if self._batch_movies is not None:
+                return self._batch_movies
+            with self._file_lock.shared():
+                with open(self.file_path, 'r', newline='', encoding='utf-8') as f:
+                    self.bytes_read += os.fstat(f.fileno()).st_size
+                    return self._parse_rows(csv.DictReader(f))
+
+    def list_catalog(self):
+        with self._lock:
+            if self._batch_movies is not None:
+                return super().list_catalog()
+            with self._file_lock.shared():
+                with open(self.file_path, 'r', newline='', encoding='utf-8') as f:
+                    self.bytes_read += os.fstat(f.fileno()).st_size
+                    return Catalog.from_rows(self._coerce_rows(csv.DictReader(f)))
+
+    @classmethod
+    def _parse_rows(cls, rows):
+        return {title: {"rating": rating, "year": year, "poster": poster}
+                for title, rating, year, poster in cls._coerce_rows(rows)}
+
+    @staticmethod
+    def _coerce_rows(rows):
+        """
+        Yields (title, rating, year, poster) for the CSV's dictionary rows,
+        with unreadable numbers as 0.
+        """
+        for row in rows:
+            title = row["title"]
+            # Rows blanked out by an indexed delete are skipped.
+            if not title.strip():
+                continue
+            rating, year, errors = coerce_numbers(row["rating"], row["year"])
+            yield title, rating, year, row["poster"]
 
     def add_movie(self, title, year, rating, poster):
-        movies = self.list_movies()
-        if title in movies:
-            raise ValueError(f"Movie '{title}' already exists!")
-        with open(self.file_path, 'a', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            writer.writerow([title, rating, year, poster])
+        def change(movies):
+            if title in movies:
+                raise ValueError(f"Movie '{title}' already exists!")
+            movies[title] = {"rating": rating, "year": year, "poster": poster}
+
+        with self._lock:
+            if self._batch_movies is not None:
+                self._batch_change(change)
+                return
+            if self.indexed:
+                with self._file_lock.exclusive():
+                    self._ensure_index()
+                    if title in self._index:
+                        raise ValueError(f"Movie '{title}' already exists!")
+                    self._append_row(title, rating, year, poster)
+                    self.save_index()
+                if self._stats is not None:
+                    self._stats.add(title, rating)
+                if self._year_index is not None:
+                    self._year_index.add(title, year)
+                if self._title_index is not None:
+                    self._title_index.add(title)
+                return
+            self._append_rows(change, [[title, rating, year, poster]])
+
+    def add_movies(self, movies):
+        def change(existing):
+            self._check_new_titles(existing, movies)
+            for title, year, rating, poster in movies:
+                existing[title] = {"rating": rating, "year": year, "poster": poster}
+
+        with self._lock:
+            if self._batch_movies is not None:
+                self._batch_change(change)
+                return
+            if self.indexed:
+                with self._file_lock.exclusive():
+                    self._ensure_index()
+                    self._check_new_titles(self._index, movies)
+                    lines = []
+                    with open(self.file_path, 'ab') as f:
+                        offset = f.tell()
+                        for title, year, rating, poster in movies:
+                            line = self._format_row(title, rating, year, poster)
+                            self._index[title] = [offset, len(line)]
+                            offset += len(line)
+                            lines.append(line)
+                        f.write(b"".join(lines))
+                    self.bytes_written += sum(map(len, lines))
+                    self._index_signature = self._committed()
+                    self.save_index()
+                for title, year, rating, poster in movies:
+                    if self._stats is not None:
+                        self._stats.add(title, rating)
+                    if self._year_index is not None:
+                        self._year_index.add(title, year)
+                    if self._title_index is not None:
+                        self._title_index.add(title)
+                return
+            self._append_rows(change, [[title, rating, year, poster]
+                                       for title, year, rating, poster in movies])
 
     def delete_movie(self, title):
-        movies = self.list_movies()
-        if title not in movies:
-            raise ValueError(f"Movie '{title}' not found!")
-        movies.pop(title)
-        with open(self.file_path, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            writer.writerow(["title", "rating", "year", "poster"])
-            for title, info in movies.items():
-                writer.writerow([title, info["rating"], info["year"], info["poster"]])
+        def change(movies):
+            if title not in movies:
+                raise ValueError(f"Movie '{title}' not found!")
+            movies.pop(title)
+
+        with self._lock:
+            if self._batch_movies is not None:
+                self._batch_change(change)
+                return
+            if self.indexed:
+                with self._file_lock.exclusive():
+                    self._ensure_index()
+                    if title not in self._index:
+                        raise ValueError(f"Movie '{title}' not found!")
+                    offset, length = self._index.pop(title)
+                    self._write_tombstone(offset, length)
+                    self.save_index()
+                if self._stats is not None:
+                    self._stats.remove(title)
+                if self._year_index is not None:
+                    self._year_index.remove(title)
+                if self._title_index is not None:
+                    self._title_index.remove(title)
+                return
+            self._rewrite(change)
 
     def update_movie(self, title, rating):
-        movies = self.list_movies()
-        if title not in movies:
-            raise ValueError(f"Movie '{title}' not found!")
-        movies[title]["rating"] = rating
-        with open(self.file_path, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            writer.writerow(["title", "rating", "year", "poster"])
-            for title, info in movies.items():
-                writer.writerow([title, info["rating"], info["year"], info["poster"]])
\ No newline at end of file
+        def change(movies):
+            if title not in movies:
+                raise ValueError(f"Movie '{title}' not found!")
+            movies[title]["rating"] = rating
+
+        with self._lock:
+            if self._batch_movies is not None:
+                self._batch_change(change)
+                return
+            if self.indexed:
+                with self._file_lock.exclusive():
+                    self._ensure_index()
+                    if title not in self._index:
+                        raise ValueError(f"Movie '{title}' not found!")
+                    moved = self._update_row(title, rating)
+                    self.save_index()
+                if self._stats is not None:
+                    if moved:
+                        # The row now sits at the end of the listing order.
+                        self._stats.remove(title)
+                        self._stats.add(title, rating)
+                    else:
+                        self._stats.update(title, rating)
+                if self._year_index is not None and moved:
+                    year = self._year_index.value(title)
+                    self._year_index.remove(title)
+                    self._year_index.add(title, year)
+                return
+            self._rewrite(change)
+
+    def _batch_change(self, change):
+        change(self._batch_movies)
+        self._batch_changes.append(change)
+
+    def _begin_batch(self):
+        # Other threads wait for the batch to end instead of joining it.
+        self._lock.acquire()
+        try:
+            with self._file_lock.shared():
+                signature = self._file_signature()
+                movies = self.list_movies()
+        except BaseException:
+            self._lock.release()
+            raise
+        self._batch_movies = movies
+        self._batch_signature = signature
+
+    def _end_batch(self, commit):
+        movies, changes = self._batch_movies, self._batch_changes
+        self._batch_movies = None
+        self._batch_changes = []
+        try:
+            if not commit or not changes:
+                return
+
+            def change(latest):
+                for each in changes:
+                    each(latest)
+            # One rewrite for the whole batch, in indexed mode too, after
+            # which the index is rebuilt and saved once.
+            self._rewrite(change, prepared=(self._batch_signature, movies))
+            if self.indexed:
+                self._rebuild_index()
+        finally:
+            self._lock.release()
+
+    def _use_index(self):
+        # Inside batch() the index still describes the file, not the
+        # working copy, so queries go through list_movies() instead.
+        return self.indexed and self._batch_movies is None
+
+    def sorted_movies(self, key="rating", reverse=True, limit=None, offset=0):
+        with self._lock:
+            if not self._use_index():
+                # Sorting a rating column beats sorting a list of dictionaries.
+                return self.list_catalog().sorted_movies(key, reverse, limit, offset)
+            with self._file_lock.shared():
+                titles = self._sorted_index(key).page(limit, offset, reverse)
+                return list(self._read_movies(titles).items())
+
+    def movies_in_range(self, min_rating=None, max_rating=None, min_year=None, max_year=None):
+        with self._lock:
+            if not self._use_index():
+                return super().movies_in_range(min_rating, max_rating, min_year, max_year)
+            with self._file_lock.shared():
+                titles = titles_in_range(self._sorted_index("rating"), self._sorted_index("year"),
+                                         min_rating, max_rating, min_year, max_year)
+                return self._read_movies(titles)
+
+    def _sorted_index(self, key):
+        self._ensure_index()
+        if key == "rating":
+            if self._stats is None:
+                self._stats = RatingStats.from_movies(self.list_movies())
+            return self._stats
+        if key == "year":
+            if self._year_index is None:
+                self._year_index = SortedIndex.from_items(
+                    (title, info["year"]) for title, info in self.list_movies().items())
+            return self._year_index
+        raise ValueError(f"Cannot sort by '{key}'")
+
+    def _read_movies(self, titles):
+        """
+        Reads the rows of the given titles through the index, in the
+        order given.
+        """
+        movies = {}
+        for title in titles:
+            raw, row = self._read_row(*self._index[title])
+            movies.update(self._parse_rows([dict(zip(HEADER, row))]))
+        return movies
+
+    def movie_stats(self):
+        with self._lock:
+            if not self._use_index():
+                return super().movie_stats()
+            return self._sorted_index("rating").summary()
+
+    def search_movies(self, query):
+        with self._lock:
+            if not self._use_index():
+                return super().search_movies(query)
+            with self._file_lock.shared():
+                self._ensure_index()
+                if self._title_index is None:
+                    self._title_index = TrigramIndex(self._index)
+                # Rows are read back in file (listing) order.
+                return self._read_movies(sorted(self._title_index.search(query), key=self._index.get))
+
+    def suggest_titles(self, query, limit=5):
+        with self._lock:
+            if not self._use_index():
+                return super().suggest_titles(query, limit)
+            self._ensure_index()
+            if self._title_index is None:
+                self._title_index = TrigramIndex(self._index)
+            return [title for title, score in self._title_index.fuzzy_search(query, limit)]
+
+    def compact(self):
+        """
+        Rewrites the file without tombstones and rebuilds the index.
+        """
+        self._check_no_batch("compact")
+        with self._lock, self._file_lock.exclusive():
+            movies = self.list_movies()
+            with temp_file(self.file_path, newline='') as f:
+                self._write_rows(f, movies)
+            replace_file(f.name, self.file_path)
+            self._file_lock.bump_version()
+            if self.indexed:
+                self._rebuild_index()
+
+    def save_index(self):
+        """
+        Writes the in-memory index to the sidecar file. It is only a cache,
+        checked against the file's signature when loaded, so it is renamed
+        into place without an fsync.
+        """
+        self._ensure_index()
+        tmp_path = f"{self.index_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            # dumps() uses the C encoder; dump() streams through the slow one.
+            f.write(json.dumps({"signature": self._index_signature, "rows": self._index}))
+        os.replace(tmp_path, self.index_path)
+
+    def _append_rows(self, check, rows):
+        """
+        Appends rows once check(movies) accepted the current catalog and
+        no one has written the file since it was read.
+        """
+        def attempt():
+            with self._file_lock.shared():
+                signature = self._file_signature()
+                movies = self.list_movies()
+            check(movies)
+            with self._file_lock.exclusive():
+                if self._file_signature() != signature:
+                    return False
+                with open(self.file_path, 'a', newline='', encoding='utf-8') as f:
+                    start = f.tell()
+                    csv.writer(f).writerows(rows)
+                    self.bytes_written += f.tell() - start
+                self._file_lock.bump_version()
+            return True
+
+        write_optimistically(self._file_lock, attempt)
+
+    def _rewrite(self, change, prepared=None):
+        """
+        Applies change(movies) to the current catalog and renames a
+        rewritten file over the old one, starting over if someone wrote
+        the file in the meantime. prepared is an optional (signature,
+        movies) with the change already applied to the catalog read at
+        signature, written unless the file changed since.
+        """
+        def attempt():
+            nonlocal prepared
+            if prepared is not None:
+                signature, movies = prepared
+                prepared = None
+            else:
+                with self._file_lock.shared():
+                    signature = self._file_signature()
+                    movies = self.list_movies()
+                change(movies)
+            with temp_file(self.file_path, newline='') as f:
+                self._write_rows(f, movies)
+            with self._file_lock.exclusive():
+                if self._file_signature() == signature:
+                    replace_file(f.name, self.file_path)
+                    self._file_lock.bump_version()
+                    return True
+            os.remove(f.name)
+            return False
+
+        write_optimistically(self._file_lock, attempt)
+
+    def _write_rows(self, f, movies):
+        padded = self.indexed
+        writer = csv.writer(f)
+        writer.writerow(HEADER)
+        for title, info in movies.items():
+            rating = info["rating"]
+            if padded:
+                rating = str(rating).ljust(RATING_WIDTH)
+            writer.writerow([title, rating, info["year"], info["poster"]])
+        self.bytes_written += f.tell()
+
+    def _file_signature(self):
+        stat = os.stat(self.file_path)
+        return [self._file_lock.version(), stat.st_mtime_ns, stat.st_size, stat.st_ino]
+
+    def _committed(self):
+        """
+        Records a write made under the exclusive lock and returns the
+        file's new signature.
+        """
+        self._file_lock.bump_version()
+        return self._file_signature()
+
+    def _ensure_index(self):
+        with self._file_lock.shared():
+            signature = self._file_signature()
+            if self._index is not None and signature == self._index_signature:
+                return
+            try:
+                with open(self.index_path, 'r', encoding='utf-8') as f:
+                    stored = json.load(f)
+                if stored["signature"] == signature:
+                    self._set_index(stored["rows"], signature)
+                    return
+            except (OSError, ValueError, KeyError):
+                pass
+            self._rebuild_index()
+
+    def _set_index(self, index, signature):
+        self._index = index
+        self._index_signature = signature
+        # Someone else changed the file, so the derived indexes are stale too.
+        self._stats = None
+        self._year_index = None
+        self._title_index = None
+
+    def _rebuild_index(self):
+        index = {}
+        for offset, length, row in self._scan_rows():
+            if row and row[0].strip():
+                index[row[0]] = [offset, length]
+        self._set_index(index, self._file_signature())
+        self.save_index()
+
+    def _scan_rows(self):
+        """
+        Yields (offset, length, row) for every data row, with the byte
+        range the row occupies in the file.
+        """
+        consumed = 0
+        with open(self.file_path, 'rb') as f:
+            def lines():
+                nonlocal consumed
+                for raw in f:
+                    consumed += len(raw)
+                    yield raw.decode('utf-8')
+            # The csv reader never reads past the end of the current
+            # record, so the consumed byte count marks each row's end.
+            reader = csv.reader(lines())
+            next(reader, None)
+            offset = consumed
+            for row in reader:
+                yield offset, consumed - offset, row
+                offset = consumed
+        self.bytes_read += consumed
+
+    @staticmethod
+    def _format_row(title, rating, year, poster, width=RATING_WIDTH):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerow([title, str(rating).ljust(width), year, poster])
+        return buffer.getvalue().encode('utf-8')
+
+    def _read_row(self, offset, length):
+        with open(self.file_path, 'rb') as f:
+            f.seek(offset)
+            raw = f.read(length)
+        self.bytes_read += length
+        return raw, next(csv.reader(io.StringIO(raw.decode('utf-8'), newline='')))
+
+    def _append_row(self, title, rating, year, poster):
+        line = self._format_row(title, rating, year, poster)
+        with open(self.file_path, 'ab') as f:
+            offset = f.tell()
+            f.write(line)
+        self.bytes_written += len(line)
+        self._index[title] = [offset, len(line)]
+        self._index_signature = self._committed()
+
+    def _write_tombstone(self, offset, length):
+        with open(self.file_path, 'r+b') as f:
+            f.seek(offset)
+            raw = f.read(length)
+            # Keep the line breaks so the rows around it are untouched.
+            f.seek(offset)
+            f.write(bytes(b if b in b"\r\n" else 0x20 for b in raw))
+        self.bytes_read += length
+        self.bytes_written += length
+        self._index_signature = self._committed()
+
+    def _update_row(self, title, rating):
+        """
+        Rewrites the row in place if it fits, else moves it to the end of
+        the file. Returns True if the row was moved.
+        """
+        offset, length = self._index[title]
+        raw, row = self._read_row(offset, length)
+        year, poster = row[2], row[3]
+        line = self._format_row(title, rating, year, poster, width=0)
+        if len(line) <= length:
+            # Pad the rating so the new row exactly covers the old one.
+            line = self._format_row(title, rating, year, poster,
+                                    width=len(str(rating)) + length - len(line))
+            with open(self.file_path, 'r+b') as f:
+                f.seek(offset)
+                f.write(line)
+            self.bytes_written += len(line)
+            self._index_signature = self._committed()
+            return False
+        self._write_tombstone(offset, length)
+        self._append_row(title, rating, year, poster)
+        return True
@@ -1,54 +1,434 @@
 import json
 import os
+import threading
+from catalog_stats import RatingStats
+from file_lock import lock_for, replace_file, temp_file, write_optimistically
 from istorage import IStorage
+from sorted_index import SortedIndex, titles_in_range
+from title_index import TrigramIndex
 
 class StorageJson(IStorage):
-    def __init__(self, file_path):
+    def __init__(self, file_path, cache=False, journal=False,
+                 compact_threshold=1024 * 1024):
+        """
+        Initialize the storage. With cache=True the parsed data is kept in
+        memory and only reloaded when the file's mtime, size or inode change;
+        rating statistics, a year index and a title search index (saved
+        next to the file) are then maintained incrementally as well.
+        With journal=True mutations are appended to a log next to the
+        snapshot, which is compacted in the background once it grows past
+        compact_threshold bytes. It implies cache=True: a write then checks
+        the cached catalog and appends one record instead of re-reading the
+        snapshot and the log.
+        Several processes may share the file: reads take a shared lock on
+        <file>.lock, and a write prepares its new snapshot without blocking
+        them, then commits it under the exclusive lock only if no one else
+        committed in between, retrying on the fresh data otherwise. "In
+        between" is judged by a version number in the lock file, which
+        every commit increments, together with the stat signature of the
+        file (and journal), which also catches edits made by hand.
+        """
         self.file_path = file_path
+        self.journal_path = file_path + ".journal"
+        self.title_index_path = file_path + ".trgm"
+        self.cache = cache or journal
+        self.journal = journal
+        self.compact_threshold = compact_threshold
+        self._lock = threading.RLock()
+        self._compaction_thread = None
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self._cache_data = None
+        self._cache_signature = None
+        self._stats = None
+        self._year_index = None
+        self._title_index = None
+        self._file_lock = lock_for(file_path)
+        # Signature of the file as of the last load or commit.
+        self._loaded_signature = None
+        # Bytes of the journal holding complete records.
+        self._journal_offset = 0
+        # Inside batch(): the edited copy of the data, the signature it was
+        # loaded at, and the changes and journal records applied to it.
+        self._batch_data = None
+        self._batch_signature = None
+        self._batch_changes = []
+        self._batch_records = []
         # Initialize file with a default structure if it doesn't exist.
         if not os.path.exists(self.file_path):
-            with open(self.file_path, 'w', encoding='utf-8') as f:
-                json.dump({"movies": {}}, f, indent=4)
+            with self._file_lock.exclusive():
+                if not os.path.exists(self.file_path):
+                    with temp_file(self.file_path) as f:
+                        json.dump({"movies": {}}, f, indent=4)
+                    replace_file(f.name, self.file_path)
 
-    def _load_data(self):
-        with open(self.file_path, 'r', encoding='utf-8') as f:
+    def _file_signature(self):
+        stat = os.stat(self.file_path)
+        signature = (self._file_lock.version(), stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        if self.journal:
             try:
-                data = json.load(f)
-            except json.JSONDecodeError:
-                data = {"movies": {}}
-        return data
+                stat = os.stat(self.journal_path)
+                signature += (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+            except FileNotFoundError:
+                pass
+        return signature
+
+    def _load_data(self):
+        with self._lock:
+            if self._batch_data is not None:
+                return self._batch_data
+            return self._read_data()
+
+    def _read_data(self):
+        with self._file_lock.shared():
+            signature = self._file_signature()
+            if self.cache:
+                if self._cache_data is not None and signature == self._cache_signature:
+                    self.cache_hits += 1
+                    return self._cache_data
+                self.cache_misses += 1
+            with open(self.file_path, 'r', encoding='utf-8') as f:
+                self.bytes_read += os.fstat(f.fileno()).st_size
+                try:
+                    data = json.load(f)
+                except json.JSONDecodeError as e:
+                    # Never mistake a damaged file for an empty catalog:
+                    # the next write would make the loss permanent.
+                    raise ValueError(f"Data file '{self.file_path}' is corrupted: {e}") from e
+            if self.journal:
+                self._replay_journal(data)
+            self._loaded_signature = signature
+            if self.cache:
+                self._cache_data = data
+                self._cache_signature = signature
+                self._stats = None
+                self._year_index = None
+                self._title_index = None
+            return data
+
+    def _replay_journal(self, data):
+        """
+        Applies the journal records on top of the snapshot. A record that
+        cannot be decoded (e.g. torn by a crash mid-write) and everything
+        after it is ignored; the next commit cuts it off the log.
+        """
+        movies = data.setdefault("movies", {})
+        self._journal_offset = 0
+        try:
+            f = open(self.journal_path, 'rb')
+        except FileNotFoundError:
+            return
+        with f:
+            self.bytes_read += os.fstat(f.fileno()).st_size
+            for line in f:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("incomplete record")
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                self._apply_record(movies, record)
+                self._journal_offset += len(line)
+
+    @staticmethod
+    def _apply_record(movies, record):
+        # Replaying is idempotent, so records already folded into the
+        # snapshot by an interrupted compaction do no harm.
+        op = record["op"]
+        title = record["title"]
+        if op == "add":
+            movies[title] = {"year": record["year"], "rating": record["rating"],
+                             "poster": record["poster"]}
+        elif op == "delete":
+            movies.pop(title, None)
+        elif op == "update":
+            if title in movies:
+                movies[title]["rating"] = record["rating"]
+
+    def _mutate(self, change):
+        """
+        Runs change(movies), which validates, edits the dictionary in place
+        and returns the journal records, against the latest data and
+        commits the result. Inside batch() only the working copy is edited.
+        """
+        with self._lock:
+            if self._batch_data is not None:
+                self._batch_records += change(self._batch_data["movies"])
+                self._batch_changes.append(change)
+                return
+            self._apply_changes([change])
+
+    def _apply_changes(self, changes, prepared=None):
+        """
+        Applies the changes to the latest data and commits the result with
+        one write. prepared is an optional (data, signature, records) with
+        the changes already applied to the data loaded at signature; it is
+        used unless another process committed since. Otherwise, and after
+        losing a race, the changes are re-applied to the fresh data.
+        """
+        def attempt():
+            nonlocal prepared
+            if prepared is not None:
+                data, signature, records = prepared
+                prepared = None
+            else:
+                data = self._load_data()
+                signature = self._loaded_signature
+                movies = data.setdefault("movies", {})
+                try:
+                    records = [record for change in changes for record in change(movies)]
+                except ValueError:
+                    # Earlier changes may already have edited the cache.
+                    self.clear_cache()
+                    raise
+            if self._commit(data, signature, *records):
+                return True
+            # Lost the race: drop our edited copy before trying again.
+            self.clear_cache()
+            return False
 
-    def _save_data(self, data):
-        with open(self.file_path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=4)
+        with self._lock:
+            write_optimistically(self._file_lock, attempt)
+
+    def _begin_batch(self):
+        self._lock.acquire()
+        try:
+            data = self._load_data()
+        except BaseException:
+            self._lock.release()
+            raise
+        # The cache keeps the committed data until the batch commits.
+        self._batch_data = dict(data, movies={title: dict(info)
+                                              for title, info in data.get("movies", {}).items()})
+        self._batch_signature = self._loaded_signature
+
+    def _end_batch(self, commit):
+        data, changes, records = self._batch_data, self._batch_changes, self._batch_records
+        self._batch_data = None
+        self._batch_changes = []
+        self._batch_records = []
+        try:
+            if not commit:
+                # The derived indexes followed the working copy.
+                self.clear_cache()
+            elif changes:
+                self._apply_changes(changes, (data, self._batch_signature, records))
+        finally:
+            self._lock.release()
+
+    def _commit(self, data, signature, *records):
+        """
+        Persists a mutation, either as journal records or as a new snapshot
+        renamed over the old one. Returns False without writing if the
+        file no longer has the given signature.
+        """
+        try:
+            if self.journal:
+                payload = "".join(json.dumps(record) + "\n" for record in records).encode('utf-8')
+                with self._file_lock.exclusive():
+                    if self._file_signature() != signature:
+                        return False
+                    with open(self.journal_path, 'ab') as f:
+                        # Cut off a torn record left by a crashed writer.
+                        f.truncate(self._journal_offset)
+                        f.write(payload)
+                    self._journal_offset += len(payload)
+                    self._file_lock.bump_version()
+                    signature = self._file_signature()
+                self.bytes_written += len(payload)
+            else:
+                # The slow part happens before taking the exclusive lock.
+                with temp_file(self.file_path) as f:
+                    json.dump(data, f, indent=4)
+                    self.bytes_written += f.tell()
+                with self._file_lock.exclusive():
+                    if self._file_signature() != signature:
+                        os.remove(f.name)
+                        return False
+                    replace_file(f.name, self.file_path)
+                    self._file_lock.bump_version()
+                    signature = self._file_signature()
+        except Exception:
+            # A failed write leaves the cache in an unknown state.
+            self.clear_cache()
+            raise
+        self._loaded_signature = signature
+        if self.cache:
+            # Our own write must not count as an outside edit.
+            self._cache_data = data
+            self._cache_signature = signature
+        if self.journal and self._journal_offset >= self.compact_threshold:
+            self._start_compaction()
+        return True
+
+    def _start_compaction(self):
+        if self._compaction_thread is not None and self._compaction_thread.is_alive():
+            return
+        self._compaction_thread = threading.Thread(target=self.compact, daemon=True)
+        self._compaction_thread.start()
+
+    def compact(self):
+        """
+        Folds the journal into a fresh snapshot and empties the log.
+        """
+        self._check_no_batch("compact")
+        with self._lock, self._file_lock.exclusive():
+            data = self._load_data()
+            with temp_file(self.file_path) as f:
+                json.dump(data, f, indent=4)
+                self.bytes_written += f.tell()
+            replace_file(f.name, self.file_path)
+            if os.path.exists(self.journal_path):
+                open(self.journal_path, 'w').close()
+            self._journal_offset = 0
+            self._file_lock.bump_version()
+            self._loaded_signature = self._file_signature()
+            if self.cache:
+                self._cache_data = data
+                self._cache_signature = self._loaded_signature
+
+    def clear_cache(self):
+        """
+        Drops the cached data so the next call re-reads the file.
+        """
+        self._cache_data = None
+        self._cache_signature = None
+        self._stats = None
+        self._year_index = None
+        self._title_index = None
 
     def list_movies(self):
         data = self._load_data()
         return data.get("movies", {})
 
     def add_movie(self, title, year, rating, poster):
-        data = self._load_data()
-        movies = data.get("movies", {})
-        if title in movies:
-            raise ValueError(f"Movie '{title}' already exists!")
-        movies[title] = {"year": year, "rating": rating, "poster": poster}
-        data["movies"] = movies
-        self._save_data(data)
+        def change(movies):
+            if title in movies:
+                raise ValueError(f"Movie '{title}' already exists!")
+            movies[title] = {"year": year, "rating": rating, "poster": poster}
+            return [{"op": "add", "title": title, "year": year,
+                     "rating": rating, "poster": poster}]
+
+        with self._lock:
+            self._mutate(change)
+            if self._stats is not None:
+                self._stats.add(title, rating)
+            if self._year_index is not None:
+                self._year_index.add(title, year)
+            if self._title_index is not None:
+                self._title_index.add(title)
+
+    def add_movies(self, new_movies):
+        def change(movies):
+            self._check_new_titles(movies, new_movies)
+            records = []
+            for title, year, rating, poster in new_movies:
+                movies[title] = {"year": year, "rating": rating, "poster": poster}
+                records.append({"op": "add", "title": title, "year": year,
+                                "rating": rating, "poster": poster})
+            return records
+
+        with self._lock:
+            self._mutate(change)
+            for title, year, rating, poster in new_movies:
+                if self._stats is not None:
+                    self._stats.add(title, rating)
+                if self._year_index is not None:
+                    self._year_index.add(title, year)
+                if self._title_index is not None:
+                    self._title_index.add(title)
 
     def delete_movie(self, title):
-        data = self._load_data()
-        movies = data.get("movies", {})
-        if title not in movies:
-            raise ValueError(f"Movie '{title}' not found!")
-        del movies[title]
-        data["movies"] = movies
-        self._save_data(data)
+        def change(movies):
+            if title not in movies:
+                raise ValueError(f"Movie '{title}' not found!")
+            del movies[title]
+            return [{"op": "delete", "title": title}]
+
+        with self._lock:
+            self._mutate(change)
+            if self._stats is not None:
+                self._stats.remove(title)
+            if self._year_index is not None:
+                self._year_index.remove(title)
+            if self._title_index is not None:
+                self._title_index.remove(title)
 
     def update_movie(self, title, rating):
-        data = self._load_data()
-        movies = data.get("movies", {})
-        if title not in movies:
-            raise ValueError(f"Movie '{title}' not found!")
-        movies[title]["rating"] = rating
-        data["movies"] = movies
-        self._save_data(data)
\ No newline at end of file
+        def change(movies):
+            if title not in movies:
+                raise ValueError(f"Movie '{title}' not found!")
+            movies[title]["rating"] = rating
+            return [{"op": "update", "title": title, "rating": rating}]
+
+        with self._lock:
+            self._mutate(change)
+            if self._stats is not None:
+                self._stats.update(title, rating)
+
+    def movie_stats(self):
+        if not self.cache:
+            return super().movie_stats()
+        with self._lock:
+            movies = self.list_movies()
+            if self._stats is None:
+                self._stats = RatingStats.from_movies(movies)
+            return self._stats.summary()
+
+    def sorted_movies(self, key="rating", reverse=True, limit=None, offset=0):
+        if not self.cache:
+            return super().sorted_movies(key, reverse, limit, offset)
+        with self._lock:
+            movies = self.list_movies()
+            index = self._sorted_index(key, movies)
+            return [(title, movies[title]) for title in index.page(limit, offset, reverse)]
+
+    def movies_in_range(self, min_rating=None, max_rating=None, min_year=None, max_year=None):
+        if not self.cache:
+            return super().movies_in_range(min_rating, max_rating, min_year, max_year)
+        with self._lock:
+            movies = self.list_movies()
+            titles = titles_in_range(self._sorted_index("rating", movies),
+                                     self._sorted_index("year", movies),
+                                     min_rating, max_rating, min_year, max_year)
+            return {title: movies[title] for title in titles}
+
+    def _sorted_index(self, key, movies):
+        if key == "rating":
+            if self._stats is None:
+                self._stats = RatingStats.from_movies(movies)
+            return self._stats
+        if key == "year":
+            if self._year_index is None:
+                self._year_index = SortedIndex.from_items((title, info["year"]) for title, info in movies.items())
+            return self._year_index
+        raise ValueError(f"Cannot sort by '{key}'")
+
+    def search_movies(self, query):
+        if not self.cache:
+            return super().search_movies(query)
+        with self._lock:
+            movies = self.list_movies()
+            return {title: movies[title] for title in self._get_title_index(movies).search(query)}
+
+    def suggest_titles(self, query, limit=5):
+        if not self.cache:
+            return super().suggest_titles(query, limit)
+        with self._lock:
+            index = self._get_title_index(self.list_movies())
+            return [title for title, score in index.fuzzy_search(query, limit)]
+
+    def _get_title_index(self, movies):
+        if self._title_index is None and self._batch_data is not None:
+            # Uncommitted titles must not end up in the saved index.
+            self._title_index = TrigramIndex(movies)
+        if self._title_index is None:
+            signature = list(self._cache_signature)
+            index = TrigramIndex.load(self.title_index_path, signature)
+            if index is None:
+                index = TrigramIndex(movies)
+                index.save(self.title_index_path, signature)
+            self._title_index = index
+        return self._title_index
@@ -0,0 +1,289 @@
+import functools
+import random
+import sqlite3
+import sys
+import threading
+from contextlib import contextmanager
+from catalog import Catalog
+from istorage import IStorage
+
+# Rows fetched at a time by iter_movies().
+FETCH_SIZE = 1000
+
+
+def _serialized(method):
+    """
+    Runs a method holding the storage's lock, so threads take turns on
+    the shared connection.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+class StorageSqlite(IStorage):
+    def __init__(self, file_path):
+        """
+        Initialize the storage on a SQLite database. The title is the
+        primary key and rating/year are indexed, so a mutation does not
+        have to touch the rest of the catalog.
+        """
+        self.file_path = file_path
+        # The connection may be used from any thread (e.g. the API
+        # server's worker); _lock keeps those uses from interleaving.
+        self._conn = sqlite3.connect(file_path, check_same_thread=False)
+        self._lock = threading.RLock()
+        # True while batch() holds a transaction open.
+        self._in_batch = False
+        # WAL lets readers run while a write is in progress.
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        # SQLite's lower() only folds ASCII; use Python's for searches.
+        self._conn.create_function("py_lower", 1, str.lower, deterministic=True)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS movies ("
+                "title TEXT PRIMARY KEY, "
+                "rating REAL NOT NULL, "
+                "year INTEGER NOT NULL, "
+                "poster TEXT NOT NULL DEFAULT '')"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_movies_rating ON movies(rating)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_movies_year ON movies(year)")
+            # Running totals kept up to date by triggers, so stats do not
+            # have to aggregate the whole table.
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS movie_totals ("
+                "id INTEGER PRIMARY KEY CHECK (id = 0), "
+                "count INTEGER NOT NULL, "
+                "total REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "INSERT OR IGNORE INTO movie_totals (id, count, total) "
+                "SELECT 0, COUNT(*), COALESCE(SUM(rating), 0) FROM movies"
+            )
+            self._conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS movies_totals_insert AFTER INSERT ON movies BEGIN "
+                "UPDATE movie_totals SET count = count + 1, total = total + NEW.rating; END"
+            )
+            self._conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS movies_totals_delete AFTER DELETE ON movies BEGIN "
+                "UPDATE movie_totals SET count = count - 1, total = total - OLD.rating; END"
+            )
+            self._conn.execute(
+                "CREATE TRIGGER IF NOT EXISTS movies_totals_update AFTER UPDATE OF rating ON movies BEGIN "
+                "UPDATE movie_totals SET total = total - OLD.rating + NEW.rating; END"
+            )
+
+    @_serialized
+    def close(self):
+        self._conn.close()
+
+    @contextmanager
+    def _transaction(self):
+        """
+        Commits the statements run inside it, or rolls them back on an
+        error. Inside batch() a savepoint does the same within the batch's
+        transaction, which only commits at the end.
+        """
+        if not self._in_batch:
+            with self._conn:
+                yield
+            return
+        self._conn.execute("SAVEPOINT statement")
+        try:
+            yield
+        except BaseException:
+            self._conn.execute("ROLLBACK TO statement")
+            raise
+        finally:
+            self._conn.execute("RELEASE statement")
+
+    def _begin_batch(self):
+        # Other threads wait until the batch ends instead of joining it.
+        self._lock.acquire()
+        try:
+            # IMMEDIATE takes the write lock now rather than at the first write.
+            self._conn.execute("BEGIN IMMEDIATE")
+        except BaseException:
+            self._lock.release()
+            raise
+        self._in_batch = True
+
+    def _end_batch(self, commit):
+        self._in_batch = False
+        try:
+            if not commit:
+                self._conn.rollback()
+                return
+            try:
+                self._conn.commit()
+            except sqlite3.Error:
+                self._conn.rollback()
+                raise
+        finally:
+            self._lock.release()
+
+    @_serialized
+    def list_movies(self):
+        rows = self._conn.execute("SELECT title, rating, year, poster FROM movies ORDER BY rowid")
+        return {title: {"rating": rating, "year": year, "poster": poster}
+                for title, rating, year, poster in rows}
+
+    @_serialized
+    def list_catalog(self):
+        return Catalog.from_rows(self._conn.execute(
+            "SELECT title, rating, year, poster FROM movies ORDER BY rowid"))
+
+    def iter_movies(self):
+        # The lock is only held while fetching, never while the caller
+        # works on the rows.
+        with self._lock:
+            cursor = self._conn.execute("SELECT title, rating, year, poster FROM movies ORDER BY rowid")
+        while True:
+            with self._lock:
+                rows = cursor.fetchmany(FETCH_SIZE)
+            if not rows:
+                return
+            for title, rating, year, poster in rows:
+                yield title, {"rating": rating, "year": year, "poster": poster}
+
+    @_serialized
+    def add_movie(self, title, year, rating, poster):
+        try:
+            with self._transaction():
+                self._conn.execute(
+                    "INSERT INTO movies (title, rating, year, poster) VALUES (?, ?, ?, ?)",
+                    (title, rating, year, poster),
+                )
+        except sqlite3.IntegrityError:
+            raise ValueError(f"Movie '{title}' already exists!")
+
+    @_serialized
+    def add_movies(self, movies):
+        self._check_new_titles((), movies)
+        try:
+            with self._transaction():
+                self._conn.executemany(
+                    "INSERT INTO movies (title, rating, year, poster) VALUES (?, ?, ?, ?)",
+                    [(title, rating, year, poster) for title, year, rating, poster in movies],
+                )
+        except sqlite3.IntegrityError:
+            existing = self._conn.execute(
+                "SELECT title FROM movies WHERE title IN (%s)" % ",".join("?" * len(movies)),
+                [movie[0] for movie in movies],
+            ).fetchone()
+            raise ValueError(f"Movie '{existing[0]}' already exists!")
+
+    @_serialized
+    def delete_movie(self, title):
+        with self._transaction():
+            cursor = self._conn.execute("DELETE FROM movies WHERE title = ?", (title,))
+        if cursor.rowcount == 0:
+            raise ValueError(f"Movie '{title}' not found!")
+
+    @_serialized
+    def update_movie(self, title, rating):
+        with self._transaction():
+            cursor = self._conn.execute("UPDATE movies SET rating = ? WHERE title = ?", (rating, title))
+        if cursor.rowcount == 0:
+            raise ValueError(f"Movie '{title}' not found!")
+
+    @_serialized
+    def search_movies(self, query):
+        rows = self._conn.execute(
+            "SELECT title, rating, year, poster FROM movies "
+            "WHERE instr(py_lower(title), ?) > 0 ORDER BY rowid",
+            (query.lower(),),
+        )
+        return {title: {"rating": rating, "year": year, "poster": poster}
+                for title, rating, year, poster in rows}
+
+    @_serialized
+    def sorted_movies(self, key="rating", reverse=True, limit=None, offset=0):
+        if key not in ("rating", "year"):
+            raise ValueError(f"Cannot sort by '{key}'")
+        direction = "DESC" if reverse else "ASC"
+        rows = self._conn.execute(
+            f"SELECT title, rating, year, poster FROM movies "
+            f"ORDER BY {key} {direction}, rowid LIMIT ? OFFSET ?",
+            (-1 if limit is None else limit, offset),
+        )
+        return [(title, {"rating": rating, "year": year, "poster": poster})
+                for title, rating, year, poster in rows]
+
+    @_serialized
+    def movies_in_range(self, min_rating=None, max_rating=None, min_year=None, max_year=None):
+        conditions, params = [], []
+        for column, operator, bound in (("rating", ">=", min_rating), ("rating", "<=", max_rating),
+                                        ("year", ">=", min_year), ("year", "<=", max_year)):
+            if bound is not None:
+                conditions.append(f"{column} {operator} ?")
+                params.append(bound)
+        where = f"WHERE {' AND '.join(conditions)} " if conditions else ""
+        rows = self._conn.execute(
+            f"SELECT title, rating, year, poster FROM movies {where}ORDER BY rowid", params)
+        return {title: {"rating": rating, "year": year, "poster": poster}
+                for title, rating, year, poster in rows}
+
+    @_serialized
+    def movie_stats(self):
+        count, total = self._conn.execute("SELECT count, total FROM movie_totals").fetchone()
+        if count == 0:
+            return None
+        # The rating index answers these without a full sort.
+        middle = [rating for rating, in self._conn.execute(
+            "SELECT rating FROM movies ORDER BY rating LIMIT ? OFFSET ?",
+            (2 - count % 2, (count - 1) // 2),
+        )]
+        best = self._conn.execute(
+            "SELECT title, rating FROM movies ORDER BY rating DESC, rowid LIMIT 1").fetchone()
+        worst = self._conn.execute(
+            "SELECT title, rating FROM movies ORDER BY rating ASC, rowid LIMIT 1").fetchone()
+        return {
+            "count": count,
+            "average": total / count,
+            "median": sum(middle) / len(middle),
+            "best": best,
+            "worst": worst,
+        }
+
+    @_serialized
+    def random_movie(self):
+        count, = self._conn.execute("SELECT count FROM movie_totals").fetchone()
+        if count == 0:
+            return None
+        title, rating, year, poster = self._conn.execute(
+            "SELECT title, rating, year, poster FROM movies LIMIT 1 OFFSET ?",
+            (random.randrange(count),),
+        ).fetchone()
+        return title, {"rating": rating, "year": year, "poster": poster}
+
+    @_serialized
+    def import_from(self, storage):
+        """
+        Copies every movie of another IStorage (e.g. StorageJson or
+        StorageCsv) in one transaction. Titles that already exist are kept.
+        Returns the number of movies imported.
+        """
+        rows = [(title, info.get("rating", 0.0), info.get("year", 0), info.get("poster", ""))
+                for title, info in storage.list_movies().items()]
+        with self._transaction():
+            cursor = self._conn.executemany(
+                "INSERT OR IGNORE INTO movies (title, rating, year, poster) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+        return cursor.rowcount
+
+
+if __name__ == "__main__":
+    # Usage: python storage_sqlite.py <source .json/.csv> <target .db>
+    from storage_csv import StorageCsv
+    from storage_json import StorageJson
+    source_path, target_path = sys.argv[1], sys.argv[2]
+    source = StorageCsv(source_path) if source_path.endswith(".csv") else StorageJson(source_path)
+    target = StorageSqlite(target_path)
+    print(f"Imported {target.import_from(source)} movies into {target_path}")
+    target.close()
@@ -0,0 +1,134 @@
+import json
+from collections import Counter
+
+
+def title_grams(text):
+    """
+    Returns the set of trigrams of a lowercased title, padded so the
+    start and end of the title form grams of their own.
+    """
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class TrigramIndex:
+    def __init__(self, titles=()):
+        """
+        An inverted index from title trigrams to titles, answering
+        substring and fuzzy searches without scanning every title.
+        """
+        self._postings = {}
+        self._lowered = {}
+        self._gram_counts = {}
+        self._order = {}
+        self._next_order = 0
+        for title in titles:
+            self.add(title)
+
+    def __len__(self):
+        return len(self._lowered)
+
+    def __contains__(self, title):
+        return title in self._lowered
+
+    def add(self, title):
+        lowered = title.lower()
+        grams = title_grams(lowered)
+        self._lowered[title] = lowered
+        self._gram_counts[title] = len(grams)
+        self._order[title] = self._next_order
+        self._next_order += 1
+        for gram in grams:
+            self._postings.setdefault(gram, set()).add(title)
+
+    def remove(self, title):
+        lowered = self._lowered.pop(title)
+        del self._gram_counts[title]
+        del self._order[title]
+        for gram in title_grams(lowered):
+            titles = self._postings[gram]
+            titles.discard(title)
+            if not titles:
+                del self._postings[gram]
+
+    def search(self, query):
+        """
+        Returns the titles containing query, case-insensitive, in the
+        order they were added.
+        """
+        query = query.lower()
+        if len(query) < 3:
+            if not query:
+                return list(self._lowered)
+            # Too short for a trigram: merge the postings of every gram
+            # that contains the query.
+            candidates = set()
+            for gram, titles in self._postings.items():
+                if query in gram:
+                    candidates |= titles
+        else:
+            grams = sorted((query[i:i + 3] for i in range(len(query) - 2)),
+                           key=lambda gram: len(self._postings.get(gram, ())))
+            candidates = set(self._postings.get(grams[0], ()))
+            for gram in grams[1:]:
+                if not candidates:
+                    break
+                candidates &= self._postings.get(gram, set())
+        # The grams only narrow the candidates down; check the order too.
+        matches = [title for title in candidates if query in self._lowered[title]]
+        matches.sort(key=self._order.__getitem__)
+        return matches
+
+    def fuzzy_search(self, query, limit=10, min_score=0.1):
+        """
+        Returns up to limit (title, score) pairs ranked by trigram
+        similarity to query, which tolerates typos.
+        """
+        grams = title_grams(query.lower())
+        shared = Counter()
+        for gram in grams:
+            shared.update(self._postings.get(gram, ()))
+        results = []
+        for title, common in shared.items():
+            score = common / (len(grams) + self._gram_counts[title] - common)
+            if score >= min_score:
+                results.append((title, score))
+        results.sort(key=lambda x: (-x[1], x[0]))
+        return results[:limit]
+
+    def save(self, file_path, signature=None):
+        """
+        Writes the index to file_path, tagged with the signature of the
+        data file it was built from.
+        """
+        titles = list(self._lowered)
+        ids = {title: i for i, title in enumerate(titles)}
+        postings = {gram: [ids[title] for title in members]
+                    for gram, members in self._postings.items()}
+        with open(file_path, 'w', encoding='utf-8') as f:
+            json.dump({"signature": signature, "titles": titles, "postings": postings}, f)
+
+    @classmethod
+    def load(cls, file_path, signature=None):
+        """
+        Loads an index saved by save(). Returns None if the file is
+        missing, unreadable or was built for another signature.
+        """
+        try:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                stored = json.load(f)
+            if stored["signature"] != signature:
+                return None
+            titles = stored["titles"]
+            postings = {gram: {titles[i] for i in ids}
+                        for gram, ids in stored["postings"].items()}
+        except (OSError, ValueError, KeyError, IndexError):
+            return None
+        index = cls()
+        for order, title in enumerate(titles):
+            index._lowered[title] = title.lower()
+            index._gram_counts[title] = len(title_grams(index._lowered[title]))
+            index._order[title] = order
+        index._next_order = len(titles)
+        index._postings = postings
+        return index
@@ -1,8 +1,43 @@
+import asyncio
+import hashlib
+import http.client
 import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
 import pytest
 
 from storage_json import StorageJson
+from storage_csv import StorageCsv
+from storage_sqlite import StorageSqlite
+from storage_binary import HEADER, HEADER_SIZE, StorageBinary
+from istorage import IStorage as IStorageDefaults
 from movie_app import MovieApp
+from omdb_client import OmdbClient
+from bulk_import import BulkImporter, TokenBucket, read_titles
+from rating_refresh import RatingRefresher, load_timestamps
+from poster_mirror import PosterMirror
+from catalog import Catalog
+from catalog_stats import RatingStats, compute_stats
+from title_index import TrigramIndex
+from sorted_index import SortedIndex
+import site_generator
+from site_generator import SiteGenerator, movie_card
+from site_search import SearchSite, search_key, title_tokens
+import benchmark
+from benchmark import compare, run_benchmarks, synthetic_movies
+from metrics import InstrumentedOmdbClient, InstrumentedStorage, Metrics
+from api_server import ApiServer
+from file_lock import FileLock
+import convert
+import main
 
 # A fake response class to simulate requests responses.
 class FakeResponse:
@@ -12,6 +47,9 @@ class FakeResponse:
     def json(self):
         return self._json_data
 
+    def raise_for_status(self):
+        pass
+
 # ---------------------------
 # Fixtures for Storage and App
 # ---------------------------
@@ -30,6 +68,7 @@ def storage(temp_storage_file):
 @pytest.fixture
 def movie_app(storage, tmp_path):
     app = MovieApp(storage)
+    app._omdb.cache_dir = str(tmp_path / "omdb_cache")
     # Create temporary files for the HTML template and website output.
     template_file = tmp_path / "template.html"
     website_file = tmp_path / "website.html"
@@ -83,9 +122,9 @@ def test_command_add_movie_success(movie_app, storage, monkeypatch):
         "Poster": "https://example.com/inception.jpg",
         "Response": "True"
     }
-    def fake_get(url):
+    def fake_get(url, params=None, timeout=None):
         return FakeResponse(fake_api_response)
-    monkeypatch.setattr("movie_app.requests.get", fake_get)
+    monkeypatch.setattr(movie_app._omdb.session, "get", fake_get)
     inputs = iter(["Inception", ""])
     monkeypatch.setattr("builtins.input", lambda prompt="": next(inputs))
     movie_app._command_add_movie()
@@ -100,9 +139,9 @@ def test_command_add_movie_failure(movie_app, storage, monkeypatch):
         "Response": "False",
         "Error": "Movie not found!"
     }
-    def fake_get(url):
+    def fake_get(url, params=None, timeout=None):
         return FakeResponse(fake_api_response)
-    monkeypatch.setattr("movie_app.requests.get", fake_get)
+    monkeypatch.setattr(movie_app._omdb.session, "get", fake_get)
     inputs = iter(["Nonexistent", ""])
     monkeypatch.setattr("builtins.input", lambda prompt="": next(inputs))
     movie_app._command_add_movie()
@@ -199,4 +238,1332 @@ def test_command_generate_website(movie_app, storage, monkeypatch):
         content = f.read()
     assert "__TEMPLATE_TITLE__" not in content
     assert "__TEMPLATE_MOVIE_GRID__" not in content
-    assert "Test Movie" in content
\ No newline at end of file
+    assert "Test Movie" in content
+    site_dir = os.path.dirname(movie_app.website_file) or "."
+    assert os.path.exists(os.path.join(site_dir, "search.html"))
+    assert search_titles(os.path.join(site_dir, "site_data"), "test") == ["Test Movie"]
+# ---------------------------
+# Tests for StorageJson cache
+# ---------------------------
+def test_cache_hits_and_misses(temp_storage_file):
+    cached = StorageJson(temp_storage_file, cache=True)
+    cached.list_movies()
+    cached.list_movies()
+    assert cached.cache_misses == 1
+    assert cached.cache_hits == 1
+    # Our own writes keep the cache valid.
+    cached.add_movie("Test Movie", 2000, 7.5, "http://example.com/test.jpg")
+    assert "Test Movie" in cached.list_movies()
+    assert cached.cache_misses == 1
+
+def test_cache_sees_outside_edits(temp_storage_file):
+    cached = StorageJson(temp_storage_file, cache=True)
+    assert cached.list_movies() == {}
+    # Another writer changes the file behind the cache's back.
+    StorageJson(temp_storage_file).add_movie("Other Movie", 1999, 6.0, "")
+    assert "Other Movie" in cached.list_movies()
+    assert cached.cache_misses == 2
+
+# ---------------------------
+# Tests for StorageJson journal
+# ---------------------------
+def test_journal_replays_mutations(temp_storage_file):
+    journaled = StorageJson(temp_storage_file, journal=True)
+    journaled.add_movie("Movie A", 2000, 7.0, "http://example.com/a.jpg")
+    journaled.add_movie("Movie B", 2001, 8.0, "http://example.com/b.jpg")
+    journaled.update_movie("Movie A", 9.0)
+    journaled.delete_movie("Movie B")
+    # The snapshot is untouched until compaction.
+    assert StorageJson(temp_storage_file).list_movies() == {}
+    movies = StorageJson(temp_storage_file, journal=True).list_movies()
+    assert list(movies) == ["Movie A"]
+    assert movies["Movie A"]["rating"] == 9.0
+
+def test_journal_ignores_torn_record(temp_storage_file):
+    journaled = StorageJson(temp_storage_file, journal=True)
+    journaled.add_movie("Movie A", 2000, 7.0, "http://example.com/a.jpg")
+    with open(journaled.journal_path, "a", encoding="utf-8") as f:
+        f.write('{"op": "add", "title": "Mov')
+    assert list(journaled.list_movies()) == ["Movie A"]
+    # The torn tail is cut off so later records are not glued onto it.
+    journaled.add_movie("Movie B", 2001, 8.0, "http://example.com/b.jpg")
+    assert list(journaled.list_movies()) == ["Movie A", "Movie B"]
+
+def test_journal_writes_do_not_reread_the_snapshot(temp_storage_file):
+    journaled = StorageJson(temp_storage_file, journal=True, compact_threshold=10 ** 9)
+    journaled.add_movie("Movie A", 2000, 7.0, "http://example.com/a.jpg")
+    bytes_read = journaled.bytes_read
+    journaled.add_movie("Movie B", 2001, 8.0, "http://example.com/b.jpg")
+    journaled.update_movie("Movie A", 9.0)
+    journaled.delete_movie("Movie B")
+    assert journaled.bytes_read == bytes_read
+
+def test_create_storage_picks_up_the_journal(temp_storage_file):
+    assert not main.create_storage(temp_storage_file).journal
+    journaled = main.create_storage(temp_storage_file, journal=True)
+    journaled.add_movie("Movie A", 2000, 7.0, "http://example.com/a.jpg")
+    # A later run without --journal still replays it.
+    reopened = main.create_storage(temp_storage_file)
+    assert reopened.journal
+    assert list(reopened.list_movies()) == ["Movie A"]
+
+def test_journal_compaction(temp_storage_file):
+    journaled = StorageJson(temp_storage_file, journal=True, compact_threshold=1)
+    journaled.add_movie("Movie A", 2000, 7.0, "http://example.com/a.jpg")
+    journaled._compaction_thread.join()
+    with open(temp_storage_file, "r", encoding="utf-8") as f:
+        assert "Movie A" in json.load(f)["movies"]
+    with open(journaled.journal_path, "rb") as f:
+        assert f.read() == b""
+
+# ---------------------------
+# Tests for indexed StorageCsv
+# ---------------------------
+@pytest.fixture
+def csv_storage(tmp_path):
+    return StorageCsv(str(tmp_path / "movies_data.csv"), indexed=True)
+
+def test_indexed_csv_add_and_duplicate(csv_storage):
+    csv_storage.add_movie("Movie, The", 2000, 7.5, "http://example.com/a.jpg")
+    movies = csv_storage.list_movies()
+    assert movies["Movie, The"] == {"rating": 7.5, "year": 2000,
+                                    "poster": "http://example.com/a.jpg"}
+    with pytest.raises(ValueError):
+        csv_storage.add_movie("Movie, The", 2000, 7.5, "")
+
+def test_indexed_csv_update_and_delete(csv_storage):
+    csv_storage.add_movie("Movie A", 2000, 7.0, "http://example.com/a.jpg")
+    csv_storage.add_movie("Movie B", 2001, 8.0, "http://example.com/b.jpg")
+    size = os.path.getsize(csv_storage.file_path)
+    csv_storage.update_movie("Movie A", 9.25)
+    # The padded rating lets the update happen in place.
+    assert os.path.getsize(csv_storage.file_path) == size
+    csv_storage.update_movie("Movie B", 1234567.125)
+    csv_storage.delete_movie("Movie A")
+    movies = csv_storage.list_movies()
+    assert movies == {"Movie B": {"rating": 1234567.125, "year": 2001,
+                                  "poster": "http://example.com/b.jpg"}}
+    with pytest.raises(ValueError):
+        csv_storage.delete_movie("Movie A")
+    # A fresh instance picks the sidecar index back up.
+    reopened = StorageCsv(csv_storage.file_path, indexed=True)
+    with pytest.raises(ValueError):
+        reopened.add_movie("Movie B", 2001, 8.0, "")
+
+def test_indexed_csv_sidecar_follows_every_write(csv_storage, monkeypatch):
+    fill_catalog(csv_storage)
+    csv_storage.update_movie("Movie A", 9.25)
+    csv_storage.delete_movie("Other D")
+    with csv_storage.batch():
+        csv_storage.add_movie("Movie E", 2005, 6.0, "")
+    csv_storage.add_movie("Movie F", 2006, 5.0, "")
+    # A new process loads the sidecar instead of scanning the file.
+    monkeypatch.setattr(StorageCsv, "_scan_rows", lambda self: pytest.fail("full scan"))
+    reopened = StorageCsv(csv_storage.file_path, indexed=True)
+    reopened.update_movie("Movie E", 6.5)
+    assert sorted(reopened.search_movies("movie")) == ["Movie A", "Movie B", "Movie E", "Movie F"]
+
+def test_indexed_csv_compact(csv_storage):
+    csv_storage.add_movie("Movie A", 2000, 7.0, "http://example.com/a.jpg")
+    csv_storage.add_movie("Movie B", 2001, 8.0, "http://example.com/b.jpg")
+    csv_storage.delete_movie("Movie A")
+    csv_storage.compact()
+    with open(csv_storage.file_path, "r", encoding="utf-8") as f:
+        lines = f.read().splitlines()
+    assert len(lines) == 2
+    csv_storage.update_movie("Movie B", 6.5)
+    assert csv_storage.list_movies()["Movie B"]["rating"] == 6.5
+
+# ---------------------------
+# Tests for StorageSqlite
+# ---------------------------
+@pytest.fixture
+def sqlite_storage(tmp_path):
+    storage = StorageSqlite(str(tmp_path / "movies.db"))
+    yield storage
+    storage.close()
+
+def test_sqlite_crud(sqlite_storage):
+    sqlite_storage.add_movie("Movie A", 2000, 7.0, "http://example.com/a.jpg")
+    sqlite_storage.add_movie("Movie B", 2001, 8.0, "http://example.com/b.jpg")
+    with pytest.raises(ValueError):
+        sqlite_storage.add_movie("Movie A", 2000, 7.0, "")
+    sqlite_storage.update_movie("Movie A", 9.0)
+    sqlite_storage.delete_movie("Movie B")
+    assert sqlite_storage.list_movies() == {
+        "Movie A": {"rating": 9.0, "year": 2000, "poster": "http://example.com/a.jpg"}
+    }
+    with pytest.raises(ValueError):
+        sqlite_storage.update_movie("Movie B", 8.0)
+    with pytest.raises(ValueError):
+        sqlite_storage.delete_movie("Movie B")
+
+def test_sqlite_import_from(sqlite_storage, storage):
+    storage.add_movie("Movie A", 2000, 7.0, "http://example.com/a.jpg")
+    storage.add_movie("Movie B", 2001, 8.0, "http://example.com/b.jpg")
+    assert sqlite_storage.import_from(storage) == 2
+    assert sqlite_storage.import_from(storage) == 0
+    assert sqlite_storage.list_movies() == storage.list_movies()
+
+# ---------------------------
+# Tests for IStorage queries
+# ---------------------------
+def fill_catalog(target):
+    target.add_movie("Movie A", 2000, 7.0, "http://example.com/a.jpg")
+    target.add_movie("Movie B", 1995, 9.0, "http://example.com/b.jpg")
+    target.add_movie("Other C", 2010, 9.0, "http://example.com/c.jpg")
+    target.add_movie("Other D", 1980, 5.5, "http://example.com/d.jpg")
+
+def test_query_fallbacks(storage):
+    fill_catalog(storage)
+    assert list(storage.search_movies("movie")) == ["Movie A", "Movie B"]
+    ranked = [title for title, info in storage.sorted_movies("rating")]
+    assert ranked == ["Movie B", "Other C", "Movie A", "Other D"]
+    assert storage.sorted_movies("year", reverse=False, limit=2, offset=1)[0][0] == "Movie B"
+    stats = storage.movie_stats()
+    assert stats == {"count": 4, "average": 7.625, "median": 8.0,
+                     "best": ("Movie B", 9.0), "worst": ("Other D", 5.5)}
+    assert storage.random_movie()[0] in storage.list_movies()
+
+def test_sqlite_queries_match_fallbacks(sqlite_storage, storage):
+    fill_catalog(storage)
+    fill_catalog(sqlite_storage)
+    assert sqlite_storage.search_movies("OTHER") == storage.search_movies("OTHER")
+    for key in ("rating", "year"):
+        for reverse in (True, False):
+            assert (sqlite_storage.sorted_movies(key, reverse, limit=3, offset=1)
+                    == storage.sorted_movies(key, reverse, limit=3, offset=1))
+    assert sqlite_storage.sorted_movies() == storage.sorted_movies()
+    assert sqlite_storage.movie_stats() == storage.movie_stats()
+    assert sqlite_storage.random_movie()[0] in storage.list_movies()
+    assert StorageSqlite(":memory:").movie_stats() is None
+
+# ---------------------------
+# Tests for OmdbClient
+# ---------------------------
+@pytest.fixture
+def omdb_server():
+    # A local stand-in for the OMDb API that counts the requests it serves.
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            title = parse_qs(urlparse(self.path).query)["t"][0]
+            server.hits.append(title)
+            if title == "Flaky" and server.hits.count(title) == 1:
+                self.send_response(503)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            if title == "Nonexistent":
+                body = {"Response": "False", "Error": "Movie not found!"}
+            else:
+                body = {"Title": title, "Year": "2010", "imdbRating": "8.8",
+                        "Poster": "N/A", "Response": "True"}
+            payload = json.dumps(body).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.hits = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def test_omdb_client_caches_responses(omdb_server, tmp_path):
+    url = f"http://127.0.0.1:{omdb_server.server_port}/"
+    client = OmdbClient("key", base_url=url, cache_dir=str(tmp_path / "cache"))
+    assert client.fetch_movie("Inception")["imdbRating"] == "8.8"
+    assert client.fetch_movie("  inception ")["Title"] == "Inception"
+    assert client.fetch_movie("Nonexistent")["Response"] == "False"
+    assert client.fetch_movie("nonexistent")["Response"] == "False"
+    assert omdb_server.hits == ["Inception", "Nonexistent"]
+    assert (client.cache_hits, client.cache_misses) == (2, 2)
+    # The cache lives on disk, so a new client reuses it.
+    other = OmdbClient("key", base_url=url, cache_dir=str(tmp_path / "cache"))
+    other.fetch_movie("Inception")
+    assert len(omdb_server.hits) == 2
+
+def test_omdb_client_ttl_expiry(omdb_server, tmp_path):
+    url = f"http://127.0.0.1:{omdb_server.server_port}/"
+    client = OmdbClient("key", base_url=url, cache_dir=str(tmp_path / "cache"), ttl=0)
+    client.fetch_movie("Inception")
+    client.fetch_movie("Inception")
+    assert omdb_server.hits == ["Inception", "Inception"]
+
+def test_omdb_client_treats_damaged_cache_entries_as_misses(omdb_server, tmp_path):
+    url = f"http://127.0.0.1:{omdb_server.server_port}/"
+    client = OmdbClient("key", base_url=url, cache_dir=str(tmp_path / "cache"))
+    client.fetch_movie("Inception")
+    path = client._cache_path("inception")
+    for damaged in ('{"title": "inception"}', '{"response": {}, "fetched_at": "yesterday"}',
+                    '{"response": [], "fetched_at": 0}', '[]', '{"respo'):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(damaged)
+        assert client.fetch_movie("Inception")["imdbRating"] == "8.8"
+    assert omdb_server.hits == ["Inception"] * 6
+    # The refetch repaired the entry.
+    assert client.fetch_movie("Inception")["Title"] == "Inception"
+    assert len(omdb_server.hits) == 6
+
+# ---------------------------
+# Tests for bulk import
+# ---------------------------
+def test_read_titles(tmp_path):
+    text_file = tmp_path / "titles.txt"
+    text_file.write_text("Inception\n# comment\n\n  inception \nAlien\n", encoding="utf-8")
+    assert read_titles(str(text_file)) == ["Inception", "Alien"]
+    csv_file = tmp_path / "titles.csv"
+    csv_file.write_text("year,title\n2010,Inception\n1979,Alien\n", encoding="utf-8")
+    assert read_titles(str(csv_file)) == ["Inception", "Alien"]
+
+def test_add_movies_is_all_or_nothing(storage, csv_storage, sqlite_storage):
+    for target in (storage, csv_storage, sqlite_storage):
+        target.add_movie("Movie A", 2000, 7.0, "")
+        with pytest.raises(ValueError):
+            target.add_movies([("Movie B", 2001, 8.0, ""), ("Movie A", 2000, 7.0, "")])
+        target.add_movies([("Movie B", 2001, 8.0, ""), ("Movie C", 2002, 6.0, "")])
+        assert list(target.list_movies()) == ["Movie A", "Movie B", "Movie C"]
+
+def test_bulk_import(omdb_server, storage, tmp_path, monkeypatch):
+    url = f"http://127.0.0.1:{omdb_server.server_port}/"
+    client = OmdbClient("key", base_url=url, cache_dir=str(tmp_path / "cache"))
+    storage.add_movie("Alien", 1979, 8.5, "")
+    saves = []
+    commit = storage._commit
+    def counting_commit(*args):
+        saves.append(args)
+        return commit(*args)
+    monkeypatch.setattr(storage, "_commit", counting_commit)
+    importer = BulkImporter(client, storage, max_workers=4, rate=100, backoff=0.01)
+    report = importer.run(["Inception", "Flaky", "Nonexistent", "Alien"])
+    assert [entry["status"] for entry in report] == ["added", "added", "failed", "skipped"]
+    assert len(saves) == 1
+    assert list(storage.list_movies()) == ["Alien", "Inception", "Flaky"]
+
+def test_token_bucket_limits_rate():
+    bucket = TokenBucket(rate=50, capacity=1)
+    start = time.monotonic()
+    for _ in range(6):
+        bucket.acquire()
+    assert time.monotonic() - start >= 0.09
+
+# ---------------------------
+# Tests for incremental stats
+# ---------------------------
+def test_rating_stats_consistency():
+    movies = {}
+    stats = RatingStats()
+    assert stats.check_consistency(movies)
+    for index, rating in enumerate([7.0, 9.0, 9.0, 5.5, 8.1, 5.5]):
+        movies[f"Movie {index}"] = {"rating": rating}
+        stats.add(f"Movie {index}", rating)
+        assert stats.check_consistency(movies)
+    movies["Movie 1"]["rating"] = 4.0
+    stats.update("Movie 1", 4.0)
+    assert stats.check_consistency(movies)
+    del movies["Movie 2"]
+    stats.remove("Movie 2")
+    assert stats.check_consistency(movies)
+    assert stats.summary() == compute_stats(movies)
+
+def test_storage_stats_are_incremental(temp_storage_file, csv_storage, sqlite_storage):
+    cached = StorageJson(temp_storage_file, cache=True)
+    for target in (cached, csv_storage, sqlite_storage):
+        fill_catalog(target)
+        assert target.movie_stats() == compute_stats(target.list_movies())
+        stats = getattr(target, "_stats", None)
+        target.update_movie("Movie B", 1.0)
+        target.update_movie("Other D", 12345678.25)
+        target.delete_movie("Other C")
+        target.add_movies([("Movie E", 2020, 6.0, "")])
+        # The same statistics object was updated, not rebuilt.
+        assert getattr(target, "_stats", None) is stats
+        assert target.movie_stats() == compute_stats(target.list_movies())
+
+# ---------------------------
+# Tests for title search index
+# ---------------------------
+def test_trigram_index_search():
+    index = TrigramIndex(["The Matrix", "The Matrix Reloaded", "Alien", "Aliens", "Up"])
+    assert index.search("matrix") == ["The Matrix", "The Matrix Reloaded"]
+    assert index.search("LIEN") == ["Alien", "Aliens"]
+    assert index.search("up") == ["Up"]
+    assert index.search("x r") == ["The Matrix Reloaded"]
+    assert index.search("missing") == []
+    index.remove("Alien")
+    index.add("Alien")
+    assert index.search("alien") == ["Aliens", "Alien"]
+    assert index.fuzzy_search("Matirx", limit=1)[0][0] == "The Matrix"
+
+def test_trigram_index_save_and_load(tmp_path):
+    path = str(tmp_path / "titles.trgm")
+    TrigramIndex(["Alien", "Aliens"]).save(path, [1, 2])
+    assert TrigramIndex.load(path, [1, 3]) is None
+    loaded = TrigramIndex.load(path, [1, 2])
+    assert loaded.search("alien") == ["Alien", "Aliens"]
+    assert loaded.fuzzy_search("Alein")[0][0] == "Alien"
+
+def test_storage_search_uses_index(temp_storage_file, csv_storage, storage):
+    cached = StorageJson(temp_storage_file, cache=True)
+    for target in (cached, csv_storage):
+        fill_catalog(target)
+        target.delete_movie("Movie A")
+        target.add_movie("Another Movie", 2005, 6.0, "")
+        assert list(target.search_movies("movie")) == ["Movie B", "Another Movie"]
+        assert target.search_movies("other c") == {
+            "Other C": {"rating": 9.0, "year": 2010, "poster": "http://example.com/c.jpg"}
+        }
+        assert target.suggest_titles("Moive B")[0] == "Movie B"
+    assert os.path.exists(cached.title_index_path)
+
+def test_command_search_movie_suggests(movie_app, storage, monkeypatch, capsys):
+    storage.add_movie("Test Movie", 2000, 7.5, "http://example.com/test.jpg")
+    inputs = iter(["Tset Movie", ""])
+    monkeypatch.setattr("builtins.input", lambda prompt="": next(inputs))
+    movie_app._command_search_movie()
+    captured = capsys.readouterr().out
+    assert "No movies found" in captured
+    assert "Did you mean: Test Movie?" in captured
+
+# ---------------------------
+# Tests for site generation
+# ---------------------------
+def test_site_generator_pages_and_incremental(movie_app, tmp_path):
+    generator = SiteGenerator(movie_app.template_file, movie_app.website_file, per_page=2)
+    movies = [(f"Movie {i}", {"rating": 7.0, "year": 2000 + i, "poster": ""}) for i in range(5)]
+    result = generator.generate(iter(movies))
+    pages = [generator.page_path(n) for n in (1, 2, 3)]
+    assert result == {"written": pages, "unchanged": []}
+    with open(pages[1], "r", encoding="utf-8") as f:
+        content = f.read()
+    assert "Movie 2" in content and "Movie 3" in content and "Movie 4" not in content
+    assert 'href="website.html">Previous' in content and 'href="website_3.html">Next' in content
+    # Only the page whose movies changed is rewritten.
+    movies[4] = ("Movie 4", {"rating": 9.0, "year": 2004, "poster": ""})
+    result = generator.generate(iter(movies))
+    assert result == {"written": [pages[2]], "unchanged": pages[:2]}
+    # Pages that no longer exist are removed.
+    generator.generate(iter(movies[:2]))
+    assert not os.path.exists(pages[1]) and not os.path.exists(pages[2])
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
+
+@pytest.mark.parametrize("buffer_size", [site_generator.PAGE_BUFFER_SIZE, 100])
+def test_site_generator_skips_unchanged_pages_without_writing(movie_app, tmp_path, monkeypatch,
+                                                               buffer_size):
+    monkeypatch.setattr(site_generator, "PAGE_BUFFER_SIZE", buffer_size)
+    generator = SiteGenerator(movie_app.template_file, movie_app.website_file, per_page=2)
+    movies = [(f"Movie {i}", {"rating": 7.0, "year": 2000 + i, "poster": ""}) for i in range(5)]
+    generator.generate(iter(movies))
+    opened = []
+    temp_file = site_generator.temp_file
+    monkeypatch.setattr(site_generator, "temp_file", lambda path: opened.append(path) or temp_file(path))
+    result = generator.generate(iter(movies))
+    assert result["written"] == []
+    # Buffered pages and the manifest are not even written to a temporary file.
+    expected = [] if buffer_size > 1000 else [generator.page_path(n) for n in (1, 2, 3)]
+    assert opened == expected
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
+
+def search_titles(data_dir, word):
+    """
+    Looks up a word prefix the way search.html does and returns the titles.
+    """
+    with open(os.path.join(data_dir, "index.json"), "r", encoding="utf-8") as f:
+        index = json.load(f)
+    if search_key(word) not in index["search"]:
+        return []
+    with open(os.path.join(data_dir, f"search-{search_key(word)}.json"), "r", encoding="utf-8") as f:
+        tokens = json.load(f)
+    titles = []
+    for token, ids in zip(tokens["tokens"], tokens["ids"]):
+        if token.startswith(word):
+            for movie_id in ids:
+                shard = index["shards"][movie_id // index["shard_size"]]
+                with open(os.path.join(data_dir, shard["file"]), "r", encoding="utf-8") as f:
+                    titles.append(json.load(f)[movie_id % index["shard_size"]][0])
+    return sorted(titles)
+
+def test_search_site_shards_and_index(movie_app, storage, tmp_path):
+    storage.add_movies([("The Matrix", 1999, 8.7, "m.jpg"), ("Matrix Reloaded", 2003, 7.2, ""),
+                        ("Alien", 1979, 8.5, ""), ("Été 85", 2020, 6.8, "")])
+    site = SearchSite(movie_app.template_file, str(tmp_path), shard_size=3,
+                      posters={"m.jpg": "posters/m.jpg"})
+    site.generate(storage.list_catalog())
+    data_dir = str(tmp_path / "site_data")
+    with open(os.path.join(data_dir, "index.json"), "r", encoding="utf-8") as f:
+        index = json.load(f)
+    assert index["count"] == 4 and index["search"] == ["8", "_", "a", "m", "r", "t"]
+    assert index["shards"] == [
+        {"file": "movies-0.json", "count": 3, "rating": [7.2, 8.7], "year": [1979, 2003]},
+        {"file": "movies-1.json", "count": 1, "rating": [6.8, 6.8], "year": [2020, 2020]}]
+    with open(os.path.join(data_dir, "movies-0.json"), "r", encoding="utf-8") as f:
+        assert json.load(f)[0] == ["The Matrix", 8.7, 1999, "posters/m.jpg"]
+    assert search_titles(data_dir, "matr") == ["Matrix Reloaded", "The Matrix"]
+    assert search_titles(data_dir, "ét") == ["Été 85"]
+    assert search_titles(data_dir, "x") == []
+    assert title_tokens("The Matrix: the Sequel") == ["matrix", "sequel", "the"]
+    with open(tmp_path / "search.html", "r", encoding="utf-8") as f:
+        page = f.read()
+    assert "__TEMPLATE_MOVIE_GRID__" not in page and "The Matrix" not in page
+    assert 'id="search-form"' in page and "site_data/" in page
+
+def test_search_site_incremental(movie_app, tmp_path):
+    catalog = StorageJson(str(tmp_path / "movies.json"))
+    catalog.add_movies([(f"Movie {i}", 2000 + i, float(i), "") for i in range(5)])
+    site = SearchSite(movie_app.template_file, str(tmp_path), shard_size=2)
+    first = site.generate(catalog.list_catalog())
+    assert first["unchanged"] == []
+    assert site.generate(catalog.list_catalog()) == {"written": [], "unchanged": first["written"]}
+    # Lowering the worst rating only touches the last shard.
+    catalog.update_movie("Movie 0", 0.5)
+    result = site.generate(catalog.list_catalog())
+    assert sorted(os.path.basename(path) for path in result["written"]) == ["index.json", "movies-2.json"]
+    # Shards beyond a smaller catalog are removed.
+    catalog.delete_movie("Movie 4")
+    catalog.delete_movie("Movie 3")
+    site.generate(catalog.list_catalog())
+    assert "movies-2.json" not in os.listdir(tmp_path / "site_data")
+
+def test_movie_card_escapes_html():
+    card = movie_card("<Tom & Jerry>", {"rating": 7.0, "year": 1940})
+    assert "&lt;Tom &amp; Jerry&gt;" in card
+    assert 'src=""' in card
+
+# ---------------------------
+# Tests for the benchmark suite
+# ---------------------------
+def test_benchmark_runs_and_compares():
+    movies = list(synthetic_movies(50))
+    assert len({title for title, year, rating, poster in movies}) == 50
+    results = run_benchmarks([50], ["json", "sqlite"], repeat=1)
+    operations = {entry["operation"] for entry in results}
+    assert {"list_movies", "add_movie", "stats", "generate_website"} <= operations
+    assert all(entry["seconds"] >= 0 and entry["peak_bytes"] >= 0 for entry in results)
+    slower = [{**entry, "seconds": entry["seconds"] * 2 + 0.01} for entry in results]
+    assert compare(results, results) == []
+    assert len(compare(results, slower)) == len(results)
+
+def test_benchmark_main_keeps_the_baseline(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    run = [{"backend": "json", "size": 50, "operation": "add_movie", "seconds": 0.5, "peak_bytes": 0}]
+    monkeypatch.setattr(benchmark, "run_benchmarks", lambda *args: run)
+    assert benchmark.main(["--output", "base.json"]) == 0
+    # A baseline 100 times faster than this run.
+    faster = [{**run[0], "seconds": 0.005}]
+    (tmp_path / "base.json").write_text(json.dumps({"results": faster}), encoding="utf-8")
+    assert benchmark.main(["--compare", "base.json"]) == 1
+    assert "REGRESSION json 50 add_movie" in capsys.readouterr().out
+    assert json.loads((tmp_path / "base.json").read_text(encoding="utf-8"))["results"] == faster
+    assert json.loads((tmp_path / "bench_latest.json").read_text(encoding="utf-8"))["results"] == run
+    with pytest.raises(SystemExit):
+        benchmark.main(["--compare", "base.json", "--output", "./base.json"])
+    assert json.loads((tmp_path / "base.json").read_text(encoding="utf-8"))["results"] == faster
+
+# ---------------------------
+# Tests for instrumentation
+# ---------------------------
+def test_instrumented_storage(temp_storage_file, tmp_path):
+    metrics = Metrics()
+    wrapped = InstrumentedStorage(StorageJson(temp_storage_file, cache=True), metrics)
+    wrapped.add_movie("Movie A", 2000, 7.0, "http://example.com/a.jpg")
+    wrapped.list_movies()
+    with pytest.raises(ValueError):
+        wrapped.delete_movie("Missing")
+    assert [title for title, info in wrapped.iter_movies()] == ["Movie A"]
+    snapshot = metrics.snapshot()
+    calls = {entry["labels"]["method"]: entry["value"]
+             for entry in snapshot["counters"]["storage_calls_total"]}
+    assert calls == {"add_movie": 1, "list_movies": 1, "delete_movie": 1, "iter_movies": 1}
+    assert snapshot["counters"]["storage_errors_total"][0]["labels"] == {"method": "delete_movie"}
+    assert snapshot["counters"]["storage_bytes_written_total"][0]["value"] > 0
+    assert snapshot["gauges"]["storage_cache_hit_ratio"][0]["value"] > 0
+    text = metrics.to_prometheus()
+    assert '# TYPE storage_call_seconds histogram' in text
+    assert 'storage_call_seconds_bucket{method="add_movie",le="+Inf"} 1' in text
+    metrics.write(str(tmp_path / "metrics.json"))
+    with open(tmp_path / "metrics.json", "r", encoding="utf-8") as f:
+        assert "storage_calls_total" in json.load(f)["counters"]
+
+def test_instrumented_omdb_and_profiling(movie_app, storage, monkeypatch, tmp_path):
+    metrics = Metrics()
+    movie_app._omdb = InstrumentedOmdbClient(movie_app._omdb, metrics)
+    monkeypatch.setattr(movie_app._omdb.session, "get", lambda url, params=None, timeout=None: FakeResponse(
+        {"Title": "Inception", "Year": "2010", "imdbRating": "8.8", "Poster": "", "Response": "True"}))
+    movie_app.profile_dir = str(tmp_path / "profiles")
+    inputs = iter(["Inception", "", "", ""])
+    monkeypatch.setattr("builtins.input", lambda prompt="": next(inputs))
+    movie_app._run_command(movie_app._command_add_movie)
+    assert "Inception" in storage.list_movies()
+    fetches = metrics.snapshot()["counters"]["omdb_fetch_total"]
+    assert fetches == [{"labels": {"outcome": "found", "source": "network"}, "value": 1}]
+    assert os.listdir(movie_app.profile_dir)[0].startswith("command_add_movie-")
+    # A second run in the same second gets its own file.
+    movie_app._run_command(movie_app._command_stats)
+    movie_app._run_command(movie_app._command_stats)
+    assert len(os.listdir(movie_app.profile_dir)) == 3
+
+# ---------------------------
+# Tests for the command line
+# ---------------------------
+def test_cli_offline_commands(temp_storage_file, monkeypatch, capsys):
+    monkeypatch.delenv("OMDB_API_KEY", raising=False)
+    StorageJson(temp_storage_file).add_movie("Test Movie", 2000, 7.5, "")
+    assert main.main(["--storage", temp_storage_file, "list"]) == 0
+    assert main.main(["-s", temp_storage_file, "update", "Test Movie", "8.5"]) == 0
+    assert main.main(["-s", temp_storage_file, "stats"]) == 0
+    assert main.main(["-s", temp_storage_file, "delete", "Missing"]) == 1
+    captured = capsys.readouterr().out
+    assert "Test Movie (2000), rating: 7.5" in captured
+    assert "Average rating: 8.50" in captured
+    assert "Movie 'Missing' not found!" in captured
+
+def test_cli_compact_indexed_csv(tmp_path, monkeypatch, capsys):
+    monkeypatch.delenv("OMDB_API_KEY", raising=False)
+    file_path = str(tmp_path / "movies.csv")
+    storage = main.create_storage(file_path)
+    assert storage.indexed
+    storage.add_movies([("Movie A", 2000, 7.0, ""), ("Movie B", 2001, 8.0, "")])
+    assert main.main(["-s", file_path, "delete", "Movie B"]) == 0
+    size = os.path.getsize(file_path)
+    assert main.main(["-s", file_path, "compact"]) == 0
+    assert os.path.getsize(file_path) < size
+    assert list(main.create_storage(file_path).list_movies()) == ["Movie A"]
+    assert main.main(["-s", str(tmp_path / "movies.db"), "compact"]) == 1
+    assert "nothing to compact" in capsys.readouterr().out
+
+def test_cli_script_mode(temp_storage_file, tmp_path, capsys):
+    script = tmp_path / "commands.txt"
+    script.write_text(
+        "# Seeded by cron\n"
+        "update 'Movie A' 9.5\n"
+        "delete \"Other D\"\n"
+        "search other\n"
+        "frobnicate\n"
+        "stats\n",
+        encoding="utf-8",
+    )
+    fill_catalog(StorageJson(temp_storage_file))
+    assert main.main(["-s", temp_storage_file, "script", str(script)]) == 1
+    captured = capsys.readouterr().out
+    assert "Movie 'Movie A' updated to rating 9.5" in captured
+    assert "Other C (2010)" in captured and "Other D (1980)" not in captured
+    assert "cannot parse line 5" in captured
+    assert "Best movie: Movie A with rating 9.5" in captured
+
+def test_offline_import_is_lazy():
+    code = ("import sys, main; main.create_storage(sys.argv[1]); "
+            "print(sorted(m for m in ('requests', 'dotenv', 'omdb_client') if m in sys.modules))")
+    src_dir = os.path.dirname(os.path.abspath(main.__file__))
+    with tempfile.TemporaryDirectory() as directory:
+        output = subprocess.run([sys.executable, "-c", code, os.path.join(directory, "m.json")],
+                                cwd=src_dir, capture_output=True, text=True, check=True).stdout
+    assert output.strip() == "[]"
+
+# ---------------------------
+# Tests for the HTTP API server
+# ---------------------------
+@pytest.fixture(params=["json", "sqlite"])
+def api_server(request, storage, tmp_path):
+    # SQLite connections are tied to their thread unless shared explicitly.
+    if request.param == "sqlite":
+        storage = StorageSqlite(str(tmp_path / "api.db"))
+        request.addfinalizer(storage.close)
+    fill_catalog(storage)
+    server = ApiServer(storage, port=0)
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    asyncio.run_coroutine_threadsafe(server.start(), loop).result()
+    yield server
+    asyncio.run_coroutine_threadsafe(server.close(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
+
+def api_request(connection, method, path, body=None, headers=None):
+    payload = json.dumps(body) if body is not None else None
+    connection.request(method, path, payload, headers or {})
+    response = connection.getresponse()
+    data = response.read()
+    return response, json.loads(data) if data else None
+
+def test_api_server_reads(api_server):
+    connection = http.client.HTTPConnection("127.0.0.1", api_server.port)
+    response, data = api_request(connection, "GET", "/movies")
+    assert response.status == 200 and len(data["movies"]) == 4
+    etag = response.getheader("ETag")
+    response, data = api_request(connection, "GET", "/movies", headers={"If-None-Match": etag})
+    assert response.status == 304 and data is None
+    response, data = api_request(connection, "GET", "/movies/search?q=other")
+    assert sorted(data["movies"]) == ["Other C", "Other D"]
+    response, data = api_request(connection, "GET", "/stats")
+    assert data["stats"]["count"] == 4 and data["stats"]["worst"]["title"] == "Other D"
+    response, data = api_request(connection, "GET", "/movies/Missing")
+    assert response.status == 404
+    connection.close()
+
+def test_api_server_writes(api_server):
+    storage = api_server.storage
+    connection = http.client.HTTPConnection("127.0.0.1", api_server.port)
+    etag = api_request(connection, "GET", "/movies")[0].getheader("ETag")
+    response, data = api_request(connection, "POST", "/movies",
+                                 {"title": "New Movie", "year": 2020, "rating": 6.0})
+    assert response.status == 201
+    response, _ = api_request(connection, "POST", "/movies",
+                              {"title": "New Movie", "year": 2020, "rating": 6.0})
+    assert response.status == 409
+    response, data = api_request(connection, "PATCH", "/movies/Movie%20A", {"rating": 9.5})
+    assert data["Movie A"]["rating"] == 9.5
+    response, _ = api_request(connection, "DELETE", "/movies/Other%20D")
+    assert response.status == 204
+    response, _ = api_request(connection, "DELETE", "/movies/Other%20D")
+    assert response.status == 404
+    response, data = api_request(connection, "GET", "/movies", headers={"If-None-Match": etag})
+    assert response.status == 200 and "New Movie" in data["movies"]
+    movies = storage.list_movies()
+    assert "New Movie" in movies and "Other D" not in movies
+    assert movies["Movie A"]["rating"] == 9.5
+    connection.close()
+
+@pytest.mark.parametrize("length", ["abc", "-5"])
+def test_api_server_rejects_bad_content_length(api_server, length):
+    connection = http.client.HTTPConnection("127.0.0.1", api_server.port)
+    connection.putrequest("POST", "/movies")
+    connection.putheader("Content-Length", length)
+    connection.endheaders()
+    response = connection.getresponse()
+    assert response.status == 400
+    assert json.loads(response.read()) == {"error": "Invalid Content-Length"}
+    connection.close()
+
+# ---------------------------
+# Tests for multi-process safety
+# ---------------------------
+WRITER_SCRIPT = """
+import sys, main
+storage = main.create_storage(sys.argv[1])
+for number in range(int(sys.argv[3])):
+    storage.add_movie(f"Worker {sys.argv[2]} Movie {number}", 2000, 5.0, "")
+"""
+
+@pytest.mark.parametrize("name", ["movies.json", "movies.csv"])
+def test_concurrent_writer_processes(tmp_path, name):
+    file_path = str(tmp_path / name)
+    src_dir = os.path.dirname(os.path.abspath(main.__file__))
+    workers = [subprocess.Popen([sys.executable, "-c", WRITER_SCRIPT, file_path, str(worker), "15"],
+                                cwd=src_dir)
+               for worker in range(4)]
+    assert [worker.wait() for worker in workers] == [0, 0, 0, 0]
+    assert len(main.create_storage(file_path).list_movies()) == 60
+
+def fork_writer(storage, worker, count):
+    for number in range(count):
+        storage.add_movie(f"Worker {worker} Movie {number}", 2000, 5.0, "")
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="needs fork()")
+@pytest.mark.parametrize("name", ["movies.json", "journal.json", "movies.csv", "movies.bin"])
+def test_forked_writer_processes(tmp_path, name):
+    import multiprocessing
+    file_path = str(tmp_path / name)
+    if name == "journal.json":
+        storage = StorageJson(file_path, cache=True, journal=True)
+    else:
+        storage = main.create_storage(file_path)
+    # Created before the fork, so the workers inherit its lock.
+    storage.list_movies()
+    context = multiprocessing.get_context("fork")
+    workers = [context.Process(target=fork_writer, args=(storage, worker, 32)) for worker in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert [worker.exitcode for worker in workers] == [0, 0, 0, 0]
+    if name == "journal.json":
+        reopened = StorageJson(file_path, journal=True)
+    else:
+        reopened = main.create_storage(file_path)
+    assert len(reopened.list_movies()) == 128
+
+def test_corrupted_json_is_not_an_empty_catalog(temp_storage_file):
+    storage = StorageJson(temp_storage_file)
+    storage.add_movie("Movie A", 2000, 7.0, "")
+    with open(temp_storage_file, "r+", encoding="utf-8") as f:
+        f.truncate(20)
+    with pytest.raises(ValueError, match="corrupted"):
+        storage.list_movies()
+    with pytest.raises(ValueError):
+        storage.add_movie("Movie B", 2001, 8.0, "")
+
+def test_write_retries_after_conflict(temp_storage_file, monkeypatch):
+    storage = StorageJson(temp_storage_file, cache=True)
+    other = StorageJson(temp_storage_file)
+    commit = storage._commit
+    calls = []
+    def racing_commit(*args):
+        if not calls:
+            # Another writer sneaks in between our read and our commit.
+            other.add_movie("Other Movie", 1999, 6.0, "")
+        calls.append(args)
+        return commit(*args)
+    monkeypatch.setattr(storage, "_commit", racing_commit)
+    storage.add_movie("Movie A", 2000, 7.0, "")
+    assert len(calls) == 2
+    assert sorted(StorageJson(temp_storage_file).list_movies()) == ["Movie A", "Other Movie"]
+
+def test_version_catches_writes_that_keep_the_stat_signature(csv_storage):
+    csv_storage.add_movie("Movie A", 2000, 7.0, "")
+    assert csv_storage.movie_stats()["average"] == 7.0
+    before = os.stat(csv_storage.file_path)
+    # Another writer patches the row in place and the mtime is restored:
+    # size, inode and mtime all match what csv_storage saw.
+    StorageCsv(csv_storage.file_path, indexed=True).update_movie("Movie A", 8.0)
+    os.utime(csv_storage.file_path, ns=(before.st_atime_ns, before.st_mtime_ns))
+    assert csv_storage.movie_stats()["average"] == 8.0
+
+def test_file_lock_version_survives_reopening(tmp_path):
+    lock = FileLock(str(tmp_path / "x.lock"))
+    with lock.exclusive():
+        assert lock.version() == 0
+        assert lock.bump_version() == 1
+        assert lock.bump_version() == 2
+    assert FileLock(lock.lock_path).version() == 2
+
+def test_file_lock_is_reentrant(tmp_path):
+    lock = FileLock(str(tmp_path / "x.lock"))
+    with lock.shared():
+        with lock.exclusive():
+            assert lock._mode() == "exclusive"
+            with lock.shared():
+                assert lock._mode() == "exclusive"
+        assert lock._mode() == "shared"
+    assert lock._mode() is None
+
+# ---------------------------
+# Tests for the columnar Catalog
+# ---------------------------
+def test_catalog_reads_like_list_movies(storage, csv_storage, sqlite_storage):
+    for target in (storage, csv_storage, sqlite_storage):
+        fill_catalog(target)
+        catalog = target.list_catalog()
+        assert isinstance(catalog, Catalog)
+        assert dict(catalog) == target.list_movies()
+        assert list(catalog) == list(target.list_movies())
+        assert catalog.stats() == compute_stats(target.list_movies())
+        assert catalog.sorted_movies("rating") == IStorageDefaults.sorted_movies(target, "rating")
+        assert catalog.sorted_movies("year", False, limit=2, offset=1) == \
+            IStorageDefaults.sorted_movies(target, "year", False, limit=2, offset=1)
+
+def test_catalog_filter_and_duplicates():
+    catalog = Catalog.from_rows([("Movie A", 7.0, 2000, "a.jpg"), ("Movie B", 9.0, 1995, ""),
+                                 ("Movie A", 8.0, 2001, "a2.jpg")])
+    assert list(catalog) == ["Movie A", "Movie B"]
+    assert catalog["Movie A"] == {"rating": 8.0, "year": 2001, "poster": "a2.jpg"}
+    assert catalog["Movie B"]["poster"] == ""
+    assert list(catalog.filter(min_rating=8.5)) == ["Movie B"]
+    assert list(catalog.filter(min_year=1996, max_rating=8.0)) == ["Movie A"]
+    assert Catalog().stats() is None
+
+def test_catalog_is_smaller_than_dicts():
+    def memory(build):
+        tracemalloc.start()
+        try:
+            result = build((title, rating, year, poster)
+                           for title, year, rating, poster in synthetic_movies(5000))
+            return tracemalloc.get_traced_memory()[0]
+        finally:
+            tracemalloc.stop()
+    dict_size = memory(lambda rows: {t: {"rating": r, "year": y, "poster": p} for t, r, y, p in rows})
+    assert memory(Catalog.from_rows) < dict_size / 2
+
+# ---------------------------
+# Tests for StorageBinary
+# ---------------------------
+@pytest.fixture
+def binary_storage(tmp_path):
+    storage = StorageBinary(str(tmp_path / "movies.bin"))
+    yield storage
+    storage.close()
+
+def test_binary_storage_crud(binary_storage):
+    fill_catalog(binary_storage)
+    with pytest.raises(ValueError):
+        binary_storage.add_movie("Movie A", 2000, 7.0, "")
+    size = os.path.getsize(binary_storage.file_path)
+    binary_storage.update_movie("Movie A", 9.5)
+    binary_storage.delete_movie("Other D")
+    with pytest.raises(ValueError):
+        binary_storage.delete_movie("Other D")
+    assert os.path.getsize(binary_storage.file_path) == size
+    reopened = StorageBinary(binary_storage.file_path)
+    movies = reopened.list_movies()
+    assert list(movies) == ["Movie A", "Movie B", "Other C"]
+    assert movies["Movie A"] == {"rating": 9.5, "year": 2000, "poster": "http://example.com/a.jpg"}
+    assert reopened.movie_stats() == compute_stats(movies)
+    assert reopened.sorted_movies("rating", limit=2) == IStorageDefaults.sorted_movies(reopened, "rating", limit=2)
+    assert reopened.random_movie()[0] in movies
+    reopened.close()
+
+def test_binary_storage_grows_and_compacts(binary_storage):
+    movies = list(synthetic_movies(1500))
+    binary_storage.add_movies(movies[:1000])
+    binary_storage.add_movies(movies[1000:])
+    for title, year, rating, poster in movies[:1200]:
+        binary_storage.delete_movie(title)
+    before = os.path.getsize(binary_storage.file_path)
+    binary_storage.compact()
+    assert os.path.getsize(binary_storage.file_path) < before
+    listed = binary_storage.list_movies()
+    assert list(listed) == [title for title, year, rating, poster in movies[1200:]]
+    assert listed[movies[-1][0]]["poster"] == movies[-1][3]
+
+def test_binary_storage_flushes_records_before_header(binary_storage):
+    flushes = []
+    class RecordingMap(bytearray):
+        def flush(self):
+            flushes.append(bytes(self))
+    m = RecordingMap(HEADER_SIZE + 64)
+    m[HEADER_SIZE:HEADER_SIZE + 4] = b"data"
+    binary_storage._publish(m, 1, 1, 1, 4, 7)
+    # The records are on disk while the header still shows the old state.
+    assert flushes[0] == bytes(HEADER_SIZE) + m[HEADER_SIZE:]
+    assert HEADER.unpack_from(flushes[1], 0)[3:] == (1, 1, 1, 4, 7)
+
+def test_binary_batch_commits_only_through_the_header(binary_storage):
+    fill_catalog(binary_storage)
+    path = binary_storage.file_path
+    before = binary_storage.list_movies()
+    movies = list(synthetic_movies(1500))
+    def counts_on_disk():
+        with open(path, "rb") as f:
+            return HEADER.unpack(f.read(HEADER.size))[3:5]
+    with pytest.raises(RuntimeError):
+        with binary_storage.batch():
+            # Outgrows the file, which is moved to a bigger one mid-batch.
+            binary_storage.add_movies(movies)
+            binary_storage.update_movie("Movie A", 1.0)
+            capacity, count = counts_on_disk()
+            assert capacity >= 1504 and count == 4
+            assert len(binary_storage.list_movies()) == 1504
+            raise RuntimeError
+    reopened = StorageBinary(path)
+    assert reopened.list_movies() == binary_storage.list_movies() == before
+    with binary_storage.batch():
+        binary_storage.add_movies(movies)
+        assert counts_on_disk()[1] == 4
+    assert counts_on_disk()[1] == 1504
+    assert len(reopened.list_movies()) == 1504
+    reopened.close()
+
+def test_binary_storage_converters(binary_storage, storage, tmp_path):
+    fill_catalog(storage)
+    assert binary_storage.import_from(storage) == 4
+    assert binary_storage.import_from(storage) == 0
+    target = StorageCsv(str(tmp_path / "out.csv"))
+    binary_storage.export_to(target)
+    assert target.list_movies() == storage.list_movies() == binary_storage.list_movies()
+
+def test_binary_storage_rejects_other_files(temp_storage_file):
+    with pytest.raises(ValueError):
+        StorageBinary(temp_storage_file).list_movies()
+
+# ---------------------------
+# Tests for the sorted indexes
+# ---------------------------
+def test_sorted_index_pages_and_ranges():
+    index = SortedIndex.from_items([("A", 7.0), ("B", 9.0), ("C", 9.0), ("D", 5.5)])
+    index.add("E", 7.0)
+    assert list(index.iter_sorted(reverse=True)) == ["B", "C", "A", "E", "D"]
+    assert index.page(limit=2, offset=1, reverse=True) == ["C", "A"]
+    assert index.page(limit=2) == ["D", "A"]
+    assert list(index.range(7.0, 9.0)) == ["A", "E", "B", "C"]
+    assert index.count(high=7.0) == 3
+    index.update("A", 10.0)
+    index.remove("B")
+    assert index.page(limit=1, reverse=True) == ["A"]
+    assert list(index.range(low=9.5)) == ["A"]
+    # Pages starting inside a run of equal values match the full order.
+    index = SortedIndex.from_items((f"T{i}", i % 4) for i in range(30))
+    ranked = list(index.iter_sorted(reverse=True))
+    for offset in range(32):
+        assert index.page(limit=5, offset=offset, reverse=True) == ranked[offset:offset + 5]
+    assert index.page(offset=29, reverse=True) == ranked[29:]
+
+def test_range_queries_and_pages_match_across_backends(temp_storage_file, csv_storage,
+                                                       sqlite_storage, binary_storage):
+    cached = StorageJson(temp_storage_file, cache=True)
+    for target in (cached, csv_storage, sqlite_storage, binary_storage):
+        fill_catalog(target)
+        target.add_movie("Movie E", 1995, 7.0, "")
+        # Warm the indexes, then change the catalog under them.
+        target.sorted_movies("rating", limit=1)
+        target.movies_in_range(min_year=1990)
+        target.update_movie("Movie A", 1234567.125)
+        target.delete_movie("Movie B")
+        target.add_movie("Movie F", 1999, 9.0, "")
+        movies = target.list_movies()
+        assert target.movies_in_range(7.0, 9.0, 1990, 1999) == {
+            title: movies[title] for title in ("Movie E", "Movie F")}
+        assert target.movies_in_range(min_rating=9.0) == IStorageDefaults.movies_in_range(target, 9.0)
+        for key in ("rating", "year"):
+            for reverse in (True, False):
+                assert target.sorted_movies(key, reverse, limit=3, offset=1) == \
+                    IStorageDefaults.sorted_movies(target, key, reverse, limit=3, offset=1)
+        assert target.sorted_movies() == IStorageDefaults.sorted_movies(target)
+
+def test_command_sorted_by_rating_pages(movie_app, storage, monkeypatch, capsys):
+    fill_catalog(storage)
+    movie_app.sorted_page_size = 3
+    inputs = iter(["", ""])
+    monkeypatch.setattr("builtins.input", lambda prompt="": next(inputs))
+    movie_app._command_sorted_by_rating()
+    captured = capsys.readouterr().out
+    assert captured.index("Movie B") < captured.index("Movie A") < captured.index("Other D")
+
+def test_command_sorted_by_rating_sorts_once_when_not_interactive(tmp_path, capsys):
+    storage = StorageCsv(str(tmp_path / "movies.csv"))
+    storage.add_movies([(f"Movie {i}", 2000, float(i % 7), "") for i in range(10)])
+    app = MovieApp(storage, interactive=False)
+    app.sorted_page_size = 3
+    calls = []
+    sorted_movies = storage.sorted_movies
+    storage.sorted_movies = lambda *args, **kwargs: calls.append(kwargs) or sorted_movies(*args, **kwargs)
+    storage.bytes_read = 0
+    app._command_sorted_by_rating()
+    lines = capsys.readouterr().out.splitlines()[2:]
+    assert len(calls) == 1 and storage.bytes_read == os.path.getsize(storage.file_path)
+    assert lines == [f"{title} ({info['year']}): {info['rating']}"
+                     for title, info in IStorageDefaults.sorted_movies(storage)]
+
+def test_command_filter_movies(movie_app, storage, monkeypatch, capsys):
+    fill_catalog(storage)
+    inputs = iter(["6", "", "1990", "2005", ""])
+    monkeypatch.setattr("builtins.input", lambda prompt="": next(inputs))
+    movie_app._command_filter_movies()
+    captured = capsys.readouterr().out
+    assert "Movie A (2000)" in captured and "Movie B (1995)" in captured
+    assert "Other C" not in captured and "Other D" not in captured
+
+# ---------------------------
+# Tests for the streaming converter
+# ---------------------------
+def test_convert_round_trip(storage, temp_storage_file, tmp_path, monkeypatch):
+    # Tiny chunks make every token straddle a chunk boundary.
+    monkeypatch.setattr(convert, "CHUNK_SIZE", 7)
+    fill_catalog(storage)
+    storage.add_movie('Multi\n"Line", Title', 2001, 6.25, "http://p.jpg")
+    csv_path, json_path = str(tmp_path / "m.csv"), str(tmp_path / "m.json")
+    assert convert.convert(temp_storage_file, csv_path) == {"read": 5, "written": 5, "bad": 0}
+    assert convert.convert(csv_path, json_path)["written"] == 5
+    assert StorageCsv(csv_path).list_movies() == storage.list_movies()
+    with open(json_path, encoding="utf-8") as f:
+        assert json.load(f) == {"movies": storage.list_movies()}
+    db_path = str(tmp_path / "m.db")
+    assert convert.convert(json_path, db_path)["written"] == 5
+    assert StorageSqlite(db_path).list_movies() == storage.list_movies()
+    # Movies the database already has are reported, not added twice.
+    assert convert.convert(json_path, db_path) == {"read": 5, "written": 0, "bad": 5}
+
+def test_convert_reports_bad_rows(tmp_path, capsys):
+    source = tmp_path / "bad.csv"
+    source.write_text('title,rating,year,poster\n'
+                      '"Two\nLines",7.0,2000,\n'
+                      'Bad Rating,n/a,1999,\n'
+                      ',,,\n'
+                      'Bad Year,5.0,,\n', encoding="utf-8")
+    target = str(tmp_path / "out.json")
+    assert main.main(["convert", str(source), target]) == 1
+    captured = capsys.readouterr()
+    assert f"{source}:4: 'Bad Rating': invalid rating 'n/a'" in captured.err
+    assert f"{source}:6: 'Bad Year': invalid year ''" in captured.err
+    assert "Wrote 3 of 3 movies" in captured.out
+    # Bad numbers are written as 0, the way StorageCsv reads them.
+    assert StorageJson(target).list_movies()["Bad Rating"]["rating"] == 0.0
+    broken = tmp_path / "broken.json"
+    broken.write_text('{"movies": {\n  "A": {"year": 1},\n  "B": {oops}}}', encoding="utf-8")
+    assert main.main(["convert", str(broken), str(tmp_path / "x.csv")]) == 1
+    assert "Invalid JSON at line 3" in capsys.readouterr().err
+    assert not os.path.exists(tmp_path / "x.csv")
+
+def test_convert_uses_constant_memory(tmp_path):
+    source = tmp_path / "big.json"
+    with open(source, "w", encoding="utf-8") as f:
+        json.dump({"movies": {title: {"year": year, "rating": rating, "poster": poster}
+                              for title, year, rating, poster in synthetic_movies(20000)},
+                   "version": 1}, f, indent=4)
+    tracemalloc.start()
+    try:
+        counts = convert.convert(str(source), str(tmp_path / "big.csv"))
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert counts["written"] == 20000
+    assert peak < os.path.getsize(source) / 4
+
+# ---------------------------
+# Tests for batch()
+# ---------------------------
+def batch_targets(tmp_path):
+    return [StorageJson(str(tmp_path / "plain.json")),
+            StorageJson(str(tmp_path / "journal.json"), cache=True, journal=True),
+            StorageCsv(str(tmp_path / "plain.csv")),
+            StorageCsv(str(tmp_path / "indexed.csv"), indexed=True),
+            StorageSqlite(str(tmp_path / "movies.db")),
+            StorageBinary(str(tmp_path / "movies.bin"))]
+
+def reopen(target):
+    if isinstance(target, StorageJson):
+        return StorageJson(target.file_path, journal=target.journal)
+    return main.create_storage(target.file_path)
+
+def test_compact_refuses_to_run_inside_batch(tmp_path):
+    for target in batch_targets(tmp_path):
+        if not hasattr(target, "compact"):
+            continue
+        fill_catalog(target)
+        with pytest.raises(RuntimeError):
+            with target.batch():
+                target.add_movie("Movie E", 2020, 6.0, "")
+                with pytest.raises(ValueError, match="inside batch"):
+                    target.compact()
+                raise RuntimeError
+        assert "Movie E" not in reopen(target).list_movies()
+        target.compact()
+
+def test_batch_commits_all_changes(tmp_path):
+    for target in batch_targets(tmp_path):
+        fill_catalog(target)
+        with target.batch():
+            target.add_movie("Movie E", 2020, 6.0, "")
+            target.update_movie("Movie A", 8.0)
+            target.delete_movie("Other D")
+            with pytest.raises(ValueError):
+                target.add_movie("Movie B", 1995, 9.0, "")
+            with pytest.raises(ValueError):
+                target.delete_movie("Other D")
+            with target.batch():
+                target.update_movie("Movie E", 6.5)
+            # Reads inside the batch see its changes.
+            assert list(target.list_movies()) == ["Movie A", "Movie B", "Other C", "Movie E"]
+            assert list(target.search_movies("movie")) == ["Movie A", "Movie B", "Movie E"]
+            assert target.movie_stats()["count"] == 4
+        expected = {"Movie A": 8.0, "Movie B": 9.0, "Other C": 9.0, "Movie E": 6.5}
+        for reader in (target, reopen(target)):
+            assert {title: info["rating"] for title, info in reader.list_movies().items()} == expected
+
+def test_batch_rolls_back_on_error(tmp_path):
+    for target in batch_targets(tmp_path):
+        fill_catalog(target)
+        before = {title: dict(info) for title, info in target.list_movies().items()}
+        with pytest.raises(RuntimeError):
+            with target.batch():
+                # Enough movies to make StorageBinary grow its file.
+                target.add_movies(list(synthetic_movies(1100)))
+                target.update_movie("Movie A", 1.0)
+                target.delete_movie("Movie B")
+                raise RuntimeError("abort")
+        assert target.list_movies() == before
+        assert target.movie_stats() == compute_stats(before)
+        assert reopen(target).list_movies() == before
+        # The storage is usable again afterwards.
+        target.add_movie("Movie E", 2020, 6.0, "")
+        assert "Movie E" in reopen(target).list_movies()
+
+def test_batch_writes_once_and_replays_on_conflict(temp_storage_file, monkeypatch):
+    target = StorageJson(temp_storage_file, cache=True)
+    fill_catalog(target)
+    commits = []
+    commit = target._commit
+    monkeypatch.setattr(target, "_commit", lambda *args: commits.append(args) or commit(*args))
+    with target.batch():
+        for number in range(50):
+            target.add_movie(f"New {number}", 2000, 5.0, "")
+        # Another writer commits while the batch is open.
+        StorageJson(temp_storage_file).add_movie("Outside", 1999, 6.0, "")
+    # The first commit lost the race; the replay on fresh data won.
+    assert len(commits) == 2
+    movies = StorageJson(temp_storage_file).list_movies()
+    assert "Outside" in movies and "New 49" in movies
+    with pytest.raises(ValueError):
+        with target.batch():
+            target.update_movie("Outside", 9.0)
+            StorageJson(temp_storage_file).delete_movie("Outside")
+    assert "Outside" not in target.list_movies()
+
+@pytest.mark.parametrize("indexed", [False, True])
+def test_csv_batch_keeps_other_threads_out(tmp_path, indexed):
+    file_path = str(tmp_path / "movies.csv")
+    storage = StorageCsv(file_path, indexed=indexed)
+    other = threading.Thread(target=storage.add_movie, args=("Other", 1999, 6.0, ""))
+    with storage.batch():
+        storage.add_movie("Batched", 2000, 7.0, "")
+        other.start()
+        other.join(0.2)
+        # The other thread waits for the batch instead of joining it.
+        assert other.is_alive() and "Other" not in storage.list_movies()
+    other.join()
+    assert sorted(StorageCsv(file_path).list_movies()) == ["Batched", "Other"]
+
+class DictStorage(IStorageDefaults):
+    """
+    A minimal backend that implements no batching of its own.
+    """
+    def __init__(self):
+        self.movies = {}
+
+    def list_movies(self):
+        return self.movies
+
+    def add_movie(self, title, year, rating, poster):
+        self.movies[title] = {"rating": rating, "year": year, "poster": poster}
+
+    def delete_movie(self, title):
+        del self.movies[title]
+
+    def update_movie(self, title, rating):
+        self.movies[title]["rating"] = rating
+
+def test_batch_without_backend_support_writes_as_it_goes(capsys):
+    storage = DictStorage()
+    fill_catalog(storage)
+    with pytest.raises(RuntimeError):
+        with storage.batch():
+            storage.update_movie("Movie A", 9.5)
+            raise RuntimeError
+    # Nothing was collected, so nothing is rolled back.
+    assert storage.movies["Movie A"]["rating"] == 9.5
+    main.run_script(MovieApp(storage, interactive=False), ["delete 'Other D'", "stats"])
+    assert "Other D" not in storage.movies
+    assert "Best movie: Movie A with rating 9.5" in capsys.readouterr().out
+
+# ---------------------------
+# Tests for the rating refresh
+# ---------------------------
+def test_rating_refresh(omdb_server, storage, tmp_path, monkeypatch):
+    url = f"http://127.0.0.1:{omdb_server.server_port}/"
+    client = OmdbClient("key", base_url=url, cache_dir=str(tmp_path / "cache"))
+    storage.add_movies([("Alien", 1979, 8.5, ""), ("Inception", 2010, 8.8, ""),
+                        ("Nonexistent", 2000, 5.0, ""), ("Flaky", 2001, 6.0, "")])
+    commits = []
+    commit = storage._commit
+    monkeypatch.setattr(storage, "_commit", lambda *args: commits.append(args) or commit(*args))
+    now = [1000.0]
+    state = str(tmp_path / "refreshed.json")
+    refresher = RatingRefresher(client, storage, state, budget=3, max_workers=1, backoff=0,
+                                clock=lambda: now[0])
+    report = refresher.run()
+    assert [(entry["title"], entry["status"]) for entry in report] == [
+        ("Alien", "updated"), ("Inception", "unchanged"), ("Nonexistent", "failed")]
+    assert len(commits) == 1
+    assert storage.list_movies()["Alien"]["rating"] == 8.8
+    assert load_timestamps(state) == {"Alien": 1000.0, "Inception": 1000.0, "Nonexistent": 1000.0}
+    # Never-fetched titles go first; the retry of Flaky counts against the budget.
+    now[0] = 1010.0
+    report = refresher.run()
+    assert [(entry["title"], entry["status"]) for entry in report] == [
+        ("Flaky", "updated"), ("Alien", "unchanged"), ("Inception", "skipped")]
+    assert storage.list_movies()["Flaky"]["rating"] == 8.8
+    assert refresher.stale_titles(storage.list_movies(), load_timestamps(state), max_age=5) == [
+        "Inception", "Nonexistent"]
+    # Ratings are always fetched fresh, never from the response cache.
+    assert omdb_server.hits.count("Alien") == 2
+    report = refresher.run(max_age=5)
+    assert [(entry["title"], entry["status"]) for entry in report] == [
+        ("Inception", "unchanged"), ("Nonexistent", "failed")]
+    # Nothing changed, so nothing was written.
+    assert len(commits) == 2
+
+def test_command_refresh_ratings(omdb_server, movie_app, storage, temp_storage_file, tmp_path, monkeypatch, capsys):
+    url = f"http://127.0.0.1:{omdb_server.server_port}/"
+    movie_app._omdb = OmdbClient("key", base_url=url, cache_dir=str(tmp_path / "cache"))
+    movie_app.interactive = False
+    storage.add_movie("Alien", 1979, 8.5, "")
+    # An explicit budget of 0 makes no requests.
+    movie_app._command_refresh_ratings(budget=0)
+    assert omdb_server.hits == []
+    assert "Refreshed 0 movies" in capsys.readouterr().out
+    movie_app._command_refresh_ratings()
+    assert "updated: Alien (8.5 -> 8.8)" in capsys.readouterr().out
+    assert list(load_timestamps(temp_storage_file + ".refreshed.json")) == ["Alien"]
+    with pytest.raises(SystemExit):
+        main.build_parser().parse_args(["refresh", "--budget", "-1"])
+    with pytest.raises(ValueError, match="negative"):
+        RatingRefresher(movie_app._omdb, storage, str(tmp_path / "state.json"), budget=-1)
+
+# ---------------------------
+# Tests for poster mirroring
+# ---------------------------
+@pytest.fixture
+def poster_server():
+    # Serves /a.jpg with an ETag and /b.jpg, the same image, with a
+    # Last-Modified date; server.images can be edited by the test.
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            image = server.images.get(self.path)
+            if image is None:
+                status, body, headers = 404, b"", {}
+            else:
+                body, headers = image
+                fresh = (headers.get("ETag") and self.headers.get("If-None-Match") == headers.get("ETag")) or \
+                        (headers.get("Last-Modified") and self.headers.get("If-Modified-Since") == headers.get("Last-Modified"))
+                status, body = (304, b"") if fresh else (200, body)
+            server.hits.append((self.path, status))
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.hits = []
+    server.images = {"/a.jpg": (b"image-a", {"ETag": '"a1"'}),
+                     "/b.jpg": (b"image-a", {"Last-Modified": "Wed, 21 Oct 2015 07:28:00 GMT"})}
+    server.url = f"http://127.0.0.1:{server.server_port}"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def test_poster_mirror(poster_server, tmp_path):
+    a, b, missing = (poster_server.url + path for path in ("/a.jpg", "/b.jpg", "/missing.jpg"))
+    cache_dir = str(tmp_path / "posters")
+    mirror = PosterMirror(cache_dir, max_workers=4)
+    files = mirror.mirror([a, b, missing, "N/A", "", a])
+    # Both URLs serve the same bytes, which are stored once.
+    assert files == {a: hashlib.sha256(b"image-a").hexdigest() + ".jpg", b: files[a]}
+    assert (mirror.downloaded, mirror.not_modified, mirror.failed) == (2, 0, 1)
+    assert sorted(os.listdir(cache_dir)) == [files[a], "manifest.json"]
+    # A later run revalidates instead of downloading again.
+    poster_server.hits.clear()
+    again = PosterMirror(cache_dir)
+    assert again.mirror([a, b]) == files
+    assert (again.downloaded, again.not_modified) == (0, 2)
+    assert sorted(poster_server.hits) == [("/a.jpg", 304), ("/b.jpg", 304)]
+    # A changed image gets a new file; the old one goes once unused.
+    poster_server.images["/a.jpg"] = (b"image-a2", {"ETag": '"a2"'})
+    changed = again.mirror([a])
+    assert changed[a] == hashlib.sha256(b"image-a2").hexdigest() + ".jpg"
+    assert sorted(os.listdir(cache_dir)) == sorted([changed[a], "manifest.json"])
+
+def test_command_generate_website_mirrors_posters(poster_server, movie_app, storage, monkeypatch):
+    storage.add_movie("Movie A", 2000, 7.0, poster_server.url + "/a.jpg")
+    storage.add_movie("Movie B", 2001, 8.0, poster_server.url + "/missing.jpg")
+    monkeypatch.setattr("builtins.input", lambda prompt="": "")
+    movie_app.mirror_posters = True
+    movie_app._command_generate_website()
+    with open(movie_app.website_file, "r", encoding="utf-8") as f:
+        content = f.read()
+    assert f'src="posters/{hashlib.sha256(b"image-a").hexdigest()}.jpg"' in content
+    # Posters that could not be fetched stay remote.
+    assert f'src="{poster_server.url}/missing.jpg"' in content